@@ -27,6 +27,11 @@ and more.
 """
 # Core API
 from agt.alexa_gadget import AlexaGadget
+from agt.async_alexa_gadget import AsyncAlexaGadget
+from agt.directive_executor import DirectiveExecutor
+from agt.metrics import GadgetMetrics, MetricsRegistry
+from agt.tracing import Tracer
+from agt.capture import CaptureReader, CaptureWriter
 
 # Directives
 from agt.messages_pb2 import Directive
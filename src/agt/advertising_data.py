@@ -0,0 +1,151 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+import functools
+import logging.config
+import struct
+
+logger = logging.getLogger(__name__)
+
+"""
+AD types
+https://www.bluetooth.com/specifications/assigned-numbers/generic-access-profile/
+"""
+AD_TYPE_FLAGS = 0x01
+AD_TYPE_COMPLETE_16BIT_UUIDS = 0x03
+AD_TYPE_INCOMPLETE_128BIT_UUIDS = 0x06
+AD_TYPE_COMPLETE_128BIT_UUIDS = 0x07
+AD_TYPE_SHORTENED_LOCAL_NAME = 0x08
+AD_TYPE_COMPLETE_LOCAL_NAME = 0x09
+AD_TYPE_SERVICE_DATA_16BIT = 0x16
+AD_TYPE_MANUFACTURER_DATA = 0xFF
+
+FLAG_LE_GENERAL_DISCOVERABLE = 0x02
+FLAG_BR_EDR_NOT_SUPPORTED = 0x04
+
+# Maximum size of the LE advertising or scan response data, and of the extended inquiry response
+ADV_DATA_SIZE = 31
+EIR_SIZE = 240
+
+_UUID16 = struct.Struct('<H')
+
+
+class AdvertisingData:
+    """
+    Builds advertising, scan response or extended inquiry response data out of AD structures:
+
+    |LENGTH|AD TYPE|DATA...|
+
+    The add methods can be chained, build() checks the size and returns the data as bytes.
+    """
+
+    def __init__(self, max_size=ADV_DATA_SIZE):
+        """
+        :param max_size: ADV_DATA_SIZE for LE advertising and scan response data, EIR_SIZE for an EIR.
+        """
+        self.max_size = max_size
+        self._data = bytearray()
+
+    def add(self, ad_type, data):
+        data = bytes(data)
+        if len(data) > 0xFE:
+            raise Exception('AD structure 0x{:02x} is {} bytes, the maximum is 254'.format(ad_type, len(data)))
+        self._data += bytes([1 + len(data), ad_type]) + data
+        return self
+
+    def add_flags(self, flags):
+        return self.add(AD_TYPE_FLAGS, [flags])
+
+    def add_uuid16_list(self, uuids):
+        return self.add(AD_TYPE_COMPLETE_16BIT_UUIDS, b''.join(_UUID16.pack(uuid) for uuid in uuids))
+
+    def add_uuid128_list(self, uuids, complete=True):
+        """
+        :param uuids: 128 bit UUIDs, each as the 16 bytes sent over the air.
+        :param complete: Whether the list holds all the services of the device.
+        """
+        ad_type = AD_TYPE_COMPLETE_128BIT_UUIDS if complete else AD_TYPE_INCOMPLETE_128BIT_UUIDS
+        return self.add(ad_type, b''.join(bytes(uuid) for uuid in uuids))
+
+    def add_local_name(self, name):
+        """
+        Adds the complete local name, or the shortened local name truncated to the space left if it doesn't fit.
+        """
+        encoded = name.encode('utf-8')
+        # length and AD type bytes
+        space = self.max_size - len(self._data) - 2
+        if len(encoded) <= space:
+            return self.add(AD_TYPE_COMPLETE_LOCAL_NAME, encoded)
+        # cut on a character boundary
+        shortened = encoded[:max(space, 0)].decode('utf-8', 'ignore').encode('utf-8')
+        logger.warning('Name {} is {} bytes, only {} fit in the advertising data: advertising {} as shortened name'
+                       .format(name, len(encoded), max(space, 0), shortened.decode('utf-8')))
+        return self.add(AD_TYPE_SHORTENED_LOCAL_NAME, shortened)
+
+    def add_service_data(self, uuid, data):
+        return self.add(AD_TYPE_SERVICE_DATA_16BIT, _UUID16.pack(uuid) + bytes(data))
+
+    def add_manufacturer_data(self, data):
+        """
+        :param data: Company identifier followed by the manufacturer specific data.
+        """
+        return self.add(AD_TYPE_MANUFACTURER_DATA, data)
+
+    def build(self):
+        if len(self._data) > self.max_size:
+            raise Exception('Advertising data is {} bytes, the maximum is {}'.format(len(self._data), self.max_size))
+        return bytes(self._data)
+
+
+"""
+Alexa Gadget frames, built once per configuration
+https://developer.amazon.com/docs/alexa-gadgets-toolkit/bluetooth-le-settings.html
+"""
+GADGET_SERVICE_UUID16 = 0xFE03
+# Amazon SIG vendor id, little endian, followed by the Alexa Gadget identifiers
+_GADGET_MANUFACTURER_DATA_SUFFIX = bytes.fromhex('7101' + '101515fe')
+# Alexa Gadget service UUID of the Classic EIR, as sent over the air
+_GADGET_CLASSIC_SERVICE_UUID = bytes.fromhex('B7166825D15A949FED4E3A98B3D28860')
+
+
+@functools.lru_cache(maxsize=None)
+def ble_adv_data(service_data, include_service_uuid):
+    """
+    LE advertising data of the gadget.
+
+    :param service_data: Alexa Gadget service data.
+    :param include_service_uuid: List the Alexa Gadget service, only when pairing.
+    """
+    adv_data = AdvertisingData().add_flags(FLAG_LE_GENERAL_DISCOVERABLE | FLAG_BR_EDR_NOT_SUPPORTED)
+    if include_service_uuid:
+        adv_data.add_uuid16_list([GADGET_SERVICE_UUID16])
+    return adv_data.add_service_data(GADGET_SERVICE_UUID16, service_data).build()
+
+
+@functools.lru_cache(maxsize=None)
+def ble_scan_resp_data(name):
+    """
+    LE scan response data holding the local name of the gadget, shortened if it doesn't fit.
+    """
+    return AdvertisingData().add_local_name(name).build()
+
+
+@functools.lru_cache(maxsize=None)
+def classic_eir(name, vendor_id, product_id):
+    """
+    Extended inquiry response of the gadget.
+
+    :param name: Friendly name.
+    :param vendor_id: Bluetooth vendor id, as 4 hex digits.
+    :param product_id: Bluetooth product id, as 4 hex digits.
+    """
+    # the name goes last, to be shortened to the space left if it is too long
+    return AdvertisingData(EIR_SIZE) \
+        .add_uuid128_list([_GADGET_CLASSIC_SERVICE_UUID], complete=False) \
+        .add_manufacturer_data(bytes.fromhex(vendor_id + product_id) + _GADGET_MANUFACTURER_DATA_SUFFIX) \
+        .add_local_name(name) \
+        .build()
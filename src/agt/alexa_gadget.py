@@ -16,13 +16,14 @@ import signal
 import sys
 import time
 from os import path
-from threading import Thread
+from threading import Event, Thread
 
 from google.protobuf import json_format
+from google.protobuf.message import DecodeError
+from google.protobuf.internal import api_implementation
 
 import agt.messages_pb2 as proto
-from agt.bt_classic.adapter import BluetoothAdapter
-from agt.ble.adapter import BluetoothLEAdapter
+from agt.util import LazyFormat
 
 global_config_path = path.join(path.join(path.dirname(path.dirname(path.abspath(__file__)))), '.agt.json')
 logger = logging.getLogger(__name__)
@@ -48,6 +49,7 @@ _MANUFACTURER_NAME = 'manufacturerName'
 _DESCRIPTION = 'description'
 _VENDOR_ID = 'bluetoothVendorID'
 _PRODUCT_ID = 'bluetoothProductID'
+_BLE_ADVERTISING = 'bleAdvertising'
 
 # Default values
 _DEFAULT_VENDOR_ID = 'FFFF'
@@ -57,43 +59,170 @@ _DEFAULT_DEVICE_TOKEN_ENCRYPTION_TYPE = '1'
 _DEFAULT_FIRMWARE_VERSION = '1'
 _DEFAULT_MANUFACTURER_NAME = 'AGT'
 _DEFAULT_DESCRIPTION = 'Alexa Gadget'
+_DEFAULT_BLE_ADVERTISING = 'hci'
 
 # Transport modes
 BLE = "BLE"
 BT = "BT"
+# Loopback to a VirtualEcho in the same process, with the BLE or the Classic Bluetooth framing
+LOOPBACK_BLE = "LOOPBACK_BLE"
+LOOPBACK_BT = "LOOPBACK_BT"
+_LOOPBACK_MODES = (LOOPBACK_BLE, LOOPBACK_BT)
 # ------------------------------------------------
 
 
+def _find_directive_classes():
+    """
+    Maps the (namespace, name) of each directive to its proto class, e.g.
+    ('Alexa.Gadget.SpeechData', 'Speechmarks') to proto.SpeechmarksDirective
+    """
+    directive_classes = {}
+    for class_name, proto_class in vars(proto).items():
+        if not class_name.endswith('Directive') or not hasattr(proto_class, 'DESCRIPTOR'):
+            continue
+        options = proto_class.DESCRIPTOR.GetOptions()
+        if options.HasExtension(proto.namespace):
+            directive_classes[(options.Extensions[proto.namespace], class_name[:-len('Directive')])] = proto_class
+    return directive_classes
+
+
+_DIRECTIVE_CLASSES = _find_directive_classes()
+
+# The wire format scan is only cheaper than parsing a generic Directive with the pure python protobuf
+_PEEK_WIRE_FORMAT = api_implementation.Type() == 'python'
+
+# Protocol buffers wire types
+_WIRE_VARINT = 0
+_WIRE_FIXED64 = 1
+_WIRE_LENGTH_DELIMITED = 2
+_WIRE_FIXED32 = 5
+
+
+def _read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _read_fields(data, start, end):
+    """
+    Iterates over the fields of the protocol buffers message in data[start:end].
+
+    :return: (field number, wire type, value), the value of a length delimited field is its (start, end) in data.
+    """
+    pos = start
+    while pos < end:
+        tag, pos = _read_varint(data, pos)
+        wire_type = tag & 0x07
+        if wire_type == _WIRE_VARINT:
+            value, pos = _read_varint(data, pos)
+        elif wire_type == _WIRE_LENGTH_DELIMITED:
+            length, pos = _read_varint(data, pos)
+            value = (pos, pos + length)
+            pos += length
+        elif wire_type == _WIRE_FIXED64:
+            value = None
+            pos += 8
+        elif wire_type == _WIRE_FIXED32:
+            value = None
+            pos += 4
+        else:
+            raise ValueError('Unsupported wire type {}'.format(wire_type))
+        if pos > end:
+            raise ValueError('Truncated field')
+        yield tag >> 3, wire_type, value
+
+
+def _peek_directive_header(data):
+    """
+    Reads the namespace and the name of a serialized directive without parsing it.
+
+    Every directive starts with the same Directive.Header header = 1, holding namespace = 1 and name = 2.
+
+    :return: (namespace, name), or None if data is not a valid directive.
+    """
+    if not _PEEK_WIRE_FORMAT:
+        # the payload of a generic Directive is not parsed
+        pb_directive = proto.Directive()
+        try:
+            pb_directive.ParseFromString(data)
+        except DecodeError:
+            return None
+        return pb_directive.header.namespace, pb_directive.header.name
+
+    namespace = ''
+    name = ''
+    try:
+        for number, wire_type, value in _read_fields(data, 0, len(data)):
+            if number != 1 or wire_type != _WIRE_LENGTH_DELIMITED:
+                continue
+            # a message field found several times is merged, the last value of each field wins
+            for header_number, header_wire_type, header_value in _read_fields(data, *value):
+                if header_wire_type != _WIRE_LENGTH_DELIMITED:
+                    continue
+                if header_number == 1:
+                    namespace = data[header_value[0]:header_value[1]].decode('utf-8')
+                elif header_number == 2:
+                    name = data[header_value[0]:header_value[1]].decode('utf-8')
+    except (IndexError, ValueError):
+        return None
+    return namespace, name
+
+
 class AlexaGadget:
     """
     An Alexa-connected accessory that interacts with an Amazon Echo device over Classic Bluetooth or Bluetooth Low Energy.
     """
 
-    def __init__(self, gadget_config_path=None):
+    def __init__(self, gadget_config_path=None, directive_executor=None, transport_mode=None, metrics=None,
+                 tracer=None, capture=None):
         """
         Initialize gadget.
 
         :param gadget_config_path: (Optional) Path to your Alexa Gadget Configuration .ini file. If you don't pass this in
         then make sure you have created a file with the same prefix as your .py file and '.ini' as the suffix.
-        """
+        :param directive_executor: (Optional) DirectiveExecutor running on_directive off the transport thread. If you
+        don't pass this in then on_directive is called on the transport thread, and must return quickly.
+        :param transport_mode: (Optional) Transport mode to use instead of the one configured with the launch.py script,
+        LOOPBACK_BLE or LOOPBACK_BT run the gadget against a VirtualEcho, without Bluetooth.
+        :param metrics: (Optional) GadgetMetrics to update, no metrics are kept if you don't pass this in.
+        :param tracer: (Optional) Tracer recording the stages of each directive, see agt.tracing.
+        :param capture: (Optional) CaptureWriter recording the raw traffic of the transport, see agt.capture.
+        """
+        self._directive_executor = directive_executor
+        self._metrics = metrics
+        self._tracer = tracer
+        self._capture = capture
+
+        # (namespace, name) of a directive to its proto class and handler, see _get_directive_handler
+        self._dispatch_table = {}
+        self._registered_handlers = {}
 
         # Load the configuration file into configparser object
         self._load_gadget_config(gadget_config_path)
 
         # load the agt config
+        if transport_mode is None:
+            self._read_transport_mode()
+        else:
+            self._transport_mode = transport_mode
         self._peer_device_bt_addr = None
-        self._read_peer_device_bt_address()
+        if self._transport_mode not in _LOOPBACK_MODES:
+            self._read_peer_device_bt_address()
 
         # Get the radio address
-        self._read_transport_mode()
-        if self._transport_mode == BT:
-            self.radio_address = BluetoothAdapter.get_address()
-        elif self._transport_mode == BLE:
-            self.radio_address = BluetoothLEAdapter.get_address()
-        else:
+        transport_class = self._get_transport_class()
+        if transport_class is None:
             raise Exception('Invalid transport mode found in the config.'
                             'Please run the launch.py script with the --setup flag again '
                             'to re-configure the transport mode.')
+        self.radio_address = transport_class.get_address()
 
         # Check to make sure deviceType (amazonId) and deviceTypeSecret (alexaGadgetSecret) have been configured
         self.device_type = self._get_value_from_config(_GADGET_SETTINGS, _AMAZON_ID)
@@ -136,20 +265,43 @@ class AlexaGadget:
         if not product_id:
             product_id = _DEFAULT_VENDOR_ID
 
+        # Get the BLE advertising backend from the Gadget config, 'hci' or 'bluez'
+        ble_advertising = self._get_value_from_config(_GADGET_SETTINGS, _BLE_ADVERTISING)
+        if not ble_advertising:
+            ble_advertising = _DEFAULT_BLE_ADVERTISING
+
         # Initialize the Transport Adapter object
         if self._transport_mode == BT:
-            self._bluetooth = BluetoothAdapter(self.friendly_name, vendor_id, product_id,
-                                                      self._on_bluetooth_data_received,
-                                                      self._on_bluetooth_connected,
-                                                      self._on_bluetooth_disconnected)
+            self._bluetooth = transport_class(self.friendly_name, vendor_id, product_id,
+                                              self._on_bluetooth_data_received,
+                                              self._on_bluetooth_connected,
+                                              self._on_bluetooth_disconnected)
         elif self._transport_mode == BLE:
-            self._bluetooth = BluetoothLEAdapter(self.endpoint_id, self.friendly_name, self.device_type,
-                                                 vendor_id, product_id, self._on_bluetooth_data_received,
-                                                 self._on_bluetooth_connected,
-                                                 self._on_bluetooth_disconnected)
+            self._bluetooth = transport_class(self.endpoint_id, self.friendly_name, self.device_type,
+                                              vendor_id, product_id, self._on_bluetooth_data_received,
+                                              self._on_bluetooth_connected,
+                                              self._on_bluetooth_disconnected,
+                                              advertising=ble_advertising)
+        else:
+            framing = BLE if self._transport_mode == LOOPBACK_BLE else BT
+            self._bluetooth = transport_class(framing, self.endpoint_id, self.friendly_name, self.device_type,
+                                              self._on_bluetooth_data_received,
+                                              self._on_bluetooth_connected,
+                                              self._on_bluetooth_disconnected)
+        if metrics is not None:
+            metrics.bind(self._transport_mode, self._bluetooth, directive_executor)
+        if tracer is not None:
+            self._bluetooth.set_tracer(tracer)
+        if capture is not None:
+            self._bluetooth.set_capture(capture)
+
+        # the Discover.Response is sent on every discovery, the Echo device discovers again on every reconnect
+        self._discover_response = self._build_discover_response()
 
         # enable auto reconnect, by default
         self._reconnect_status = (0, time.time())
+        # wakes up the main thread when the connection state or the reconnect status changes
+        self._connection_state_changed = Event()
 
         # flag for ensuring keyboard interrupt is only handled once
         self._keyboard_interrupt_being_handled = False
@@ -207,9 +359,7 @@ class AlexaGadget:
                 logger.info('Now in pairing mode over {}. Pair {} in the Alexa App.'
                             .format(self._transport_mode, self.friendly_name))
 
-            # current BT implementation requires event loop on mainthread
-            # if event loop no longer required, block on signal.pause()
-            self._bluetooth.run()
+            self._run_event_loop()
 
     def start(self):
         """
@@ -221,6 +371,13 @@ class AlexaGadget:
         main_thread.setDaemon(True)
         main_thread.start()
 
+    @property
+    def transport(self):
+        """
+        The transport adapter of the gadget, e.g. the LoopbackAdapter to attach a VirtualEcho to
+        """
+        return self._bluetooth
+
     def is_paired(self):
         """
         Return true if this gadget has a Echo device BT address in config and bonded, false otherwise
@@ -246,6 +403,7 @@ class AlexaGadget:
         """
         # update the reconnect status to indicate that we should attempt to reconnect immediately
         self._reconnect_status = (0, time.time())
+        self._connection_state_changed.set()
 
     def disconnect(self):
         """
@@ -253,6 +411,7 @@ class AlexaGadget:
         """
         # update the reconnect status to indicate that we shouldn't attempt to automatically reconnect
         self._reconnect_status = (0, None)
+        self._connection_state_changed.set()
 
         # disconnect from the currently connected Echo device
         self._bluetooth.disconnect()
@@ -282,11 +441,7 @@ class AlexaGadget:
 
           * param: `DiscoverResponseEventProto.Event <https://developer.amazon.com/docs/alexa-gadgets-toolkit/alexa-discovery-interface.html#discover-response-event>`_
         """
-        msg = proto.Message()
-        msg.payload = event.SerializeToString()
-        logger.debug('Sending event to Echo device:\033[90m {{ {} }}\033[00m'.format(
-            json_format.MessageToDict(event, including_default_value_fields=True)))
-        self._bluetooth.send(msg.SerializeToString())
+        self._send(self._serialize_event(event), event)
 
     # ------------------------------------------------
     # Callbacks
@@ -353,87 +508,48 @@ class AlexaGadget:
           * callback: ``on_alerts_deletealert(directive)``
 
         """
-        logger.debug('Received directive from Echo device:\033[90m {{ {} }}\033[00m'.format(
-            json_format.MessageToDict(directive, including_default_value_fields=True)))
-        callback_str = 'on_' + '_'.join([directive.header.namespace, directive.header.name]).lower().replace('.', '_')
-        cb = getattr(self, callback_str, None)
-        if cb is not None:
+        logger.debug('Received directive from Echo device:\033[90m { %s }\033[00m',
+                     LazyFormat(json_format.MessageToDict, directive, including_default_value_fields=True))
+        _, cb = self._get_directive_handler(directive.header.namespace, directive.header.name)
+        if cb is None:
+            return
+        span = self._tracer.start() if self._tracer is not None else None
+        if self._metrics is None and span is None:
             cb(directive)
+            return
+        start = time.perf_counter()
+        try:
+            cb(directive)
+        finally:
+            if self._metrics is not None:
+                self._metrics.handler_seconds.labels(directive.header.namespace, directive.header.name).observe(
+                    time.perf_counter() - start)
+            if span is not None:
+                self._tracer.stop(span, 'gadget.handler', namespace=directive.header.namespace,
+                                  name=directive.header.name)
+
+    def register_directive_handler(self, namespace, name, handler):
+        """
+        Registers a handler for a directive, called by on_directive instead of the ``on_namespace_name`` method.
+
+        :param namespace: namespace of the directive, e.g. Custom.MyGadget
+        :param name: name of the directive
+        :param handler: callable taking the directive, or None to fall back to the ``on_namespace_name`` method
+        """
+        if handler is None:
+            self._registered_handlers.pop((namespace, name), None)
+        else:
+            self._registered_handlers[(namespace, name)] = handler
+        # the handler is looked up again on the next directive
+        self._dispatch_table.pop((namespace, name), None)
 
     def on_alexa_discovery_discover(self, directive):
         """
         Called when Gadget receives Alexa.Discovery.Discover directive from the Echo device.
         """
-        # Get values from the self.simple_gadget_config and set them to variables
-        model_name = self._get_value_from_config(_GADGET_SETTINGS, _MODEL_NAME)
-        if not model_name:
-            model_name = _DEFAULT_MODEL_NAME
-
-        device_token_encryption_type = self._get_value_from_config(_GADGET_SETTINGS, _DEVICE_TOKEN_ENCRYPTION_TYPE)
-        if not device_token_encryption_type:
-            device_token_encryption_type = _DEFAULT_DEVICE_TOKEN_ENCRYPTION_TYPE
-
-        firmware_version = self._get_value_from_config(_GADGET_SETTINGS, _FIRMWARE_VERSION)
-        if not firmware_version:
-            firmware_version = _DEFAULT_FIRMWARE_VERSION
-
-        # Automatically generate the device token using endpoint_id and device_type_secret
-        device_token = self._generate_token(self.endpoint_id, self.device_type_secret)
-
-        manufacturer_name = self._get_value_from_config(_GADGET_SETTINGS, _MANUFACTURER_NAME)
-        if not manufacturer_name:
-            manufacturer_name = _DEFAULT_MANUFACTURER_NAME
-
-        description = self._get_value_from_config(_GADGET_SETTINGS, _DESCRIPTION)
-        if not description:
-            description = _DEFAULT_DESCRIPTION
-
-        # Generate the Discover.Response Protocol Buffer Message
-        pb_event = proto.DiscoverResponseEvent()
-        pb_event.header.namespace = 'Alexa.Discovery'
-        pb_event.header.name = 'Discover.Response'
-        pb_event.header.messageId = ''
-
-        # Populate the endpoint of the response payload
-        pb_endpoint = pb_event.payload.endpoints.add()
-        pb_endpoint.endpointId = self.endpoint_id
-        pb_endpoint.manufacturerName = manufacturer_name
-        pb_endpoint.description = description
-        pb_endpoint.friendlyName = self.friendly_name
-
-        pb_endpoint.additionalIdentification.modelName = model_name
-        pb_endpoint.additionalIdentification.deviceTokenEncryptionType = device_token_encryption_type
-        pb_endpoint.additionalIdentification.firmwareVersion = firmware_version
-        pb_endpoint.additionalIdentification.amazonDeviceType = self.device_type
-        pb_endpoint.additionalIdentification.radioAddress = self.radio_address
-        pb_endpoint.additionalIdentification.deviceToken = device_token
-
-        for section in self.gadget_config.sections():
-            if section == _GADGET_CAPABILITIES:
-                for (k, v) in self.gadget_config.items(section):
-                    pb_capability = pb_endpoint.capabilities.add()
-                    pb_capability.interface = k
-                    pb_capability.type = 'AlexaInterface'
-                    """
-                    If capability is something like:
-                        Alexa.Gadget.StateListener = 1.0 - timeinfo, timers, alarms, reminders, wakeword
-                    Then we will split on '-' and add supported types
-
-                    Otherwise, it should be in this format:
-                        Alerts = 1.1
-                    In which casse we simple pass only the version
-                    """
-                    if '-' in v:
-                        v = v.split('-')
-                        pb_capability.version = v[0].strip()
-                        if len(v) == 2:
-                            for st in v[1].split(','):
-                                supported_types = pb_capability.configuration.supportedTypes.add()
-                                supported_types.name = st.strip()
-                    else:
-                        pb_capability.version = v.strip()
-
-        self.send_event(pb_event)
+        event, data = self._discover_response
+        self._log_event(event)
+        self._send(data, event)
 
     # ------------------------------------------------
     # Helpers
@@ -447,21 +563,43 @@ class AlexaGadget:
             # poll the bluetooth adapter
             self._bluetooth.poll_server()
 
-            # if gadget got disconnected, try to reconnect
-            if not self.is_connected() and self.is_paired():
-                rs = self._reconnect_status
-                if rs[1] and time.time() > rs[1]:
-                    logger.info(
-                        'Attempting to reconnect to Echo device with address {} over {}'
-                        .format(self._peer_device_bt_addr, self._transport_mode))
-                    self._bluetooth.reconnect(self._peer_device_bt_addr)
-                    if rs[0] < 30:
-                        self._reconnect_status = (rs[0] + 1, time.time() + 10)
-                    else:
-                        self._reconnect_status = (rs[0] + 1, time.time() + 60)
+            # the transports are event driven, only wake up for the next reconnect attempt
+            # or when the connection state changes
+            self._connection_state_changed.wait(self._reconnect_if_due())
+            self._connection_state_changed.clear()
+
+    def _run_event_loop(self):
+        """
+        Runs the event loop of the transport until the gadget is stopped.
+        """
+        # current BT implementation requires event loop on mainthread
+        # if event loop no longer required, block on signal.pause()
+        self._bluetooth.run()
 
-            # 10 times a second
-            time.sleep(0.1)
+    def _reconnect_if_due(self):
+        """
+        If gadget got disconnected, try to reconnect when the next attempt is due.
+
+        :return: seconds until the next reconnect attempt, or None if there is none to wait for
+        """
+        timeout = None
+        if not self.is_connected() and self.is_paired():
+            rs = self._reconnect_status
+            if rs[1] and time.time() > rs[1]:
+                logger.info(
+                    'Attempting to reconnect to Echo device with address {} over {}'
+                    .format(self._peer_device_bt_addr, self._transport_mode))
+                if self._metrics is not None:
+                    self._metrics.reconnects.inc()
+                self._bluetooth.reconnect(self._peer_device_bt_addr)
+                if rs[0] < 30:
+                    self._reconnect_status = (rs[0] + 1, time.time() + 10)
+                else:
+                    self._reconnect_status = (rs[0] + 1, time.time() + 60)
+            rs = self._reconnect_status
+            if rs[1]:
+                timeout = max(0, rs[1] - time.time())
+        return timeout
 
     def _on_bluetooth_connected(self, bt_addr):
         """
@@ -475,6 +613,9 @@ class AlexaGadget:
 
         # reset the reconnect status
         self._reconnect_status = (0, time.time())
+        self._connection_state_changed.set()
+        if self._metrics is not None:
+            self._metrics.connection.set(1)
 
         # if the update the saved bluetooth address
         if bt_addr != self._peer_device_bt_addr:
@@ -493,6 +634,9 @@ class AlexaGadget:
         """
         logger.info('Disconnected from Echo device with address {} over {}'
                     .format(bt_addr, self._transport_mode))
+        self._connection_state_changed.set()
+        if self._metrics is not None:
+            self._metrics.connection.set(0)
 
         # call the callback.
         try:
@@ -507,6 +651,9 @@ class AlexaGadget:
 
         if not data:
             return
+        if self._metrics is not None:
+            self._metrics.bytes_in.inc(len(data))
+        span = self._tracer.start() if self._tracer is not None else None
 
         # Parse the main message.
         pb_msg = proto.Message()
@@ -516,21 +663,192 @@ class AlexaGadget:
             logger.error('Error handling data: {}'.format(data.hex()))
             return
 
-        # parse the directive
-        pb_directive = proto.Directive()
+        # parse the directive once, into its proto class found from the header
+        header = _peek_directive_header(pb_msg.payload)
+        if header is None:
+            proto_class = proto.Directive
+        else:
+            proto_class, _ = self._get_directive_handler(*header)
+        pb_directive = proto_class()
         pb_directive.ParseFromString(pb_msg.payload)
-        namespace = pb_directive.header.namespace
-        name = pb_directive.header.name
-        proto_class = getattr(proto, name + 'Directive', None)
-        if proto_class and namespace == proto_class.DESCRIPTOR.GetOptions().Extensions[proto.namespace]:
-            pb_directive = proto_class()
-            pb_directive.ParseFromString(pb_msg.payload)
-
-        # call the callback.
+        if self._metrics is not None:
+            self._metrics.directives_received.labels(pb_directive.header.namespace, pb_directive.header.name).inc()
+        if span is not None:
+            self._tracer.stop(span, 'gadget.parse', namespace=pb_directive.header.namespace,
+                              name=pb_directive.header.name)
+            span = self._tracer.start()
+
+        # call the callback, or queue it to the executor
         try:
-            self.on_directive(pb_directive)
-        except:
-            logger.exception("Exception handling directive from Echo device")
+            if self._directive_executor is not None:
+                if span is None:
+                    queued = self._directive_executor.submit(pb_directive.header.namespace, self.on_directive,
+                                                             pb_directive)
+                else:
+                    # the handler span goes to the trace of the directive
+                    queued = self._directive_executor.submit(pb_directive.header.namespace, self._in_trace,
+                                                             self._tracer.current(), self.on_directive, pb_directive)
+                if not queued:
+                    logger.warning('Dropped directive %s.%s, the directive queue is full or shut down',
+                                   pb_directive.header.namespace, pb_directive.header.name)
+                return
+            try:
+                self.on_directive(pb_directive)
+            except:
+                logger.exception("Exception handling directive from Echo device")
+        finally:
+            if span is not None:
+                self._tracer.stop(span, 'gadget.dispatch')
+
+    def _in_trace(self, trace_id, fn, *args):
+        """
+        Calls fn in the trace trace_id, from another thread than the one which started it.
+        """
+        previous = self._tracer.attach(trace_id)
+        try:
+            return fn(*args)
+        finally:
+            self._tracer.detach(previous)
+
+    def _get_directive_handler(self, namespace, name):
+        """
+        Returns the proto class and the handler of a directive.
+
+        The handler is the one registered with register_directive_handler, else the ``on_namespace_name`` method
+        if the gadget defines it, else None. Both are looked up on the first directive and then kept in the
+        dispatch table.
+        """
+        key = (namespace, name)
+        entry = self._dispatch_table.get(key)
+        if entry is None:
+            handler = self._registered_handlers.get(key)
+            if handler is None:
+                callback_str = 'on_' + '_'.join([namespace, name]).lower().replace('.', '_')
+                handler = getattr(self, callback_str, None)
+            entry = (_DIRECTIVE_CLASSES.get(key, proto.Directive), handler)
+            self._dispatch_table[key] = entry
+        return entry
+
+    def _serialize_event(self, event):
+        """
+        Returns the serialized Message holding an event.
+        """
+        if self._metrics is not None:
+            start = time.perf_counter()
+        msg = proto.Message()
+        msg.payload = event.SerializeToString()
+        data = msg.SerializeToString()
+        if self._metrics is not None:
+            self._metrics.encode_seconds.observe(time.perf_counter() - start)
+        self._log_event(event)
+        return data
+
+    def _log_event(self, event):
+        logger.debug('Sending event to Echo device:\033[90m { %s }\033[00m',
+                     LazyFormat(json_format.MessageToDict, event, including_default_value_fields=True))
+
+    def _send(self, data, event):
+        """
+        Hands a serialized Message over to the transport.
+
+        :param event: The event serialized in data, for the metrics.
+        """
+        return self._transport_send(data, event)
+
+    def _transport_send(self, data, event):
+        metrics = self._metrics
+        if metrics is None:
+            return self._bluetooth.send(data)
+        start = time.perf_counter()
+        sent = self._bluetooth.send(data)
+        metrics.send_time.observe(time.perf_counter() - start)
+        if sent is False:
+            metrics.dropped.inc()
+        else:
+            # counted once the transport has taken it, a dropped event is only counted as dropped
+            metrics.events_sent.labels(event.header.namespace, event.header.name).inc()
+            metrics.bytes_out.inc(len(data))
+        return sent
+
+    def _build_discover_response(self):
+        """
+        Builds the Discover.Response event from the Gadget .ini file, once when the gadget is created: like the
+        transport settings, a change to the file takes effect on the next start.
+
+        :return: (event, serialized Message)
+        """
+        # Get values from the self.simple_gadget_config and set them to variables
+        model_name = self._get_value_from_config(_GADGET_SETTINGS, _MODEL_NAME)
+        if not model_name:
+            model_name = _DEFAULT_MODEL_NAME
+
+        device_token_encryption_type = self._get_value_from_config(_GADGET_SETTINGS, _DEVICE_TOKEN_ENCRYPTION_TYPE)
+        if not device_token_encryption_type:
+            device_token_encryption_type = _DEFAULT_DEVICE_TOKEN_ENCRYPTION_TYPE
+
+        firmware_version = self._get_value_from_config(_GADGET_SETTINGS, _FIRMWARE_VERSION)
+        if not firmware_version:
+            firmware_version = _DEFAULT_FIRMWARE_VERSION
+
+        # Automatically generate the device token using endpoint_id and device_type_secret
+        device_token = self._generate_token(self.endpoint_id, self.device_type_secret)
+
+        manufacturer_name = self._get_value_from_config(_GADGET_SETTINGS, _MANUFACTURER_NAME)
+        if not manufacturer_name:
+            manufacturer_name = _DEFAULT_MANUFACTURER_NAME
+
+        description = self._get_value_from_config(_GADGET_SETTINGS, _DESCRIPTION)
+        if not description:
+            description = _DEFAULT_DESCRIPTION
+
+        # Generate the Discover.Response Protocol Buffer Message
+        pb_event = proto.DiscoverResponseEvent()
+        pb_event.header.namespace = 'Alexa.Discovery'
+        pb_event.header.name = 'Discover.Response'
+        pb_event.header.messageId = ''
+
+        # Populate the endpoint of the response payload
+        pb_endpoint = pb_event.payload.endpoints.add()
+        pb_endpoint.endpointId = self.endpoint_id
+        pb_endpoint.manufacturerName = manufacturer_name
+        pb_endpoint.description = description
+        pb_endpoint.friendlyName = self.friendly_name
+
+        pb_endpoint.additionalIdentification.modelName = model_name
+        pb_endpoint.additionalIdentification.deviceTokenEncryptionType = device_token_encryption_type
+        pb_endpoint.additionalIdentification.firmwareVersion = firmware_version
+        pb_endpoint.additionalIdentification.amazonDeviceType = self.device_type
+        pb_endpoint.additionalIdentification.radioAddress = self.radio_address
+        pb_endpoint.additionalIdentification.deviceToken = device_token
+
+        for section in self.gadget_config.sections():
+            if section == _GADGET_CAPABILITIES:
+                for (k, v) in self.gadget_config.items(section):
+                    pb_capability = pb_endpoint.capabilities.add()
+                    pb_capability.interface = k
+                    pb_capability.type = 'AlexaInterface'
+                    """
+                    If capability is something like:
+                        Alexa.Gadget.StateListener = 1.0 - timeinfo, timers, alarms, reminders, wakeword
+                    Then we will split on '-' and add supported types
+
+                    Otherwise, it should be in this format:
+                        Alerts = 1.1
+                    In which casse we simple pass only the version
+                    """
+                    if '-' in v:
+                        v = v.split('-')
+                        pb_capability.version = v[0].strip()
+                        if len(v) == 2:
+                            for st in v[1].split(','):
+                                supported_types = pb_capability.configuration.supportedTypes.add()
+                                supported_types.name = st.strip()
+                    else:
+                        pb_capability.version = v.strip()
+
+        msg = proto.Message()
+        msg.payload = pb_event.SerializeToString()
+        return pb_event, msg.SerializeToString()
 
     def _load_gadget_config(self, gadget_config_path):
         """
@@ -566,6 +884,23 @@ class AlexaGadget:
             return self.gadget_config.get(section, option)
         return None
 
+    def _get_transport_class(self):
+        """
+        Returns the adapter class of the transport mode, or None if the transport mode is invalid.
+
+        The adapters are imported on demand, the Bluetooth ones need dbus and GLib.
+        """
+        if self._transport_mode == BT:
+            from agt.bt_classic.adapter import BluetoothAdapter
+            return BluetoothAdapter
+        elif self._transport_mode == BLE:
+            from agt.ble.adapter import BluetoothLEAdapter
+            return BluetoothLEAdapter
+        elif self._transport_mode in _LOOPBACK_MODES:
+            from agt.loopback import LoopbackAdapter
+            return LoopbackAdapter
+        return None
+
     def _read_transport_mode(self):
         """
         Reads the transport mode with which gadget is configured
@@ -593,6 +928,9 @@ class AlexaGadget:
         """
         Writes the bluetooth address of the paired Echo device to disk
         """
+        if self._transport_mode in _LOOPBACK_MODES:
+            # the VirtualEcho is not a paired Echo device
+            return
         with open(global_config_path, "r") as read_file:
             data = json.load(read_file)
         with open(global_config_path, "w+") as write_file:
@@ -612,3 +950,7 @@ class AlexaGadget:
             self._keyboard_interrupt_being_handled = True
             self._bluetooth.set_discoverable(False)
             self._bluetooth.stop_server()
+            if self._directive_executor is not None:
+                self._directive_executor.shutdown(wait=False)
+            if self._capture is not None:
+                self._capture.close()
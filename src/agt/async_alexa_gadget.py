@@ -0,0 +1,299 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+import asyncio
+import functools
+import json
+import logging.config
+import threading
+
+import agt.messages_pb2 as proto
+from agt.alexa_gadget import AlexaGadget, _LOOPBACK_MODES
+
+try:
+    from gi.repository import GLib
+except ImportError:
+    try:
+        import gobject as GLib
+    except ImportError:
+        # only the loopback transport can run without GLib
+        GLib = None
+
+try:
+    import gbulb
+except ImportError:
+    gbulb = None
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncAlexaGadget(AlexaGadget):
+    """
+    An Alexa Gadget driven by an asyncio event loop.
+
+    Directive handlers, ``on_connected`` and ``on_disconnected`` can be coroutine functions, each call runs as
+    a task of the loop: a timer or an animation is a task waiting on ``asyncio.sleep`` instead of a thread.
+    The transport callbacks are called on the loop, and ``send_event`` and ``send_custom_event`` are
+    coroutines.
+
+    .. highlight:: python
+    .. code-block:: python
+
+        import asyncio
+
+        from agt import AsyncAlexaGadget
+
+        class MyAsyncGadget(AsyncAlexaGadget):
+            async def on_alerts_setalert(self, directive):
+                await asyncio.sleep(10)
+                await self.send_custom_event('Custom.MyGadget', 'TimerDone', {})
+
+        if __name__ == '__main__':
+            MyAsyncGadget().main()
+
+    If `gbulb <https://github.com/beeware/gbulb>`_ is installed, the asyncio loop is a GLib main loop which
+    also dispatches the D-Bus messages and the sockets of the transport. Otherwise the GLib main loop runs
+    in a thread of its own, which hands the callbacks over to the asyncio loop.
+    """
+
+    def __init__(self, gadget_config_path=None, transport_mode=None, metrics=None, tracer=None, capture=None):
+        """
+        Initialize gadget.
+
+        :param gadget_config_path: (Optional) Path to your Alexa Gadget Configuration .ini file. If you don't pass this in
+        then make sure you have created a file with the same prefix as your .py file and '.ini' as the suffix.
+        :param transport_mode: (Optional) Transport mode to use instead of the one configured with the launch.py script.
+        :param metrics: (Optional) GadgetMetrics to update, no metrics are kept if you don't pass this in.
+        :param tracer: (Optional) Tracer recording the stages of each directive, see agt.tracing.
+        :param capture: (Optional) CaptureWriter recording the raw traffic of the transport, see agt.capture.
+        """
+        super().__init__(gadget_config_path, transport_mode=transport_mode, metrics=metrics, tracer=tracer,
+                         capture=capture)
+
+        # set by run()
+        self._loop = None
+        self._loop_thread = None
+        self._glib_transport = False
+        self._glib_integrated = False
+        self._stopped = None
+        # running handler tasks, cancelled when the gadget stops
+        self._tasks = set()
+        self._connection_state_changed = _LoopEvent()
+
+        for name in ('on_connected', 'on_disconnected'):
+            callback = getattr(self, name)
+            if asyncio.iscoroutinefunction(callback):
+                setattr(self, name, functools.partial(self._create_handler_task, callback))
+
+    def start(self):
+        """
+        Start the transport, call run() to start the event loop.
+        """
+        # Start the Bluetooth server (Note: This doesn't connect or pair).
+        self._bluetooth.start_server()
+
+    async def run(self):
+        """
+        Runs the gadget on the current asyncio loop until it is stopped, start() must have been called first.
+        """
+        self._loop = asyncio.get_event_loop()
+        self._loop_thread = threading.current_thread()
+        # the loopback transport runs a queue of its own instead of a GLib main loop
+        self._glib_transport = self._transport_mode not in _LOOPBACK_MODES and GLib is not None
+        self._glib_integrated = self._glib_transport and gbulb is not None and \
+            isinstance(self._loop, gbulb.GLibEventLoop)
+        self._stopped = self._loop.create_future()
+        self._connection_state_changed.bind(self._loop)
+
+        if not self._glib_integrated:
+            transport_thread = threading.Thread(target=self._bluetooth.run, daemon=True)
+            transport_thread.start()
+
+        reconnect_task = self._loop.create_task(self._reconnect_loop())
+        try:
+            await self._stopped
+        finally:
+            tasks = [reconnect_task] + list(self._tasks)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._connection_state_changed.bind(None)
+            self._loop = None
+
+    def stop(self):
+        """
+        Stops the transport and makes run() return, can be called from any thread.
+        """
+        self._bluetooth.stop_server()
+        if self._capture is not None:
+            self._capture.close()
+        self._request_stop()
+
+    async def send_custom_event(self, namespace, name, payload):
+        """
+        Send a custom event to the skill
+
+        :param namespace: namespace of the custom event
+        :param name: name of the custom event
+        :param payload: JSON payload of the custom event
+        :return: once the transport has taken the event, what the transport returned
+        """
+        event = proto.Event()
+        event.header.namespace = namespace
+        event.header.name = name
+        event.payload = json.dumps(payload).encode('UTF-8')
+        return await self.send_event(event)
+
+    async def send_event(self, event):
+        """
+        Send an event to the Echo device, see AlexaGadget.send_event
+
+        :return: once the transport has taken the event, what the transport returned
+        """
+        return await self._send(self._serialize_event(event), event)
+
+    # ------------------------------------------------
+    # Helpers
+    # ------------------------------------------------
+
+    def _run_event_loop(self):
+        if gbulb is not None:
+            gbulb.install()
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.run())
+        finally:
+            loop.close()
+
+    async def _reconnect_loop(self):
+        while True:
+            # reconnecting can block on sdptool or HCI commands, keep it off the loop
+            timeout = await self._loop.run_in_executor(None, self._reconnect_if_due)
+            await self._connection_state_changed.wait(timeout)
+            self._connection_state_changed.clear()
+
+    def _send(self, data, event):
+        """
+        Hands a serialized Message over to the transport, from the thread running the GLib main loop when the
+        transport runs on one in a thread of its own.
+
+        :return: future of what the transport returned
+        """
+        if self._loop is None:
+            raise Exception('The gadget is not running')
+        loop = self._loop
+        future = loop.create_future()
+        if self._glib_integrated or not self._glib_transport:
+            future.set_result(self._transport_send(data, event))
+            return future
+
+        def send():
+            try:
+                result = self._transport_send(data, event)
+            except Exception as e:
+                loop.call_soon_threadsafe(_set_future_exception, future, e)
+            else:
+                loop.call_soon_threadsafe(_set_future_result, future, result)
+            return False
+
+        GLib.idle_add(send, priority=GLib.PRIORITY_DEFAULT)
+        return future
+
+    def _call_in_loop(self, callback, *args):
+        if self._loop is None or threading.current_thread() is self._loop_thread:
+            callback(*args)
+        else:
+            self._loop.call_soon_threadsafe(callback, *args)
+
+    def _on_bluetooth_connected(self, bt_addr):
+        self._call_in_loop(super()._on_bluetooth_connected, bt_addr)
+
+    def _on_bluetooth_disconnected(self, bt_addr):
+        self._call_in_loop(super()._on_bluetooth_disconnected, bt_addr)
+
+    def _on_bluetooth_data_received(self, data):
+        trace_id = self._tracer.current() if self._tracer is not None else None
+        if trace_id is None:
+            self._call_in_loop(super()._on_bluetooth_data_received, data)
+        else:
+            self._call_in_loop(self._in_trace, trace_id, super()._on_bluetooth_data_received, data)
+
+    def _get_directive_handler(self, namespace, name):
+        """
+        Returns the proto class and the handler of a directive, a coroutine function handler is wrapped to
+        run as a task.
+        """
+        key = (namespace, name)
+        entry = self._dispatch_table.get(key)
+        if entry is None:
+            proto_class, handler = super()._get_directive_handler(namespace, name)
+            if asyncio.iscoroutinefunction(handler):
+                handler = functools.partial(self._create_handler_task, handler)
+            entry = (proto_class, handler)
+            self._dispatch_table[key] = entry
+        return entry
+
+    def _create_handler_task(self, handler, *args):
+        task = self._loop.create_task(handler(*args))
+        self._tasks.add(task)
+        task.add_done_callback(self._on_handler_task_done)
+        return task
+
+    def _on_handler_task_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('Exception in handler task', exc_info=task.exception())
+
+    def _request_stop(self):
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(_set_future_result, self._stopped, None)
+
+    def _keyboard_interrupt_handler(self, signal, frame):
+        super()._keyboard_interrupt_handler(signal, frame)
+        self._request_stop()
+
+
+class _LoopEvent:
+    """
+    Wakes up a coroutine of the asyncio loop from any thread, in place of the threading.Event of AlexaGadget
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._event = None
+
+    def bind(self, loop):
+        self._loop = loop
+        self._event = asyncio.Event() if loop is not None else None
+
+    def set(self):
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._event.set)
+
+    def clear(self):
+        if self._event is not None:
+            self._event.clear()
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+def _set_future_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_future_exception(future, exception):
+    if not future.done():
+        future.set_exception(exception)
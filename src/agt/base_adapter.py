@@ -23,38 +23,65 @@ class BaseAdapter:
         # initialize bluez adapter
         self._bus = bus
         self._dbus = dbus
+        # object paths of the bluez adapters, and of the devices by address,
+        # seeded once and then kept current from the ObjectManager signals
+        self._adapter_paths = []
+        self._device_paths = {}
+        self._device_addresses = {}
+        self._index_bluez_objects()
         self.bluez_adapter = self._create_bluez_adapter()
 
-    def _create_bluez_adapter(self):
+    def _index_bluez_objects(self):
+        # listen before reading the tree so that no change is missed in between
+        self._bus.add_signal_receiver(self._on_interfaces_added, bus_name=BUS_NAME,
+                                      dbus_interface=DBUS_OM_IFACE, signal_name='InterfacesAdded')
+        self._bus.add_signal_receiver(self._on_interfaces_removed, bus_name=BUS_NAME,
+                                      dbus_interface=DBUS_OM_IFACE, signal_name='InterfacesRemoved')
         objs = self._dbus.Interface(self._bus.get_object(BUS_NAME, '/'), DBUS_OM_IFACE).GetManagedObjects()
-        for path, _interface in objs.items():
-            adapter = _interface.get(ADAPTER_INTERFACE)
-            if adapter is None:
-                continue
-            # use the first adapter which is the default adapter
-            # this means we only support one bt adapter
-            return self._dbus.Interface(self._bus.get_object(BUS_NAME, path), ADAPTER_INTERFACE)
-        return None
+        for path, interfaces in objs.items():
+            self._on_interfaces_added(path, interfaces)
+
+    def _on_interfaces_added(self, path, interfaces):
+        path = str(path)
+        if ADAPTER_INTERFACE in interfaces and path not in self._adapter_paths:
+            self._adapter_paths.append(path)
+        device = interfaces.get(DEVICE_INTERFACE)
+        if device is not None and 'Address' in device:
+            address = str(device['Address']).upper()
+            self._device_paths[address] = path
+            self._device_addresses[path] = address
+
+    def _on_interfaces_removed(self, path, interfaces):
+        path = str(path)
+        if ADAPTER_INTERFACE in interfaces and path in self._adapter_paths:
+            self._adapter_paths.remove(path)
+        if DEVICE_INTERFACE in interfaces:
+            address = self._device_addresses.pop(path, None)
+            if address is not None and self._device_paths.get(address) == path:
+                del self._device_paths[address]
+
+    def _create_bluez_adapter(self):
+        if not self._adapter_paths:
+            return None
+        # use the first adapter which is the default adapter
+        # this means we only support one bt adapter
+        return self._dbus.Interface(self._bus.get_object(BUS_NAME, self._adapter_paths[0]), ADAPTER_INTERFACE)
+
+    def _find_device_path(self, bd_addr):
+        return self._device_paths.get(str(bd_addr).upper())
 
     def _find_device(self, bd_addr):
-        objs = self._dbus.Interface(self._bus.get_object(BUS_NAME, '/'), DBUS_OM_IFACE).GetManagedObjects()
-        for path, _interface in objs.items():
-            device = _interface.get(DEVICE_INTERFACE)
-            if device is None:
-                continue
-            if device['Address'] == bd_addr:
-                return self._dbus.Interface(self._bus.get_object(BUS_NAME, path), DEVICE_INTERFACE)
-        return None
+        path = self._find_device_path(bd_addr)
+        if path is None:
+            return None
+        return self._dbus.Interface(self._bus.get_object(BUS_NAME, path), DEVICE_INTERFACE)
 
     def is_paired_to_address(self, bd_addr):
-        device = self._find_device(bd_addr)
-        if device is None:
-            return False
-        return True
+        return self._find_device_path(bd_addr) is not None
 
     def unpair(self, bd_addr):
-        device = self._find_device(bd_addr)
-        if device is not None:
-            self.bluez_adapter.RemoveDevice(device.object_path)
+        path = self._find_device_path(bd_addr)
+        if path is not None:
+            self.bluez_adapter.RemoveDevice(path)
         else:
-            logger.info('Device is not paired with Raspberry Pi')
\ No newline at end of file
+            logger.info('Device is not paired with Raspberry Pi')
@@ -12,47 +12,21 @@ import os
 import dbus.exceptions
 import logging.config
 from dbus.mainloop.glib import DBusGMainLoop
-import time
-import codecs
-import subprocess
+import socket
 from agt.ble.protocol import BLEProtocol, Packetizer
 from agt.base_adapter import BaseAdapter
 from agt.base_adapter import BUS_NAME, ADAPTER_INTERFACE, DBUS_OM_IFACE, DEVICE_INTERFACE
+from agt.ble.advertisement import ADV_MODE_PAIR, ADV_MODE_RECONNECT, ADV_BACKEND_HCI, create_advertiser
+from agt.capture import FRAMING_BLE, INBOUND, OUTBOUND
+from agt.hci import read_bd_addr
 from agt.util import subprocess_run_and_log
 
 try:
     from gi.repository import GObject
+    from gi.repository import GLib
 except ImportError:
     import gobject as GObject
-
-# When gadget advertises for OOBE, set service data identifier
-# https://developer.amazon.com/docs/alexa-gadgets-toolkit/bluetooth-le-settings.html#adv-packet-for-pairing
-BLE_ADV_DATA_PAIR_CMD = 'sudo hcitool -i hci0 cmd 0x08 0x0008 ' \
-                   ' 0x1F 0x02 0x01 0x06' \
-                   ' 0x03 0x03 0x03 0xFE' \
-                   ' 0x17 0x16 0x03 0xFE 0x71 0x01 0x00 0xFF ' \
-                   '0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00'
-
-# Skip the Service Data Identifier for reconnection
-# https://developer.amazon.com/docs/alexa-gadgets-toolkit/bluetooth-le-settings.html#adv-packet-for-reconnection
-BLE_ADV_DATA_RECONNECT_CMD = 'sudo hcitool -i hci0 cmd 0x08 0x0008 ' \
-                             ' 0x1F 0x02 0x01 0x06' \
-                             ' 0x1B 0x16 0x03 0xFE 0x71 0x01 0x00 0xFF' \
-                             ' 0x00 0x00 0x00 0x00' \
-                             ' 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00'
-
-# Adv Params changed to 0x0020 (20 ms (32*0.625))
-BLE_ADV_PARAMS_CMD = 'sudo hcitool -i hci0 cmd 0x08 0x0006 ' \
-                     '0x20 0x00 0x20 0x00 ' \
-                     '0x00 ' \
-                     '0x00 ' \
-                     '0x00 ' \
-                     '0x00 0x00 0x00 0x00 0x00 0x00 ' \
-                     '0x07 ' \
-                     '0x00 '
-
-BLE_ADV_DISABLE = 'sudo hcitool -i hci0 cmd 0x08 0x000a 00'
-BLE_ADV_ENABLE = 'sudo hcitool -i hci0 cmd 0x08 0x000a 01'
+    GLib = GObject
 
 GATT_MANAGER_IFACE = 'org.bluez.GattManager1'
 GATT_SERVICE_IFACE = 'org.bluez.GattService1'
@@ -60,14 +34,14 @@ GATT_CHRC_IFACE = 'org.bluez.GattCharacteristic1'
 GATT_DESC_IFACE = 'org.bluez.GattDescriptor1'
 DBUS_PROP_IFACE = 'org.freedesktop.DBus.Properties'
 
+# Seconds to wait for BlueZ to complete a synchronous call
+DBUS_CALL_TIMEOUT = 10
+
 logger = logging.getLogger(__name__)
 
 class NotSupportedException(dbus.exceptions.DBusException):
     _dbus_error_name = 'org.bluez.Error.NotSupported'
 
-def _hciconfig(args):
-    return subprocess.run(['/usr/bin/sudo', '/bin/hciconfig'] + args, stdout=subprocess.PIPE)
-
 """
 BluetoothLEAdapter bluetooth interface for Alexa Gadgets application
 """
@@ -80,11 +54,12 @@ class BluetoothLEAdapter(dbus.service.Object):
                  gadget_product_id,
                  data_received_cb,
                  on_connection_cb,
-                 on_disconnection_cb):
+                 on_disconnection_cb,
+                 advertising=ADV_BACKEND_HCI):
         self._protocol = BLEProtocol(gadget_endpoint_id, gadget_friendly_name, gadget_device_type,
                                                       data_received_cb, self.on_ready_to_send_data_cb)
         self._gatt_server = BLEGattTransport(self._protocol, gadget_friendly_name,
-                                             on_connection_cb, on_disconnection_cb)
+                                             on_connection_cb, on_disconnection_cb, advertising=advertising)
         self._gadget_friendly_name = gadget_friendly_name
         self._gadget_vendor_id = gadget_vendor_id
         self._gadget_product_id = gadget_product_id
@@ -119,10 +94,10 @@ class BluetoothLEAdapter(dbus.service.Object):
         :return:
         """
         logger.debug('Sending packetized data')
-        self._gatt_server.send_data(bytearray(payload))
+        self._gatt_server.send_data(payload)
     def set_discoverable(self, discoverable):
         if discoverable:
-            self._gatt_server.set_advertisement_data(self._gadget_friendly_name, BLE_ADV_DATA_PAIR_CMD)
+            self._gatt_server.set_advertisement_mode(ADV_MODE_PAIR)
         self._gatt_server.toggle_advertisement(discoverable)
     def disconnect(self):
         """
@@ -134,8 +109,29 @@ class BluetoothLEAdapter(dbus.service.Object):
         return self._gatt_server.is_connected()
     def get_connection_info(self):
         raise NotSupportedException()
+    def get_stats(self):
+        """
+        Returns the MTU and fragmentation counters of the current connection
+        """
+        return self._protocol.get_stats()
+    def set_ack_observer(self, observer):
+        """
+        Calls observer with the seconds from the last packet of each directive to its transport ACK
+        """
+        self._protocol.ack_observer = observer
+    def set_tracer(self, tracer):
+        """
+        Traces the packets written by the Echo device with tracer, see agt.tracing
+        """
+        self._protocol.tracer = tracer
+    def set_capture(self, capture):
+        """
+        Records the packets written and notified over GATT with capture, a CaptureWriter
+        """
+        capture.start_session(FRAMING_BLE)
+        self._protocol.capture = capture
     def reconnect(self, bd_addr):
-        self._gatt_server.set_advertisement_data(self._gadget_friendly_name, BLE_ADV_DATA_RECONNECT_CMD)
+        self._gatt_server.set_advertisement_mode(ADV_MODE_RECONNECT)
         self._gatt_server.toggle_advertisement(True)
     def is_paired_to_address(self, bd_addr):
         return self._gatt_server.is_paired_to_address(bd_addr)
@@ -150,10 +146,7 @@ class BluetoothLEAdapter(dbus.service.Object):
 
         :return: Host BD Address
         """
-        p = _hciconfig(['hci0'])
-        bdaddr = p.stdout.decode('utf-8').split('BD Address: ')[1].split(' ')[0]
-        bdaddr = bdaddr.replace(':', '').strip()
-        return bdaddr
+        return read_bd_addr()
 
 """
 Application:
@@ -168,12 +161,12 @@ class Application(dbus.service.Object):
     """
     org.bluez.GattApplication1 interface implementation
     """
-    def __init__(self, bus, protocol):
+    def __init__(self, bus, protocol, acquire_io=True):
         self._path = '/'
         self._protocol = protocol
         self._services = []
         dbus.service.Object.__init__(self, bus, self._path)
-        self._gadgetService = AlexaGadgetService(bus, 0, self._protocol)
+        self._gadgetService = AlexaGadgetService(bus, 0, self._protocol, acquire_io)
         self._add_service(self._gadgetService)
 
     def get_gadget_service(self):
@@ -335,12 +328,12 @@ class AlexaGadgetService(Service):
     """
     GADGET_UUID = '0000FE03-0000-1000-8000-00805F9B34FB'
 
-    def __init__(self, bus, index, protocol):
+    def __init__(self, bus, index, protocol, acquire_io=True):
         Service.__init__(self, bus, index, self.GADGET_UUID, True)
 
         self._protocol = protocol
-        self._txChar = DataWriteCharacteristic(bus, 0, self, self._protocol)
-        self._rxChar = DataReadCharacteristic(bus, 1, self, self._protocol)
+        self._txChar = DataWriteCharacteristic(bus, 0, self, self._protocol, acquire_io)
+        self._rxChar = DataReadCharacteristic(bus, 1, self, self._protocol, acquire_io)
 
         self._add_characteristic(self._txChar)
         self._add_characteristic(self._rxChar)
@@ -355,23 +348,81 @@ class AlexaGadgetService(Service):
 class DataWriteCharacteristic(Characteristic):
     TX_UUID = 'F04EB177-3005-43A7-AC61-A390DDF83076'
 
-    def __init__(self, bus, index, service, protocol):
+    def __init__(self, bus, index, service, protocol, acquire_io=True):
         self._protocol = protocol
+        self._acquire_io = acquire_io
+        self._write_socket = None
         Characteristic.__init__(
             self, bus, index,
             self.TX_UUID,
             ['encrypt-write'],
             service)
 
+    def get_properties(self):
+        properties = Characteristic.get_properties(self)
+        if self._acquire_io:
+            # BlueZ only calls AcquireWrite when the WriteAcquired property is present
+            properties[GATT_CHRC_IFACE]['WriteAcquired'] = dbus.Boolean(self._write_socket is not None)
+        return properties
+
     def WriteValue(self, value, options):
-        self._protocol.data_received(bytearray(value))
+        self._set_mtu(options)
+        self._data_received(bytearray(value), 'gatt.write_value')
+
+    @dbus.service.method(GATT_CHRC_IFACE, in_signature='a{sv}', out_signature='hq')
+    def AcquireWrite(self, options):
+        """
+        Hand BlueZ a socket to write the data sent by the Echo device to, instead of calling WriteValue
+        """
+        if not self._acquire_io:
+            raise NotSupportedException()
+        self._set_mtu(options)
+        self.release_write()
+        self._write_socket, remote = _AcquiredSocket.create(self._socket_data_received, self.release_write)
+        self._write_socket.start()
+        logger.debug('write acquired')
+        return _unix_fd(remote), dbus.UInt16(options.get('mtu', 0))
+
+    def release_write(self):
+        if self._write_socket is not None:
+            self._write_socket.close()
+            self._write_socket = None
+            logger.debug('write released')
+
+    def _socket_data_received(self, data):
+        self._data_received(data, 'gatt.socket_read')
+
+    def _data_received(self, data, span_name):
+        """
+        Hand a packet over to the protocol, as the root span of its trace when it is traced
+        """
+        if self._protocol.capture is not None:
+            self._protocol.capture.record(INBOUND, data)
+        tracer = self._protocol.tracer
+        if tracer is None or tracer.begin() is None:
+            self._protocol.data_received(data)
+            return
+        span = tracer.start()
+        try:
+            self._protocol.data_received(data)
+        finally:
+            tracer.stop(span, span_name, size=len(data))
+            tracer.end()
+
+    def _set_mtu(self, options):
+        # BlueZ reports the ATT MTU negotiated for the connection with every write
+        mtu = options.get('mtu')
+        if mtu is not None:
+            self._protocol.set_mtu(mtu)
 
 
 class DataReadCharacteristic(Characteristic):
     RX_UUID = '2BEEA05B-1879-4BB4-8A2F-72641F82420B'
 
-    def __init__(self, bus, index, service, protocol):
+    def __init__(self, bus, index, service, protocol, acquire_io=True):
         self._protocol = protocol
+        self._acquire_io = acquire_io
+        self._notify_socket = None
         Characteristic.__init__(
             self, bus, index,
             self.RX_UUID,
@@ -379,8 +430,15 @@ class DataReadCharacteristic(Characteristic):
             service)
         self._notifying = False
 
+    def get_properties(self):
+        properties = Characteristic.get_properties(self)
+        if self._acquire_io:
+            # BlueZ only calls AcquireNotify when the NotifyAcquired property is present
+            properties[GATT_CHRC_IFACE]['NotifyAcquired'] = dbus.Boolean(self._notify_socket is not None)
+        return properties
+
     def ReadValue(self, options):
-        logger.debug('Rx value read: ' + repr(self._rx_value))
+        logger.debug('Rx value read: %r', self._rx_value)
         return [dbus.Byte(self._rx_value)]
 
     # Call this method when you need to send data from the gadget
@@ -388,6 +446,12 @@ class DataReadCharacteristic(Characteristic):
         if not self._notifying:
             logger.debug('notifications not enabled yet')
             return
+        if self._protocol.capture is not None:
+            self._protocol.capture.record(OUTBOUND, payload)
+        if self._notify_socket is not None:
+            # BlueZ reads the socket and sends every packet as a notification
+            self._notify_socket.send(payload)
+            return
         self.PropertiesChanged(
             GATT_CHRC_IFACE,
             {'Value': convert_to_dbus_array(payload)}, [])
@@ -395,24 +459,153 @@ class DataReadCharacteristic(Characteristic):
     def StartNotify(self):
         logger.debug('notifications enabled')
         self._notifying = True
-        time.sleep(1)
-        self._protocol.gadget_ready()
+        # send the protocol version packet once BlueZ has the reply, without blocking the main loop. The MTU is
+        # not known yet, BLEProtocol.set_mtu sends an updated packet once the first WriteValue reports it
+        GLib.idle_add(self._gadget_ready)
+
+    @dbus.service.method(GATT_CHRC_IFACE, in_signature='a{sv}', out_signature='hq')
+    def AcquireNotify(self, options):
+        """
+        Hand BlueZ a socket to read the notifications from, instead of PropertiesChanged signals.
+        Notifications are enabled by this call, StartNotify is not called.
+        """
+        if not self._acquire_io:
+            raise NotSupportedException()
+        mtu = options.get('mtu')
+        if mtu is not None:
+            self._protocol.set_mtu(mtu)
+        self._release_notify()
+        self._notify_socket, remote = _AcquiredSocket.create(None, self.StopNotify)
+        self._notify_socket.start()
+        self._notifying = True
+        logger.debug('notify acquired')
+        # send the protocol version packet once BlueZ has received the socket, as in StartNotify
+        GLib.idle_add(self._gadget_ready)
+        return _unix_fd(remote), dbus.UInt16(mtu or 0)
+
+    def _gadget_ready(self):
+        if self._notifying:
+            self._protocol.gadget_ready()
+        # do not repeat the idle callback
+        return False
 
     def StopNotify(self):
         logger.debug('notifications disabled')
+        self._release_notify()
         if not self._notifying:
             logger.debug('Not notifying, nothing to do')
             return
         self._notifying = False
 
+    def _release_notify(self):
+        if self._notify_socket is not None:
+            self._notify_socket.close()
+            self._notify_socket = None
+            logger.debug('notify released')
+
 
 def convert_to_dbus_array(payload):
-    payload = bytearray(payload)
-    out = []
-    for b in payload:
-        out = out + [dbus.Byte(b)]
+    """
+    Convert a payload (bytes, bytearray, memoryview or list of ints) to a D-Bus byte array.
 
-    return dbus.Array(out, signature=dbus.Signature('y'))
+    dbus.ByteArray is marshalled as 'ay' straight from its buffer, so the payload is copied
+    once instead of allocating a dbus.Byte per byte.
+    """
+    return dbus.ByteArray(payload)
+
+
+def _unix_fd(sock):
+    """
+    Wrap a socket in a D-Bus file descriptor. dbus.types.UnixFd duplicates the descriptor,
+    so our copy of it is closed.
+    """
+    fd = dbus.types.UnixFd(sock.fileno())
+    sock.close()
+    return fd
+
+
+def _glib_add_watch(fd, callback):
+    return GLib.io_add_watch(fd, GLib.PRIORITY_DEFAULT, GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, callback)
+
+
+class _AcquiredSocket:
+    """
+    Local end of a socket pair handed over to BlueZ through AcquireWrite/AcquireNotify.
+    Every GATT write/notification is a single SOCK_SEQPACKET packet, so no framing is needed.
+    """
+    # a packet can't be larger than the maximum length of an attribute value
+    MAX_PACKET_SIZE = 512
+
+    def __init__(self, sock, data_received_cb, closed_cb, add_watch=_glib_add_watch, remove_watch=None):
+        """
+        :param sock: local end of the socket pair
+        :param data_received_cb: called with every packet read from the socket, None to ignore inbound data
+        :param closed_cb: called once BlueZ has closed its end of the socket pair
+        :param add_watch: registers a callback(fd, condition) to call when the socket is readable or closed
+        :param remove_watch: removes a watch returned by add_watch
+        """
+        self._sock = sock
+        self._sock.setblocking(False)
+        self._data_received_cb = data_received_cb
+        self._closed_cb = closed_cb
+        self._add_watch = add_watch
+        self._remove_watch = remove_watch if remove_watch is not None else GLib.source_remove
+        self._watch = None
+
+    @classmethod
+    def create(cls, data_received_cb, closed_cb, **kwargs):
+        """
+        Create a socket pair.
+
+        :return: the _AcquiredSocket wrapping the local end, and the remote end to hand over to BlueZ
+        """
+        local, remote = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        return cls(local, data_received_cb, closed_cb, **kwargs), remote
+
+    def start(self):
+        self._watch = self._add_watch(self._sock.fileno(), self._on_io)
+
+    def send(self, payload):
+        try:
+            self._sock.send(payload)
+        except BlockingIOError:
+            logger.error('Acquired socket is full, dropping packet of size %d', len(payload))
+        except OSError as e:
+            logger.debug('Acquired socket closed: {}'.format(e))
+            self._on_closed()
+
+    def close(self):
+        if self._watch is not None:
+            self._remove_watch(self._watch)
+            self._watch = None
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _on_io(self, fd, condition):
+        """
+        Read every pending packet, or release the socket when BlueZ closed its end
+        """
+        while self._sock is not None:
+            try:
+                data = self._sock.recv(self.MAX_PACKET_SIZE)
+            except BlockingIOError:
+                return True
+            except OSError as e:
+                logger.debug('Acquired socket closed: {}'.format(e))
+                data = b''
+            if not data:
+                # the watch is removed by returning False
+                self._watch = None
+                self._on_closed()
+                return False
+            if self._data_received_cb is not None:
+                self._data_received_cb(data)
+        return False
+
+    def _on_closed(self):
+        self.close()
+        self._closed_cb()
 
 
 def find_adapter(bus):
@@ -425,24 +618,6 @@ def find_adapter(bus):
     return None
 
 
-def get_scan_resp_data(name):
-    name_bytes = name.encode()
-    namehex = codecs.encode(name_bytes, 'hex')
-    str_hex_name = str(namehex, 'ascii')
-    name_byte_list = ['0x' + str_hex_name[i:i+2] for i in range(0, len(str_hex_name), 2)]
-    space_sep_name_hex = " ".join(name_byte_list)
-
-    len_name = len(name_byte_list)
-    len_with_flag = 1 + len_name # additional 1 for the type flag
-    scan_resp_len = 1 + len_with_flag
-
-    zeros = [0] * (31 - scan_resp_len)
-    zero_list_str = " ".join(['0x{:02x}'.format(zeros[i]) for i in range(0, len(zeros), 1)])
-
-    scan_resp = 'sudo hcitool -i hci0 cmd 0x08 0x0009 ' + '0x{:02x}'.format(scan_resp_len) + ' ' + '0x{:02x}'.format(len_with_flag) + ' 0x09 ' + space_sep_name_hex + ' ' + zero_list_str
-    return scan_resp
-
-
 """
 BLEGattTransport:
 This class is the Transport level abstraction of BLE.
@@ -457,7 +632,8 @@ APP Characteristic Rx:	2BEEA05B-1879-4BB4-8A2F-72641F82420B
 
 
 class BLEGattTransport(BaseAdapter):
-    def __init__(self, protocol, gadget_name, on_connection_cb, on_disconnection_cb):
+    def __init__(self, protocol, gadget_name, on_connection_cb, on_disconnection_cb, acquire_io=True,
+                 advertising=ADV_BACKEND_HCI):
         logger.debug('resetting Bluez...')
         self.restart_bluez_deamon()
         logger.debug('Initializing BLE service')
@@ -468,6 +644,8 @@ class BLEGattTransport(BaseAdapter):
         self._gadget_name = gadget_name
         self._on_connect_cb = on_connection_cb
         self._on_disconnect_cb = on_disconnection_cb
+        # object path of the connected Echo device
+        self._device_path = None
 
         global mainloop
         DBusGMainLoop(set_as_default=True)
@@ -484,7 +662,11 @@ class BLEGattTransport(BaseAdapter):
             self._bus.get_object(BUS_NAME, self._adapter),
             GATT_MANAGER_IFACE)
 
-        self._application = Application(self._bus, self._protocol)
+        # advertising backend, writing HCI commands or registering advertisements with BlueZ
+        self._advertiser = create_advertiser(advertising, self._bus, self._adapter, gadget_name)
+
+        # acquire_io lets BlueZ exchange GATT writes/notifications over sockets instead of D-Bus messages
+        self._application = Application(self._bus, self._protocol, acquire_io)
         self._loop = GObject.MainLoop()
 
         logger.debug('Registering GATT application...')
@@ -505,33 +687,42 @@ class BLEGattTransport(BaseAdapter):
         subprocess_run_and_log("systemctl restart bluetooth")
 
     def connect(self):
-        self.set_advertisement_data(self._gadget_name, BLE_ADV_DATA_RECONNECT_CMD)
+        self.set_advertisement_mode(ADV_MODE_RECONNECT)
         self.toggle_advertisement(True)
 
     def is_connected(self):
         return self._is_connected
 
     def disconnect(self):
+        """
+        Disconnect the Echo device, returns once the connection is down
+        """
         logger.debug('ble: disconnect')
-        cmd = 'echo "disconnect" | bluetoothctl'
-        subprocess_run_and_log(cmd)
+        if self._device_path is None:
+            logger.debug('ble: not connected')
+            return
+        device = dbus.Interface(self._bus.get_object(BUS_NAME, self._device_path), DEVICE_INTERFACE)
+        try:
+            device.Disconnect(timeout=DBUS_CALL_TIMEOUT)
+        except dbus.exceptions.DBusException as e:
+            logger.error('Failed to disconnect: {}'.format(e))
 
     def stop(self):
         # Make sure that the disconnect completes
         # before un registering the services.
         # Else it will cause EFD to be alerted of un-intended service
-        # service removal, causing the gadget to be unusable
+        # service removal, causing the gadget to be unusable.
+        # Both calls return once BlueZ is done, there is no need to wait any longer.
         logger.debug('quitting dbus mainloop')
         self.disconnect()
-        logger.info('Disconnecting. Please wait for 5 seconds...')
-        time.sleep(3)
+        try:
+            self._service_manager.UnregisterApplication(self._application.get_path(), timeout=DBUS_CALL_TIMEOUT)
+        except dbus.exceptions.DBusException as e:
+            logger.error('Failed to unregister application: {}'.format(e))
         self._loop.quit()
-        self._service_manager.UnregisterApplication(self._application)
-        # sleep again to allow time for the application un-registration
-        time.sleep(2)
 
     def send_data(self, payload):
-        logger.debug('Sending payload, size=' + str(len(payload)))
+        logger.debug('Sending payload, size=%d', len(payload))
         self._application._gadgetService._rxChar.notify_rx_value(payload)
 
     def register_app_cb(self):
@@ -541,24 +732,16 @@ class BLEGattTransport(BaseAdapter):
         logger.debug('Failed to register application: ' + str(error))
         self._loop.quit()
 
-    def set_advertisement_data(self, name, cmd):
+    def set_advertisement_mode(self, mode):
         logger.debug('set_advertisement')
         try:
-            subprocess_run_and_log('sudo hciconfig hci0 up')
-            subprocess_run_and_log(cmd)
-
-            subprocess_run_and_log(get_scan_resp_data(name))
+            self._advertiser.set_mode(mode)
         except Exception as e:
             logger.error(e)
 
     def toggle_advertisement(self, enable):
         try:
-            if enable is False:
-                subprocess_run_and_log(BLE_ADV_DISABLE)
-            else:
-                subprocess_run_and_log(BLE_ADV_PARAMS_CMD)
-                time.sleep(1)
-                subprocess_run_and_log(BLE_ADV_ENABLE)
+            self._advertiser.enable(enable)
         except Exception as e:
             logger.error(e)
 
@@ -579,20 +762,20 @@ class BLEGattTransport(BaseAdapter):
     def property_changed(self, interface, changed, invalidated, path):
         iface = interface[interface.rfind(".") + 1:]
         for name, value in changed.items():
-            val = str(value)
-            logger.debug("{%s.PropertyChanged} [%s] %s = %s" % (iface, path, name,
-                                                         val))
-            logger.debug(str(name))
-            logger.debug(str(val))
-            if str(name) == 'Connected' and str(val) == '1':
+            logger.debug("{%s.PropertyChanged} [%s] %s = %s", iface, path, name, value)
+            if name == 'Connected' and value:
                 logger.debug('device connected. Disabling advertisement')
                 mac_address = get_address_from_path(path)
                 self.toggle_advertisement(False)
+                self._device_path = path
                 self._on_connect_cb(mac_address)
                 self._is_connected = True
-            elif str(name) == 'Connected' and str(val) == '0':
+            elif name == 'Connected':
                 logger.debug('device is disconnected.')
                 self._application._gadgetService._rxChar.StopNotify()
+                self._application._gadgetService._txChar.release_write()
+                self._protocol.connection_closed()
+                self._device_path = None
                 self._on_disconnect_cb(get_address_from_path(path))
                 self._is_connected = False
                 self.connect()
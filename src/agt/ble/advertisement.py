@@ -0,0 +1,240 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+import dbus
+import dbus.exceptions
+import dbus.service
+import logging.config
+import time
+from agt.advertising_data import ble_adv_data, ble_scan_resp_data
+from agt.base_adapter import BUS_NAME
+from agt.hci import HCISocket, HCICommandError, HCI_COMMAND_DISALLOWED
+
+logger = logging.getLogger(__name__)
+
+# Advertising modes
+ADV_MODE_PAIR = 'pair'
+ADV_MODE_RECONNECT = 'reconnect'
+
+# Advertising backends
+ADV_BACKEND_HCI = 'hci'
+ADV_BACKEND_BLUEZ = 'bluez'
+
+# Alexa Gadget service, and its service data for each mode
+GADGET_SERVICE_UUID = 'FE03'
+GADGET_SERVICE_DATA = {
+    ADV_MODE_PAIR: bytes([0x71, 0x01, 0x00, 0xFF]) + bytes(16),
+    ADV_MODE_RECONNECT: bytes([0x71, 0x01, 0x00, 0xFF]) + bytes(20),
+}
+
+# When gadget advertises for OOBE, set service data identifier
+# https://developer.amazon.com/docs/alexa-gadgets-toolkit/bluetooth-le-settings.html#adv-packet-for-pairing
+BLE_ADV_DATA_PAIR = ble_adv_data(GADGET_SERVICE_DATA[ADV_MODE_PAIR], True)
+
+# Skip the Service Data Identifier for reconnection
+# https://developer.amazon.com/docs/alexa-gadgets-toolkit/bluetooth-le-settings.html#adv-packet-for-reconnection
+BLE_ADV_DATA_RECONNECT = ble_adv_data(GADGET_SERVICE_DATA[ADV_MODE_RECONNECT], False)
+
+# Adv Params changed to 0x0020 (20 ms (32*0.625))
+BLE_ADV_PARAMS = bytes([0x20, 0x00, 0x20, 0x00,
+                        0x00,
+                        0x00,
+                        0x00,
+                        0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
+                        0x07,
+                        0x00])
+BLE_ADV_INTERVAL_MS = 20
+
+LE_ADVERTISING_MANAGER_IFACE = 'org.bluez.LEAdvertisingManager1'
+LE_ADVERTISEMENT_IFACE = 'org.bluez.LEAdvertisement1'
+DBUS_PROP_IFACE = 'org.freedesktop.DBus.Properties'
+
+
+class InvalidArgsException(dbus.exceptions.DBusException):
+    _dbus_error_name = 'org.freedesktop.DBus.Error.InvalidArgs'
+
+
+def create_advertiser(backend, bus, adapter_path, name):
+    """
+    Create the advertiser of a backend.
+
+    :param backend: ADV_BACKEND_HCI or ADV_BACKEND_BLUEZ.
+    :param bus: D-Bus connection.
+    :param adapter_path: Object path of the BlueZ adapter.
+    :param name: Gadget friendly name.
+    """
+    if backend == ADV_BACKEND_HCI:
+        return HCIAdvertiser(name)
+    elif backend == ADV_BACKEND_BLUEZ:
+        return BlueZAdvertiser(bus, adapter_path, name)
+    raise Exception('Invalid BLE advertising backend: {}'.format(backend))
+
+
+class HCIAdvertiser:
+    """
+    Advertises by writing the advertising data and parameters to the controller with HCI commands.
+    """
+
+    _ADV_DATA = {
+        ADV_MODE_PAIR: BLE_ADV_DATA_PAIR,
+        ADV_MODE_RECONNECT: BLE_ADV_DATA_RECONNECT,
+    }
+
+    def __init__(self, name, hci=None):
+        self._scan_resp_data = ble_scan_resp_data(name)
+        self._hci = hci if hci is not None else HCISocket()
+
+    def set_mode(self, mode):
+        self._hci.device_up()
+        self._hci.le_set_advertising_data(self._ADV_DATA[mode])
+        self._hci.le_set_scan_response_data(self._scan_resp_data)
+
+    def enable(self, enable):
+        if not enable:
+            self._hci.le_set_advertise_enable(False)
+            return
+        # each command waits for its Command Complete event, no need to wait in between
+        try:
+            self._hci.le_set_advertising_parameters(BLE_ADV_PARAMS)
+            self._hci.le_set_advertise_enable(True)
+        except HCICommandError as e:
+            # the parameters can't be changed while advertising, which is already enabled then
+            if e.status != HCI_COMMAND_DISALLOWED:
+                raise
+
+
+class Advertisement(dbus.service.Object):
+    """
+    org.bluez.LEAdvertisement1 interface implementation
+    """
+    PATH_BASE = '/org/bluez/agt/advertisement'
+
+    def __init__(self, bus, index, service_uuids, service_data, local_name):
+        self._path = self.PATH_BASE + str(index)
+        self._bus = bus
+        # built once, BlueZ reads them every time the advertisement is registered
+        self._properties = {
+            'Type': 'peripheral',
+            'Discoverable': dbus.Boolean(True),
+            'LocalName': dbus.String(local_name),
+            'ServiceData': dbus.Dictionary({uuid: dbus.ByteArray(data) for uuid, data in service_data.items()},
+                                           signature='sv'),
+            'MinInterval': dbus.UInt32(BLE_ADV_INTERVAL_MS),
+            'MaxInterval': dbus.UInt32(BLE_ADV_INTERVAL_MS),
+        }
+        if service_uuids:
+            self._properties['ServiceUUIDs'] = dbus.Array(service_uuids, signature='s')
+        dbus.service.Object.__init__(self, bus, self._path)
+
+    def get_properties(self):
+        return {LE_ADVERTISEMENT_IFACE: self._properties}
+
+    def get_path(self):
+        return dbus.ObjectPath(self._path)
+
+    @dbus.service.method(DBUS_PROP_IFACE,
+                         in_signature='s',
+                         out_signature='a{sv}')
+    def GetAll(self, interface):
+        if interface != LE_ADVERTISEMENT_IFACE:
+            raise InvalidArgsException()
+        return self._properties
+
+    @dbus.service.method(LE_ADVERTISEMENT_IFACE,
+                         in_signature='',
+                         out_signature='')
+    def Release(self):
+        logger.debug('{}: Released'.format(self._path))
+
+
+class BlueZAdvertiser:
+    """
+    Advertises by registering org.bluez.LEAdvertisement1 objects with the LEAdvertisingManager1 of the adapter,
+    so that BlueZ owns the advertising data instead of having it overwritten behind its back.
+
+    The advertisement of each mode is built on first use and kept, switching modes only unregisters one
+    and registers the other. The calls are asynchronous, BlueZ reads the advertisement back from the
+    main loop while it registers it.
+    """
+
+    _SERVICE_UUIDS = {
+        ADV_MODE_PAIR: [GADGET_SERVICE_UUID],
+        ADV_MODE_RECONNECT: [],
+    }
+
+    def __init__(self, bus, adapter_path, name, on_registered_cb=None):
+        """
+        :param bus: D-Bus connection.
+        :param adapter_path: Object path of the BlueZ adapter.
+        :param name: Gadget friendly name.
+        :param on_registered_cb: Called with the advertisement mode once it is registered.
+        """
+        self._bus = bus
+        self._name = name
+        self._on_registered_cb = on_registered_cb
+        self._manager = dbus.Interface(bus.get_object(BUS_NAME, adapter_path), LE_ADVERTISING_MANAGER_IFACE)
+        self._advertisements = {}
+        self._mode = ADV_MODE_RECONNECT
+        self._enabled = False
+        self._registered = None
+        # seconds between the last register request and its reply
+        self.last_register_latency = None
+
+    def set_mode(self, mode):
+        self._mode = mode
+        if self._enabled:
+            self._register()
+
+    def enable(self, enable):
+        self._enabled = enable
+        if enable:
+            self._register()
+        else:
+            self._unregister()
+
+    def _get_advertisement(self, mode):
+        advertisement = self._advertisements.get(mode)
+        if advertisement is None:
+            advertisement = Advertisement(self._bus, len(self._advertisements), self._SERVICE_UUIDS[mode],
+                                          {GADGET_SERVICE_UUID: GADGET_SERVICE_DATA[mode]}, self._name)
+            self._advertisements[mode] = advertisement
+        return advertisement
+
+    def _register(self):
+        mode = self._mode
+        advertisement = self._get_advertisement(mode)
+        if self._registered is advertisement:
+            return
+        self._unregister()
+        self._registered = advertisement
+        start = time.monotonic()
+
+        def on_registered():
+            self.last_register_latency = time.monotonic() - start
+            logger.debug('Advertisement registered: {}'.format(mode))
+            if self._on_registered_cb:
+                self._on_registered_cb(mode)
+
+        def on_error(error):
+            logger.error('Failed to register advertisement: {}'.format(error))
+            if self._registered is advertisement:
+                self._registered = None
+
+        self._manager.RegisterAdvertisement(advertisement.get_path(), {},
+                                            reply_handler=on_registered, error_handler=on_error)
+
+    def _unregister(self):
+        if self._registered is None:
+            return
+        advertisement = self._registered
+        self._registered = None
+
+        def on_error(error):
+            logger.debug('Failed to unregister advertisement: {}'.format(error))
+
+        self._manager.UnregisterAdvertisement(advertisement.get_path(),
+                                              reply_handler=lambda: None, error_handler=on_error)
@@ -5,17 +5,13 @@
 # See the Agreement for the specific terms and conditions of the Agreement.
 # Capitalized terms not defined in this file have the meanings given to them in the Agreement.
 #
-import dbus
 import logging.config
+import struct
+import time
 from agt.ble.messages_pb2 import ControlEnvelope
 from agt.ble.messages_pb2 import GET_DEVICE_INFORMATION, GET_DEVICE_FEATURES, NONE, BLUETOOTH_LOW_ENERGY
 from agt.util import log_bytes
 
-
-class NotSupportedException(dbus.exceptions.DBusException):
-    _dbus_error_name = 'org.bluez.Error.NotSupported'
-
-
 logger = logging.getLogger(__name__)
 
 """
@@ -42,6 +38,33 @@ class TransactionType:
     LAST_PACKET = 2
     CONTROL_PACKET = 3
 
+"""
+Precompiled packet headers
+https://developer.amazon.com/docs/alexa-gadgets-toolkit/packet-ble.html#header
+
+First packet:            Byte1, Byte2, Reserved, Total Length (16 bits), Length (8 or 16 bits)
+Continuation/Last packet: Byte1, Byte2, Length (8 or 16 bits)
+Ack packet:              Byte1, Byte2, Reserved, Length (=2), MsgType (0x01), ErrorCode
+"""
+_HEADERS = {
+    False: {False: struct.Struct('>BBB'), True: struct.Struct('>BBH')},
+    True: {False: struct.Struct('>BBBHB'), True: struct.Struct('>BBBHH')},
+}
+_ACK_PACKET = struct.Struct('>BBBBBB')
+_UINT16 = struct.Struct('>H')
+
+
+def _as_memoryview(payload):
+    """
+    Wrap the payload in a memoryview without copying it when it already supports the buffer protocol
+    """
+    if isinstance(payload, memoryview):
+        return payload
+    if isinstance(payload, (bytes, bytearray)):
+        return memoryview(payload)
+    # e.g. dbus.Array of dbus.Byte values
+    return memoryview(bytes(payload))
+
 """
 Protocol Version Packet
 https://developer.amazon.com/docs/alexa-gadgets-toolkit/bluetooth-le-settings.html#pvp
@@ -50,11 +73,16 @@ Gadget Developers can choose the appropriate values for these, please refer to t
 PROTOCOL_VERSION_PACKET_PREFIX = [0xfe, 0x03,  # 2 bytes for Protocol identifier 0XFE03
                                   0x03,  # 1 byte Major Version
                                   0x00]  # 1 byte Minor Version
-MTU_SIZE = [0x02, 0x00]  # 2 bytes MTU Size
+MTU_SIZE = [0x02, 0x00]  # 2 bytes MTU Size, used until the ATT MTU of the connection is known
 MAX_TRANSACTIONAL_SIZE = [0x13, 0x88]  # Max Transactional Data Size
 # 12 bytes Reserved
 PROTOCOL_VERSION_PACKET_SUFFIX = [0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
 
+# ATT header of a notification/write (opcode + handle) that is not available for the packet
+ATT_HEADER_SIZE = 3
+# Smallest ATT MTU allowed by the Bluetooth Core specification
+ATT_MIN_MTU = 23
+
 """"
 BLE Protocol implements the Bluetooth Low Energy protocol for Alexa Gadgets
 as defined here:
@@ -67,34 +95,107 @@ the gadget and the Alexa Device
 
 class BLEProtocol:
     def __init__(self, endpoint_id, friendly_name, amazon_device_type, data_received_cb, on_data_ready_cb):
-        self._packetizer = Packetizer(MTU_SIZE)
+        self._packetizer = Packetizer(MTU_SIZE, zero_copy=True)
+        self._default_mtu = self._packetizer.max_payload_size
+        self._att_mtu = None
+        # packet size reported by the protocol version packet sent on the current connection, None until sent
+        self._announced_mtu = None
         self.control_stream_parser = ControlMessageParser(endpoint_id, friendly_name, amazon_device_type)
         self._data_received_cb = data_received_cb
         self._on_data_ready_cb = on_data_ready_cb
+        # called with the seconds from the last packet of an Alexa stream transaction to its ACK
+        self.ack_observer = None
+        # Tracer recording the reassembly and the ACK of the packets, see agt.tracing
+        self.tracer = None
+        # CaptureWriter recording the packets written and notified over GATT, see agt.capture
+        self.capture = None
 
     def data_received(self, payload):
-        data, stream_id, ack, tx_id = self._packetizer.deserialize(bytearray(payload))
+        received = time.perf_counter() if self.ack_observer is not None else None
+        span = self.tracer.start() if self.tracer is not None else None
+        data, stream_id, ack, tx_id = self._packetizer.deserialize(payload)
+        if span is not None:
+            self.tracer.stop(span, 'ble.deserialize', size=len(payload), complete=data is not None)
         if data is not None:
-            logger.debug("===========StreamID:%d==========" % stream_id)
+            logger.debug("===========StreamID:%d==========", stream_id)
+            if int(stream_id) == AppStreams.ALEXA_STREAM_ID:
+                # acknowledge the transaction before handing it over, however long the gadget takes with it
+                self.send_transport_ack(stream_id, ack, tx_id)
+                if received is not None:
+                    self.ack_observer(time.perf_counter() - received)
+                self._data_received_cb(data)
+                return
             if int(stream_id) == AppStreams.CONTROL_STREAM_ID:
                 control_msg_resp, parsed_input = self.control_stream_parser.parse_payload(bytearray(data))
                 if control_msg_resp is not None:
                     log_bytes(control_msg_resp)
                     self.send_data(control_msg_resp, AppStreams.CONTROL_STREAM_ID)
-            elif int(stream_id) == AppStreams.ALEXA_STREAM_ID:
-                self._data_received_cb(data)
             self.send_transport_ack(stream_id, ack, tx_id)
 
+    def set_mtu(self, att_mtu):
+        """
+        Resize the packets to the ATT MTU negotiated by BlueZ for the current connection.
+
+        Without AcquireNotify the protocol version packet goes out on StartNotify, before the first WriteValue
+        reports the MTU: an updated protocol version packet is sent when the packet size changes after it.
+
+        :param att_mtu: negotiated ATT MTU, as reported in the 'mtu' option of WriteValue/AcquireWrite/AcquireNotify
+        """
+        att_mtu = int(att_mtu)
+        if att_mtu == self._att_mtu:
+            return
+        if att_mtu < ATT_MIN_MTU:
+            logger.warning('Ignoring invalid ATT MTU: %d', att_mtu)
+            return
+        self._att_mtu = att_mtu
+        # a packet can't be larger than the maximum length of an attribute value
+        self._packetizer.max_payload_size = min(att_mtu - ATT_HEADER_SIZE, self._default_mtu)
+        logger.debug('ATT MTU %d negotiated, packet size set to %d', att_mtu, self._packetizer.max_payload_size)
+        if self._announced_mtu is not None and self._announced_mtu != self._packetizer.max_payload_size:
+            self.gadget_ready()
+
+    def get_mtu(self):
+        """
+        Returns the maximum packet size currently used on the connection
+        """
+        return self._packetizer.max_payload_size
+
+    def connection_closed(self):
+        """
+        Reset the per connection state, the MTU is negotiated again on the next connection
+        """
+        self._att_mtu = None
+        self._announced_mtu = None
+        self._packetizer.max_payload_size = self._default_mtu
+        self._packetizer.init_streams()
+        self._packetizer.reset_stats()
+
+    def get_stats(self):
+        """
+        Returns the per connection MTU and fragmentation counters
+        """
+        return {
+            'att_mtu': self._att_mtu,
+            'packet_size': self._packetizer.max_payload_size,
+            'transactions_sent': self._packetizer.transactions_sent,
+            'packets_sent': self._packetizer.packets_sent,
+            'fragmented_transactions_sent': self._packetizer.fragmented_transactions_sent,
+            'dropped_transactions': self._packetizer.dropped_transactions,
+        }
+
     def send_transport_ack(self, stream_id, ack, tx_id):
             if int(ack) == 1:
                 logger.debug('sending Transport ack')
-                sequences = self._packetizer.create_ack_message(int(ack), stream_id, tx_id)
-                self._on_data_ready_cb(sequences)
+                span = self.tracer.start() if self.tracer is not None else None
+                for sequence in self._packetizer.create_ack_message(int(ack), stream_id, tx_id):
+                    self._on_data_ready_cb(sequence)
+                if span is not None:
+                    self.tracer.stop(span, 'ble.ack', stream=stream_id)
 
     def send_data(self, message, stream_id=AppStreams.ALEXA_STREAM_ID):
         if message is not None:
             sequences = self._packetizer.serialize(message, stream_id)
-            logger.debug('total sequences to be sent:' + str(len(sequences)))
+            logger.debug('total sequences to be sent: %d', len(sequences))
             for sequence in sequences:
                 self._on_data_ready_cb(sequence)
 
@@ -106,7 +207,11 @@ class BLEProtocol:
 
     def gadget_ready(self):
         logger.debug('gadget ready, sending protocol version update')
-        protocol_version_packet = PROTOCOL_VERSION_PACKET_PREFIX + MTU_SIZE + MAX_TRANSACTIONAL_SIZE + PROTOCOL_VERSION_PACKET_SUFFIX
+        self._announced_mtu = self.get_mtu()
+        mtu_size = list(self._announced_mtu.to_bytes(2, byteorder='big'))
+        # bytes, the acquired notify socket does not take a list
+        protocol_version_packet = bytes(PROTOCOL_VERSION_PACKET_PREFIX + mtu_size + MAX_TRANSACTIONAL_SIZE +
+                                        PROTOCOL_VERSION_PACKET_SUFFIX)
         log_bytes(protocol_version_packet)
         self._on_data_ready_cb(protocol_version_packet)
 
@@ -136,7 +241,7 @@ class ControlMessageParser:
                 logger.debug('======= Feature Query ======')
                 return self._create_feature_query_response(), msg_parser
             else:
-                logger.debug('CommandID:' + str(msg_parser.command))
+                logger.debug('CommandID: %s', msg_parser.command)
 
         except Exception as e:
             logger.error('exception:' + str(e.message))
@@ -168,21 +273,55 @@ class ControlMessageParser:
         except Exception as e:
             logger.error('exception:' + str(e))
 
+"""
+Reassembly limits for multi-packet transactions received from the Echo device.
+At most MAX_IN_FLIGHT_SIZE bytes are held for partially received transactions, and
+a transaction that has not completed within TRANSACTION_TIMEOUT seconds is dropped.
+"""
+MAX_IN_FLIGHT_SIZE = 4 * int.from_bytes(MAX_TRANSACTIONAL_SIZE, byteorder='big')
+TRANSACTION_TIMEOUT = 10
+
+
+class _Transaction:
+    """
+    Partially received transaction, reassembled into a buffer sized from the total length of its first packet
+    """
+    __slots__ = ('buffer', 'offset', 'next_seq_no', 'deadline')
+
+    def __init__(self, total_length, deadline):
+        self.buffer = bytearray(total_length)
+        self.offset = 0
+        self.next_seq_no = 0
+        self.deadline = deadline
+
+
 class Packetizer:
-    def __init__(self, max_payload_size):
+    def __init__(self, max_payload_size, zero_copy=False,
+                 max_in_flight_size=MAX_IN_FLIGHT_SIZE, transaction_timeout=TRANSACTION_TIMEOUT):
         self.max_payload_size = int.from_bytes(max_payload_size, byteorder='big')
+        # zero copy mode hands out memoryview slices instead of bytearray copies
+        self.zero_copy = zero_copy
         # Rx params
-        self.pending_read = {}
+        self.max_in_flight_size = max_in_flight_size
+        self.transaction_timeout = transaction_timeout
         self.init_streams()
 
         # Tx params
         self.transaction_id = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.dropped_transactions = 0
+        self.transactions_sent = 0
+        self.packets_sent = 0
+        self.fragmented_transactions_sent = 0
 
     def init_streams(self):
-        self.pending_read = {
-            str(AppStreams.CONTROL_STREAM_ID): bytearray(),
-            str(AppStreams.ALEXA_STREAM_ID): bytearray(),
-        }
+        # partially received transactions keyed by (stream_id, transaction_id)
+        self._transactions = {}
+        self._in_flight_size = 0
+        # keys of the dropped transactions, whose remaining packets are dropped without a warning each
+        self._dropped_keys = set()
 
     """
     https://developer.amazon.com/docs/alexa-gadgets-toolkit/packet-ble.html#header
@@ -192,40 +331,19 @@ class Packetizer:
     |--------Byte1-----------|------------Byte2----------------------|-----Byte3----|---Byte4---|-----Byte5----|--Byte6--|
     """
     def create_ack_message(self, ack, stream_id, tx_id):
-        sequences = [None]
-        sequence = bytearray()
-
-        # Byte1: StreamID, Transaction ID
-        sequence += bytes([((stream_id << 4) & 0xF0) | (tx_id & 0x0F)])
         seq_no = 0
 
-        # Total Length of ack packet 1 byte ACK/NACK, 2nd byte is Error Code
-        total_length = 2
-
         # Byte2: SeqNo, Transaction Type(11), reserved, length extender (0)
-        byte2 = (seq_no << 4) & 0xF0
-        tx_type = TransactionType.CONTROL_PACKET
-        byte2 = byte2 | ((tx_type << 2) & 0x0C)  # Control message
+        byte2 = ((seq_no << 4) & 0xF0) | ((TransactionType.CONTROL_PACKET << 2) & 0x0C)  # Control message
 
         # ACK bit
         if ack:
             byte2 = byte2 | (0x01 << 1)
 
-        sequence += bytes([byte2])
-
-        # if first packet add an empty byte (Reserved)
-        sequence += bytes([0x00])
-
-        # total transaction len (8 bits)
-        sequence += bytes([total_length & 0xFF])
-
-        byte5 = 0x01  # 0x01 for ACK/NACK
-        sequence += bytes([byte5 & 0xFF])
-
-        # Error Code
-        sequence += bytes([0x00])
-        sequences[seq_no] = sequence
-        return sequences
+        # Byte3 is reserved, total length of ack packet is 2: 1 byte ACK/NACK (0x01), 1 byte Error Code
+        sequence = bytearray(_ACK_PACKET.size)
+        _ACK_PACKET.pack_into(sequence, 0, ((stream_id << 4) & 0xF0) | (tx_id & 0x0F), byte2, 0x00, 2, 0x01, 0x00)
+        return [sequence]
 
     """
     https://developer.amazon.com/docs/alexa-gadgets-toolkit/packet-ble.html#header
@@ -238,7 +356,8 @@ class Packetizer:
         if not payload:
             logger.info("Empty payload received")
             return
-        payload = bytearray(payload)
+        # no copy is made of the payload until it is written into the output buffer
+        payload = _as_memoryview(payload)
 
         total_length = len(payload)
         """
@@ -249,33 +368,24 @@ class Packetizer:
         https://developer.amazon.com/docs/alexa-gadgets-toolkit/packet-ble.html#header
         """
         mtu = self.max_payload_size - 7
-        if mtu is 0:
+        if mtu <= 0:
             raise Exception('MTU value cannot be 0')
 
-        total_sequences = int(total_length/mtu + (1 if total_length%mtu != 0 else 0))
-
-        sequences = [None] * total_sequences
-        # start index
-        si = 0
-        # end index
-        ei = mtu if mtu < (total_length - si) else (total_length - si)
-        seq_no = 0
-
-        while si != ei:
-            sequence = bytearray()
-            sequence += bytes([((stream_id << 4) & 0xF0) | (self.transaction_id & 0x0F)])
-
-            # byte 2.
-            byte2 = (seq_no << 4) & 0xF0
+        total_sequences = total_length // mtu + (1 if total_length % mtu != 0 else 0)
+        byte1 = ((stream_id << 4) & 0xF0) | (self.transaction_id & 0x0F)
 
+        # Pick the header layout of every sequence up front so that all of them
+        # can be written into a single preallocated buffer
+        headers = []
+        buffer_size = total_length
+        for seq_no in range(total_sequences):
+            payload_length = min(mtu, total_length - seq_no * mtu)
             if seq_no == 0:
                 tx_type = TransactionType.FIRST_PACKET
             elif seq_no == total_sequences - 1:
                 tx_type = TransactionType.LAST_PACKET
             else:
                 tx_type = TransactionType.CONTINUATION_PACKET
-            byte2 = byte2 | ((tx_type << 2) & 0x0C)
-            payload_length = ei - si
             """
             Length extender
             ## https://developer.amazon.com/docs/alexa-gadgets-toolkit/packet-ble.html#header
@@ -283,33 +393,36 @@ class Packetizer:
             0: The packet's payload is 8 bits.
             1: The packet's payload is 16 bits.
             """
-            length_extension = False
-            if payload_length > 255:
-                byte2 = byte2 | 0x01
-                length_extension = True
-
-            sequence += bytes([byte2])
-
-            # if first packet add an empty byte (Reserved)
-            if tx_type == TransactionType.FIRST_PACKET:
-                sequence += bytes([0x00])
-
-                # total transaction len (16 bits)
-                sequence += bytes([(total_length >> 8) & 0xFF])
-                sequence += bytes([total_length & 0xFF])
-
-            if length_extension:
-                sequence += bytes([(payload_length >> 8) & 0xFF])
-            sequence += bytes([payload_length & 0xFF])
+            length_extension = payload_length > 255
+            header = _HEADERS[tx_type == TransactionType.FIRST_PACKET][length_extension]
+            byte2 = ((seq_no << 4) & 0xF0) | ((tx_type << 2) & 0x0C) | (0x01 if length_extension else 0x00)
+            headers.append((header, byte2, payload_length))
+            buffer_size += header.size
+
+        buffer = bytearray(buffer_size)
+        view = memoryview(buffer)
+        sequences = [None] * total_sequences
+        offset = 0
+        si = 0
+        for seq_no, (header, byte2, payload_length) in enumerate(headers):
+            start = offset
+            if seq_no == 0:
+                # first packet carries a reserved byte and the total transaction length (16 bits)
+                header.pack_into(buffer, offset, byte1, byte2, 0x00, total_length, payload_length)
+            else:
+                header.pack_into(buffer, offset, byte1, byte2, payload_length)
+            offset += header.size
             # finally add the payload
-            sequence = sequence + bytearray(payload[si:ei])
-            sequences[seq_no] = sequence
-            seq_no += 1
-
-            si = ei
-            ei = (mtu if mtu < (total_length - si) else (total_length - si)) + si
+            view[offset:offset + payload_length] = payload[si:si + payload_length]
+            offset += payload_length
+            si += payload_length
+            sequences[seq_no] = view[start:offset] if self.zero_copy else buffer[start:offset]
 
         self.transaction_id += 1
+        self.transactions_sent += 1
+        self.packets_sent += total_sequences
+        if total_sequences > 1:
+            self.fragmented_transactions_sent += 1
         return sequences
 
 
@@ -325,46 +438,160 @@ class Packetizer:
         count = 0
         if not payload:
             logger.info("Empty payload received")
-            return
-        payload = bytearray(payload)
+            return None, None, None, None
+        payload = _as_memoryview(payload)
+        if len(payload) < 2:
+            logger.warning('Dropping packet of %d bytes, shorter than a header', len(payload))
+            self.dropped_transactions += 1
+            return None, None, None, None
         stream_id, tx_id = self.parse_first_byte(payload[count])
         count += 1
 
         seq_no, tx_type, le, ack = self.parse_second_byte(payload[count])
         count += 1
 
+        header_size = count + (3 if tx_type == TransactionType.FIRST_PACKET else 0) + (2 if le == 1 else 1)
+        if len(payload) < header_size:
+            logger.warning('Dropping packet of stream %d, transaction %d: truncated header', stream_id, tx_id)
+            self._drop_transaction((stream_id, tx_id))
+            self._dropped_keys.add((stream_id, tx_id))
+            self.dropped_transactions += 1
+            return None, None, None, None
+
         # handle length extender separately
 
         if tx_type == TransactionType.FIRST_PACKET:
             # skip the reserved byte
             count += 1
             # this is present only in first packet
-            total_length = (payload[count] << 8) + payload[count+1]
+            total_length, = _UINT16.unpack_from(payload, count)
             count += 2
 
         # get the length of current payload
-        if str(le) == '1':
-            tx_length = (payload[count] << 8) + payload[count+1]
+        if le == 1:
+            tx_length, = _UINT16.unpack_from(payload, count)
             count += 2
         else:
             tx_length = payload[count]
             count += 1
 
         binary_payload = payload[count:count+tx_length]
+        if len(binary_payload) != tx_length:
+            logger.warning('Dropping truncated packet of stream %d, transaction %d', stream_id, tx_id)
+            self._drop_transaction((stream_id, tx_id))
+            self._dropped_keys.add((stream_id, tx_id))
+            self.dropped_transactions += 1
+            return None, None, None, None
 
         # first packet and no more packets
         if tx_type == TransactionType.FIRST_PACKET and tx_length == total_length:
             # first and only packet. Pass to the application
+            self._drop_transaction((stream_id, tx_id), count_drop=True)
+            if not self.zero_copy:
+                binary_payload = bytearray(binary_payload)
             return binary_payload, stream_id, ack, tx_id
-        elif tx_type == TransactionType.FIRST_PACKET or tx_type == TransactionType.CONTINUATION_PACKET:
+        elif tx_type == TransactionType.FIRST_PACKET:
             # first packet, but not the last
-            self.pending_read[str(stream_id)] = self.pending_read[str(stream_id)] + binary_payload
+            self._start_transaction((stream_id, tx_id), seq_no, total_length, binary_payload)
             return None, None, None, None
-        elif tx_type == TransactionType.LAST_PACKET:
+        elif tx_type == TransactionType.CONTINUATION_PACKET or tx_type == TransactionType.LAST_PACKET:
+            data = self._continue_transaction((stream_id, tx_id), seq_no, binary_payload,
+                                              tx_type == TransactionType.LAST_PACKET)
+            if data is None:
+                return None, None, None, None
             # Last packet. Send the complete packet to app
-            ret_arr = self.pending_read[str(stream_id)] + binary_payload
-            self.pending_read[str(stream_id)] = bytearray()
-            return ret_arr, stream_id, ack, tx_id
+            return data, stream_id, ack, tx_id
+        return None, None, None, None
+
+    def _start_transaction(self, key, seq_no, total_length, binary_payload):
+        """
+        Allocate the reassembly buffer of a new transaction from the total length of its first packet
+        """
+        now = time.monotonic()
+        # a new first packet replaces an unfinished transaction with the same id
+        self._drop_transaction(key, count_drop=True)
+        self._dropped_keys.discard(key)
+        self._expire_transactions(now)
+
+        if len(binary_payload) > total_length:
+            logger.warning('Dropping transaction %s: first packet is longer than total length %d', key, total_length)
+            self._dropped_keys.add(key)
+            self.dropped_transactions += 1
+            return
+        if self._in_flight_size + total_length > self.max_in_flight_size:
+            logger.warning('Dropping transaction %s: %d bytes would exceed the in-flight limit of %d bytes',
+                           key, total_length, self.max_in_flight_size)
+            self._dropped_keys.add(key)
+            self.dropped_transactions += 1
+            return
+
+        transaction = _Transaction(total_length, now + self.transaction_timeout)
+        self._transactions[key] = transaction
+        self._in_flight_size += total_length
+        self._append(transaction, seq_no, binary_payload)
+
+    def _continue_transaction(self, key, seq_no, binary_payload, last):
+        """
+        Append a continuation or last packet to its transaction.
+
+        :return: the reassembled payload once the last packet is received, None otherwise
+        """
+        transaction = self._transactions.get(key)
+        if transaction is None:
+            if key in self._dropped_keys:
+                # the drop of the transaction has been logged
+                logger.debug('Dropping packet %d of dropped transaction %s', seq_no, key)
+                if last:
+                    self._dropped_keys.discard(key)
+            else:
+                logger.warning('Dropping packet %d of unknown transaction %s', seq_no, key)
+            return None
+        if time.monotonic() > transaction.deadline:
+            logger.warning('Dropping transaction %s: timed out', key)
+            self._drop_transaction(key, count_drop=True)
+            return None
+        if seq_no != transaction.next_seq_no:
+            logger.warning('Dropping transaction %s: expected sequence %d, got %d',
+                           key, transaction.next_seq_no, seq_no)
+            self._drop_transaction(key, count_drop=True)
+            return None
+        if transaction.offset + len(binary_payload) > len(transaction.buffer):
+            logger.warning('Dropping transaction %s: payload exceeds total length %d', key, len(transaction.buffer))
+            self._drop_transaction(key, count_drop=True)
+            return None
+
+        self._append(transaction, seq_no, binary_payload)
+        if not last:
+            return None
+
+        self._drop_transaction(key)
+        if transaction.offset != len(transaction.buffer):
+            logger.warning('Dropping transaction %s: received %d of %d bytes',
+                           key, transaction.offset, len(transaction.buffer))
+            self.dropped_transactions += 1
+            return None
+        return transaction.buffer
+
+    @staticmethod
+    def _append(transaction, seq_no, binary_payload):
+        end = transaction.offset + len(binary_payload)
+        transaction.buffer[transaction.offset:end] = binary_payload
+        transaction.offset = end
+        # sequence numbers are 4 bits wide and wrap around
+        transaction.next_seq_no = (seq_no + 1) & 0x0F
+
+    def _drop_transaction(self, key, count_drop=False):
+        transaction = self._transactions.pop(key, None)
+        if transaction is not None:
+            self._in_flight_size -= len(transaction.buffer)
+            if count_drop:
+                self._dropped_keys.add(key)
+                self.dropped_transactions += 1
+
+    def _expire_transactions(self, now):
+        for key in [key for key, transaction in self._transactions.items() if now > transaction.deadline]:
+            logger.warning('Dropping transaction %s: timed out', key)
+            self._drop_transaction(key, count_drop=True)
 
     """
     Parse first byte of the header
@@ -6,18 +6,22 @@
 # Capitalized terms not defined in this file have the meanings given to them in the Agreement.
 #
 
-import binascii
+import collections
 import dbus
 import dbus.service
 import logging.config
-import select
 import subprocess
 import threading
 import uuid
 from dbus.mainloop.glib import DBusGMainLoop
 from gi.repository import GObject
+from gi.repository import GLib
+from agt.advertising_data import classic_eir
 from agt.base_adapter import BaseAdapter
+from agt.capture import FRAMING_BT, INBOUND, OUTBOUND
+from agt.bt_classic.spp import SPPPacket, SPPParser
 from agt.base_adapter import BUS_NAME, ADAPTER_INTERFACE, DBUS_OM_IFACE, DEVICE_INTERFACE
+from agt.hci import HCISocket, SCAN_DISABLED, SCAN_INQUIRY, SCAN_PAGE, read_bd_addr
 import bluetooth
 
 logger = logging.getLogger(__name__)
@@ -25,19 +29,11 @@ logger = logging.getLogger(__name__)
 """
 Constants
 """
-_STX = 0xF0  # Start transmission
-_ETX = 0xF1  # End transmission.
-_ESC = 0xF2  # Escape character to allow reserved characters.
-
-_RESERVED = [_STX, _ETX, _ESC]
-
-# Indicate no error.
-_ERR = 0x00
-# Hardcoded per documentation.
-_CMD = 0x02
-
 _SPP_CHANNEL = 4
 
+# Bytes that can be waiting to be written to the RFCOMM socket before send() applies backpressure
+SEND_QUEUE_HIGH_WATER_MARK = 64 * 1024
+
 """
 BlueZ constants
 """
@@ -49,10 +45,6 @@ DBUS_PROP_IFACE = 'org.freedesktop.DBus.Properties'
 
 IO_CAPABILITY = 'NoInputNoOutput'
 
-def _hciconfig(args):
-    return subprocess.run(['/usr/bin/sudo', '/bin/hciconfig'] + args, stdout=subprocess.PIPE)
-
-
 def _sdptool(args):
     return subprocess.run(['/usr/bin/sudo', '/usr/bin/sdptool'] + args, stdout=subprocess.PIPE)
 
@@ -93,10 +85,7 @@ class BluetoothAdapter(dbus.service.Object):
 
         :return: Host BD Address
         """
-        p = _hciconfig(['hci0'])
-        bdaddr = p.stdout.decode('utf-8').split('BD Address: ')[1].split(' ')[0]
-        bdaddr = bdaddr.replace(':', '').strip()
-        return bdaddr
+        return read_bd_addr()
 
     def start_server(self):
         """
@@ -116,22 +105,52 @@ class BluetoothAdapter(dbus.service.Object):
 
     def poll_server(self):
         """
-        Check the servers for connection/data.
+        Nothing to poll, the RFCOMM sockets are watched by the GLib main loop started by run().
 
         """
-        self._spp_server.poll()
+        pass
 
-    def send(self, data):
+    def send(self, data, block=False, timeout=None):
         """
         Send data to a server.
 
         :param data:
-
+        :param block: Wait for room in the send queue when it is above its high-water mark.
+        :param timeout: Maximum time to wait for room in seconds, None waits forever.
+        :return: True if the data was queued, False if it was dropped.
         """
         # Generate SPP packet before sending over SPP server
-        packet = _SPPPacket()
+        packet = SPPPacket()
         packet.payload = data
-        self._spp_server.send(packet.get())
+        queued = self._spp_server.send(packet.get(), block, timeout)
+        if not queued:
+            logger.warning('Dropped {} bytes, the send queue is full or not connected'.format(len(data)))
+        return queued
+
+    def get_stats(self):
+        """
+        Returns the send queue counters of the current connection
+        """
+        return self._spp_server.get_stats()
+
+    def set_ack_observer(self, observer):
+        """
+        Nothing to observe, SPP has no transport ACK.
+        """
+        pass
+
+    def set_tracer(self, tracer):
+        """
+        Traces the data read from the RFCOMM socket with tracer, see agt.tracing
+        """
+        self._spp_server.tracer = tracer
+
+    def set_capture(self, capture):
+        """
+        Records the data read from and written to the RFCOMM socket with capture, a CaptureWriter
+        """
+        capture.start_session(FRAMING_BT)
+        self._spp_server.capture = capture
 
     def set_discoverable(self, discoverable):
         """
@@ -140,7 +159,8 @@ class BluetoothAdapter(dbus.service.Object):
         :param discoverable: On/Off for discoverable.
         """
         if discoverable:
-            self._bluez_api.start_inbound_pairing_mode(self._gadget_friendly_name, self._create_eir())
+            eir = classic_eir(self._gadget_friendly_name, self._gadget_vendor_id, self._gadget_product_id)
+            self._bluez_api.start_inbound_pairing_mode(self._gadget_friendly_name, eir)
         else:
             self._bluez_api.stop_inbound_pairing_mode()
 
@@ -175,36 +195,80 @@ class BluetoothAdapter(dbus.service.Object):
     def run(self):
         self._bluez_api.run_dbus()
 
-    def _create_eir(self):
+
+class _SendQueue:
+    """
+    Data waiting to be written to the RFCOMM socket.
+
+    The data is kept as a deque of memoryviews of the data queued, a partial write only advances the
+    memoryview at the head of the queue, nothing is copied or joined.
+    The queue is not thread safe, _RFCOMMServer guards it with its condition.
+    """
+
+    def __init__(self, high_water_mark=SEND_QUEUE_HIGH_WATER_MARK):
+        """
+        :param high_water_mark: Size in bytes from which the queue is full.
         """
-        Create extended inquiry response.
+        self.high_water_mark = high_water_mark
+        self._chunks = collections.deque()
+        self._size = 0
+        self.reset_stats()
+
+    def __len__(self):
+        return self._size
+
+    def reset_stats(self):
+        self.queued_bytes = 0
+        self.sent_bytes = 0
+        self.dropped_bytes = 0
 
+    def is_full(self):
+        return self._size >= self.high_water_mark
+
+    def put(self, data):
         """
-        # Length, address, and actual name
-        eir = '{0:0{1}x}'.format(1 + len(self._gadget_friendly_name), 2)
-        eir += '09'
-        eir += binascii.hexlify(self._gadget_friendly_name.encode('utf8')).decode('utf-8')
+        Append data, unless the queue is full.
 
-        # Length, address, and actual UUID
-        eir += '11'
-        # Address for UUID data,
-        eir += '06'
-        eir += 'B7166825D15A949FED4E3A98B3D28860'
+        :param data: Bytes-like data, e.g. the bytearray of SPPPacket.get(). The queue takes it over without a
+        copy, it must not be modified after it is queued.
+        :return: True if the data was queued, False if it was dropped.
+        """
+        if self.is_full():
+            self.drop(data)
+            return False
+        if len(data):
+            self._chunks.append(memoryview(data))
+            self._size += len(data)
+            self.queued_bytes += len(data)
+        return True
 
-        # Length, address, and actual manufacturer data.
-        eir += '0b'
-        eir += 'ff'
-        # Vendor ID, Product ID, Amazon SIG VID, Amazon Gadget UUID
-        eir += self._gadget_vendor_id
-        eir += self._gadget_product_id
+    def drop(self, data):
+        """
+        Account for data that could not be queued.
+        """
+        self.dropped_bytes += len(data)
 
-        eir += '7101'
-        eir += '101515fe'
+    def peek(self):
+        """
+        :return: The memoryview at the head of the queue, or None if the queue is empty.
+        """
+        return self._chunks[0] if self._chunks else None
 
-        # End of data
-        eir += '00'
+    def consume(self, count):
+        """
+        Remove count bytes written from the head of the queue.
+        """
+        head = self._chunks[0]
+        if count >= len(head):
+            self._chunks.popleft()
+        else:
+            self._chunks[0] = head[count:]
+        self._size -= count
+        self.sent_bytes += count
 
-        return eir
+    def clear(self):
+        self._chunks.clear()
+        self._size = 0
 
 
 class _RFCOMMServer:
@@ -212,7 +276,8 @@ class _RFCOMMServer:
     RFCOMM server using pybluez
     """
 
-    def __init__(self, channel, data_handler_cb, on_connected_cb, on_disconnected_cb):
+    def __init__(self, channel, data_handler_cb, on_connected_cb, on_disconnected_cb,
+                 high_water_mark=SEND_QUEUE_HIGH_WATER_MARK):
         """
         Initializer a single server.
 
@@ -220,6 +285,7 @@ class _RFCOMMServer:
         :param data_handler_cb: Data sink.
         :param on_connected_cb: Connection success.
         :param on_disconnected_cb: Disconnection.
+        :param high_water_mark: Size in bytes of the send queue from which send() applies backpressure.
 
         """
         self._data_handler_cb = data_handler_cb
@@ -231,43 +297,60 @@ class _RFCOMMServer:
 
         self._socket = None
         self._info = None
-        self._send_queue = bytearray()
+        self._send_queue = _SendQueue(high_water_mark)
 
         self._send_queue_available = threading.Condition()
 
-        self._spp_parser = _Parser(self._data_handler_cb)
+        # GLib io watches of the server socket, and of the connected socket
+        self._server_watch = None
+        self._read_watch = None
+        self._write_watch = None
+
+        self._spp_parser = SPPParser(self._data_handler_cb)
+        # Tracer of the data read, see agt.tracing
+        self.tracer = None
+        # CaptureWriter of the data read and written, see agt.capture
+        self.capture = None
 
     def start(self):
         """
-        Start the server.
+        Start the server. Connections are accepted from the GLib main loop as soon as they come in.
 
         """
         self._server.bind(('', self._channel))
         self._server.listen(1)
+        self._watch_server()
 
-    def send(self, data):
+    def send(self, data, block=False, timeout=None):
         """
-        Send data, it is thread safe although there isn't any multi-threading.
+        Send data, it is thread safe. The data is written from the GLib main loop as soon as
+        the socket is writable.
 
-        :param data: Data to append, None will clear queue.
-        """
-        self._send_queue_available.acquire()
-        if data is None:
-            self._send_queue = bytearray()
-        elif self.is_connected():
-            self._send_queue += data
-        self._send_queue_available.release()
+        Once the send queue reaches its high-water mark, the data is dropped, or with block the
+        call waits until the queue drains below it. Never block from the GLib main loop, it is
+        the one draining the queue.
 
-    def poll(self):
-        """
-        Check the server for a connection or data.
-
-        """
-        if self.is_connected():
-            self._poll_read()
-            self._poll_write()
-        else:
-            self._poll_connect()
+        :param data: Data to append, None will clear queue.
+        :param block: Wait for room in the send queue when it is full.
+        :param timeout: Maximum time to wait for room in seconds, None waits forever.
+        :return: True if the data was queued, False if it was dropped.
+        """
+        with self._send_queue_available:
+            if data is None:
+                self._send_queue.clear()
+                return True
+            if block:
+                self._send_queue_available.wait_for(
+                    lambda: not self.is_connected() or not self._send_queue.is_full(), timeout)
+            if not self.is_connected():
+                self._send_queue.drop(data)
+                return False
+            if not self._send_queue.put(data):
+                return False
+            if self._write_watch is None:
+                self._write_watch = GLib.io_add_watch(self._socket.fileno(), GLib.PRIORITY_DEFAULT,
+                                                      GLib.IO_OUT, self._on_writable)
+            return True
 
     def is_connected(self):
         """
@@ -284,9 +367,16 @@ class _RFCOMMServer:
         """
         if self._socket:
             prev_info = self._info
+            self._send_queue_available.acquire()
+            self._remove_watch('_read_watch')
+            self._remove_watch('_write_watch')
             self._socket.close()
             self._socket = None
             self._info = None
+            # wake up the blocked senders
+            self._send_queue_available.notify_all()
+            self._send_queue_available.release()
+            self._watch_server()
             self._on_disconnected_cb(prev_info[0])
 
     def get_connection_info(self):
@@ -300,33 +390,58 @@ class _RFCOMMServer:
         else:
             return None, None
 
-    def _poll_connect(self):
+    def get_stats(self):
+        """
+        Returns the send queue counters of the current connection, and the checksum failures since the start
         """
-        Poll the server to see if a connection is accepted.
+        with self._send_queue_available:
+            return {
+                'checksum_failures': self._spp_parser.checksum_failures,
+                'send_queue_size': len(self._send_queue),
+                'high_water_mark': self._send_queue.high_water_mark,
+                'queued_bytes': self._send_queue.queued_bytes,
+                'sent_bytes': self._send_queue.sent_bytes,
+                'dropped_bytes': self._send_queue.dropped_bytes,
+            }
 
+    def _watch_server(self):
         """
-        available, _, _ = select.select([self._server], [], [], 0)
+        Accept the next connection when it comes in.
 
-        if len(available):
-            self._connect()
+        """
+        if self._server_watch is None:
+            self._server_watch = GLib.io_add_watch(self._server.fileno(), GLib.PRIORITY_DEFAULT,
+                                                   GLib.IO_IN, self._on_acceptable)
+
+    def _remove_watch(self, name):
+        watch = getattr(self, name)
+        if watch is not None:
+            GLib.source_remove(watch)
+            setattr(self, name, None)
+
+    def _on_acceptable(self, fd, condition):
+        # only one connection at a time, stop watching the server until it is disconnected
+        self._server_watch = None
+        self._connect()
+        return False
 
     def _connect(self):
         self._socket, self._info = self._server.accept()
-        self.send(None)
+        with self._send_queue_available:
+            self._send_queue.clear()
+            self._send_queue.reset_stats()
+        self._read_watch = GLib.io_add_watch(self._socket.fileno(), GLib.PRIORITY_DEFAULT,
+                                             GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, self._on_readable)
         self._on_connected_cb(self._info[0])
 
-    def _poll_read(self):
-        """
-        Poll a connection to see if data is available or needs to be sent.
-
-        """
-        if self._socket is not None:
-            readable, _, _ = select.select([self._socket], [], [], 0)
-
-            if len(readable):
-                self._read()
+    def _on_readable(self, fd, condition):
+        self._read()
+        # keep watching while the connection is up
+        return self.is_connected()
 
     def _read(self):
+        tracer = self.tracer
+        span = tracer.start() if tracer is not None and tracer.begin() is not None else None
         data = bytes()
         try:
             data = self._socket.recv(1024)
@@ -335,159 +450,43 @@ class _RFCOMMServer:
             logger.debug('Bluetooth connection broken: {}'.format(e))
         finally:
             if len(data):
+                if self.capture is not None:
+                    self.capture.record(INBOUND, data)
                 self._spp_parser.parse(data)
             else:
                 self.disconnect()
+            if span is not None:
+                tracer.stop(span, 'rfcomm.read', size=len(data))
+                tracer.end()
 
-    def _poll_write(self):
-        if self._socket is not None:
-            _, writable, _ = select.select([], [self._socket], [], 0)
-
-            if len(writable):
-                self._write()
+    def _on_writable(self, fd, condition):
+        self._write()
+        self._send_queue_available.acquire()
+        # stop watching once the queue is empty, send() watches the socket again
+        keep_watching = self.is_connected() and len(self._send_queue) > 0
+        if not keep_watching:
+            self._write_watch = None
+        self._send_queue_available.release()
+        return keep_watching
 
     def _write(self):
-        count = 0
-        try:
-            self._send_queue_available.acquire()
-            if len(self._send_queue):
-                count = self._socket.send(bytes(self._send_queue))
-        except bluetooth.btcommon.BluetoothError as e:
-            # Indicates a broken connection.
-            logger.debug('Bluetooth connection broken: {}'.format(e))
+        broken = False
+        with self._send_queue_available:
+            chunk = self._send_queue.peek()
+            if chunk is not None:
+                try:
+                    count = self._socket.send(chunk)
+                except bluetooth.btcommon.BluetoothError as e:
+                    # Indicates a broken connection.
+                    logger.debug('Bluetooth connection broken: {}'.format(e))
+                    broken = True
+                else:
+                    if self.capture is not None:
+                        self.capture.record(OUTBOUND, chunk[:count])
+                    self._send_queue.consume(count)
+                    self._send_queue_available.notify_all()
+        if broken:
             self.disconnect()
-        finally:
-            self._send_queue = self._send_queue[count:]
-            self._send_queue_available.release()
-
-
-class _Parser:
-    """
-    The Parser class will handle the standard SPP packet.
-    """
-
-    def __init__(self, payload_cb):
-        """
-        Initialize
-
-        :param payload_cb: Callback to send a completed payload.
-        """
-        self._payload_cb = payload_cb
-        self._data = bytearray()
-        self._state = self._state_find_stx
-        self._packet = None
-
-    def parse(self, data):
-        """
-        Parse incoming data, will call the payload cb when a packet is found.
-
-        :param data: New data.
-        """
-        self._data += bytearray(data)
-        while len(self._data):
-            self._state(self._data.pop(0))
-
-    def _start_packet(self):
-        """
-        Begin a new packet.
-
-        """
-        self._packet = _SPPPacket()
-        self._state = self._state_get_command_id
-
-    def _state_find_stx(self, c):
-        """
-        Find start transmission (STX) character.   Followed by state_get_command_id()
-
-        :param c: Char to parse
-        """
-        if c == _STX:
-            self._start_packet()
-
-    def _state_get_command_id(self, c):
-        """
-        Accept command id character.   Followed by state_get_error_id().
-        Will drop back to start if STX is found.
-
-        :param c: Char to parse
-        """
-        if c == _STX:
-            self._start_packet()
-        else:
-            self._packet.command_id = c
-            self._state = self._state_get_error_id
-
-    def _state_get_error_id(self, c):
-        """
-        Accept error id character.   Followed by state_get_seq_id().
-        Will drop back to start if STX is found.
-
-        :param c: Char to parse
-        """
-        if c == _STX:
-            self._start_packet()
-        else:
-            self._packet.error_id = c
-            self._state = self._state_get_seq_id
-
-    def _state_get_seq_id(self, c):
-        """
-        Accept sequence id character.   Followed by state_get_data().
-        Will drop back to start if STX is found.
-
-        :param c: Char to parse
-        """
-        if c == _STX:
-            self._start_packet()
-        elif c == _ESC:
-            self._state = self._state_get_seq_id_escaped
-        else:
-            self._packet.sequence_id = c
-            self._state = self._state_get_data
-
-    def _state_get_seq_id_escaped(self, c):
-        """
-        Accept a single escaped character (seq_id can also be escaped)
-
-        :param c: Char to parse
-        """
-
-        self._packet.sequence_id = _ESC ^ c
-        self._state = self._state_get_data
-
-    def _state_get_data(self, c):
-        """
-        Accept payload.  This could be an escaped character (state_get_escaped()
-        Will drop back to start if STX is found, and validate checksum and send payload if ETX is found.
-
-        :param c: Char to parse
-        """
-        if c == _STX:
-            self._start_packet()
-        elif c == _ESC:
-            self._state = self._state_get_escaped
-        elif c == _ETX:
-            # Last two bytes are checksum
-            if len(self._packet.payload) >= 2:
-                found_checksum = self._packet.payload.pop() + (self._packet.payload.pop() << 8)
-                # Then get actual
-                calc_checksum = self._packet._calc_checksum()
-
-                if found_checksum == calc_checksum:
-                    self._payload_cb(self._packet.payload)
-
-            self._state = self._state_find_stx
-        else:
-            self._packet.payload.append(c)
-
-    def _state_get_escaped(self, c):
-        """
-        Accept a single escaped character.
-
-        :param c: Char to parse
-        """
-        self._packet.payload.append(_ESC ^ c)
-        self._state = self._state_get_data
 
 
 def _create_service_records():
@@ -593,81 +592,16 @@ def _create_service_records():
     _create_record('/bluez3', _create_channel_xml('0x1201', _SPP_CHANNEL))
 
 
-class _SPPPacket:
-    _SEQ_ID = 0
-
-    def __init__(self):
-        """
-        Create SPP packet.
-        """
-        self.payload = bytearray()
-        self.command_id = None
-        self.error_id = None
-
-    def get(self):
-        """
-        Create a full packet from payload.
-
-        """
-        header = self._get_header()
-        self.command_id = _CMD
-        self.error_id = _ERR
-        checksum = self._calc_checksum()
-        payload_to_escape = self.payload + bytearray([checksum >> 8, checksum & 0xFF])
-        payload_escaped = bytearray()
-        for b in payload_to_escape:
-            if b in _RESERVED:
-                payload_escaped.append(_ESC)
-                payload_escaped.append(_ESC ^ b)
-            else:
-                payload_escaped.append(b)
-        payload_escaped.append(_ETX)
-
-        return header + payload_escaped
-
-    def _calc_header_checksum(self):
-        return self.command_id + self.error_id
-
-    def _get_header(self):
-        return bytearray([_STX, _CMD, _ERR, self._get_sequence_id()])
-
-    def _calc_checksum(self):
-        """
-        Calculate the payload checksum.
-
-        """
-        payload_sum = sum(self.payload)
-        checksum = payload_sum + self._calc_header_checksum()
-
-        return checksum & 0xFFFF
-
-    @staticmethod
-    def _get_sequence_id():
-        """
-        Create a sequence id.
-
-        :return: Sequence id.
-        """
-        retval = _SPPPacket._SEQ_ID
-
-        while True:
-            _SPPPacket._SEQ_ID += 1
-            _SPPPacket._SEQ_ID &= 0xFF
-
-            if _SPPPacket._SEQ_ID not in _RESERVED:
-                break
-
-        return retval
-
 class _BlueZAPI(dbus.service.Object, BaseAdapter):
     """
     A python wrapper for BlueZ dbus APIs
     """
 
     def __init__(self):
+        self._hci = HCISocket()
         # sspmode (Simple Secure Pairing Mode) should always be 1.
         # 0 indicates the legacy pairing using pin code.
-        _hciconfig(['hci0', 'sspmode', '1'])
+        self._hci.write_simple_pairing_mode(True)
 
         # initialize Mainloop
         DBusGMainLoop(set_as_default=True)
@@ -739,13 +673,13 @@ class _BlueZAPI(dbus.service.Object, BaseAdapter):
         '''
 
         # hci commands to configure EIR
-        _hciconfig(['hci0', 'reset'])
-        _hciconfig(['hci0', 'name', friendly_name])
+        self._hci.reset()
+        self._hci.write_local_name(friendly_name)
         # mode 2 means inq with EIR
-        _hciconfig(['hci0', 'inqmode', '2'])
-        _hciconfig(['hci0', 'inqdata', eir])
+        self._hci.write_inquiry_mode(2)
+        self._hci.write_ext_inquiry_response(eir)
         # piscan means both page scan and inquire scan
-        _hciconfig(['hci0', 'piscan'])
+        self._hci.set_scan(SCAN_PAGE | SCAN_INQUIRY)
         # btm commands to configure pairing mode
         self._bluez_agent_manager.RegisterAgent(BLUEZ_AGENT_PATH, IO_CAPABILITY)
         self._bluez_agent_manager.RequestDefaultAgent(BLUEZ_AGENT_PATH)
@@ -755,7 +689,7 @@ class _BlueZAPI(dbus.service.Object, BaseAdapter):
     def stop_inbound_pairing_mode(self):
         self._bluez_properties.Set(ADAPTER_INTERFACE, 'Discoverable', False)
         self._bluez_properties.Set(ADAPTER_INTERFACE, 'Pairable', False)
-        _hciconfig(['hci0', 'noscan'])
+        self._hci.set_scan(SCAN_DISABLED)
 
     def is_paired_to_address(self, bd_addr):
         return super(_BlueZAPI, self).is_paired_to_address(bd_addr)
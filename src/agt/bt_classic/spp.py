@@ -0,0 +1,236 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+"""
+SPP packet framing, shared by the Classic Bluetooth transport and the loopback transport
+"""
+STX = 0xF0  # Start transmission
+ETX = 0xF1  # End transmission.
+ESC = 0xF2  # Escape character to allow reserved characters.
+
+RESERVED = [STX, ETX, ESC]
+# Reserved characters and their escaped form, ESC first
+_ESCAPES = [(bytes([c]), bytes([ESC, ESC ^ c])) for c in [ESC, STX, ETX]]
+
+# Indicate no error.
+ERR = 0x00
+# Hardcoded per documentation.
+CMD = 0x02
+
+
+class SPPParser:
+    """
+    The Parser class will handle the standard SPP packet.
+
+    |STX|CMD|ERR|SEQ|PAYLOAD...|CHECKSUM (16 bits)|ETX|
+
+    SEQ, PAYLOAD and CHECKSUM are escaped: a reserved character is sent as ESC followed by (ESC ^ character).
+    An unescaped STX anywhere in a packet restarts the packet.
+    """
+
+    def __init__(self, payload_cb):
+        """
+        Initialize
+
+        :param payload_cb: Callback to send a completed payload.
+        """
+        self._payload_cb = payload_cb
+        # Data of the current packet not parsed yet, or None while looking for STX
+        self._data = None
+        # (command id, error id) of the current packet, None until its header is parsed
+        self._header = None
+        # Un-escaped payload and checksum of the current packet received so far
+        self._payload = None
+        self.checksum_failures = 0
+
+    def parse(self, data):
+        """
+        Parse incoming data, will call the payload cb when a packet is found.
+
+        A packet split across several calls is un-escaped as it arrives, each byte is only looked at once.
+
+        :param data: New data.
+        """
+        if self._data is None:
+            start = data.find(STX)
+            if start < 0:
+                return
+            self._data = bytearray(data[start + 1:])
+        else:
+            self._data += data
+
+        while self._data is not None and self._parse_packet():
+            pass
+
+    def _restart(self, data, end):
+        """
+        Start a new packet after the STX at end.
+        """
+        self._header = None
+        del data[:end + 1]
+
+    def _parse_packet(self):
+        """
+        Parse the packet at the start of the buffer.
+
+        :return: True if parsing should continue with the rest of the buffer, False if more data is needed.
+        """
+        data = self._data
+
+        if self._header is None:
+            # Command id and error id are never escaped, only STX is reserved for them.
+            for i in range(min(3, len(data))):
+                if data[i] == STX:
+                    self._restart(data, i)
+                    return True
+            if len(data) < 3:
+                return False
+            if data[2] == ESC:
+                if len(data) < 4:
+                    return False
+                # the sequence id is not used, the escaped character is accepted even if it is STX
+                body_start = 4
+            else:
+                body_start = 3
+            self._header = (data[0], data[1])
+            self._payload = bytearray()
+            del data[:body_start]
+
+        # Un-escape up to the unescaped STX or ETX ending the packet, keeping a trailing ESC for the next call.
+        payload = self._payload
+        pos = 0
+        next_stx = data.find(STX)
+        next_etx = data.find(ETX)
+        while True:
+            end = min(next_stx if next_stx >= 0 else len(data), next_etx if next_etx >= 0 else len(data))
+            esc = data.find(ESC, pos, end)
+            if esc < 0:
+                break
+            payload += data[pos:esc]
+            if esc + 1 >= len(data):
+                del data[:esc]
+                return False
+            payload.append(ESC ^ data[esc + 1])
+            pos = esc + 2
+            # the escaped character can't end the packet
+            if next_stx == esc + 1:
+                next_stx = data.find(STX, pos)
+            if next_etx == esc + 1:
+                next_etx = data.find(ETX, pos)
+        payload += data[pos:end]
+        if end == len(data):
+            data.clear()
+            return False
+
+        if data[end] == STX:
+            # restart on STX
+            self._restart(data, end)
+            return True
+
+        # ETX found, last two bytes are checksum
+        command_id, error_id = self._header
+        self._header = None
+        self._payload = None
+        if len(payload) >= 2:
+            found_checksum = (payload[-2] << 8) + payload[-1]
+            del payload[-2:]
+            calc_checksum = (sum(payload) + command_id + error_id) & 0xFFFF
+            if found_checksum == calc_checksum:
+                self._payload_cb(payload)
+            else:
+                self.checksum_failures += 1
+
+        # look for the STX of the next packet
+        start = data.find(STX, end + 1)
+        if start < 0:
+            self._data = None
+            return False
+        del data[:start + 1]
+        return True
+
+
+def _escape(data):
+    """
+    Escape the reserved characters of data, returned as is when it doesn't contain any.
+
+    ESC is escaped first so that the escapes inserted for STX and ETX are not escaped again.
+    """
+    if STX not in data and ETX not in data and ESC not in data:
+        return data
+    data = bytes(data)
+    for reserved, escaped in _ESCAPES:
+        data = data.replace(reserved, escaped)
+    return data
+
+
+class SPPPacket:
+    _SEQ_ID = 0
+
+    def __init__(self):
+        """
+        Create SPP packet.
+        """
+        self.payload = bytearray()
+        self.command_id = None
+        self.error_id = None
+
+    def get(self):
+        """
+        Create a full packet from payload.
+
+        """
+        header = self._get_header()
+        self.command_id = CMD
+        self.error_id = ERR
+        checksum = self._calc_checksum()
+        payload_escaped = _escape(self.payload)
+        checksum_escaped = _escape(bytes([checksum >> 8, checksum & 0xFF]))
+
+        # header | escaped payload | escaped checksum | ETX, written into a single buffer
+        packet = bytearray(len(header) + len(payload_escaped) + len(checksum_escaped) + 1)
+        end = len(header)
+        packet[:end] = header
+        packet[end:end + len(payload_escaped)] = payload_escaped
+        end += len(payload_escaped)
+        packet[end:end + len(checksum_escaped)] = checksum_escaped
+        packet[-1] = ETX
+
+        return packet
+
+    def _calc_header_checksum(self):
+        return self.command_id + self.error_id
+
+    def _get_header(self):
+        return bytearray([STX, CMD, ERR, self._get_sequence_id()])
+
+    def _calc_checksum(self):
+        """
+        Calculate the payload checksum.
+
+        """
+        payload_sum = sum(self.payload)
+        checksum = payload_sum + self._calc_header_checksum()
+
+        return checksum & 0xFFFF
+
+    @staticmethod
+    def _get_sequence_id():
+        """
+        Create a sequence id.
+
+        :return: Sequence id.
+        """
+        retval = SPPPacket._SEQ_ID
+
+        while True:
+            SPPPacket._SEQ_ID += 1
+            SPPPacket._SEQ_ID &= 0xFF
+
+            if SPPPacket._SEQ_ID not in RESERVED:
+                break
+
+        return retval
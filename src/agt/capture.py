@@ -0,0 +1,250 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+import collections
+import logging.config
+import mmap
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+"""
+Capture file format, little endian:
+
+    MAGIC
+    record*
+
+    record: time (8 bytes, nanoseconds since the start of the session) | length (4 bytes) | kind (1 byte) | data
+
+A session record starts each session, its data is the wall clock time of the start in nanoseconds (8 bytes)
+followed by the framing in ASCII. The other records hold a frame exactly as it was read from or written to
+the transport: a BLE packet, or a chunk of the RFCOMM stream of SPP packets.
+"""
+MAGIC = b'AGTCAP1\n'
+_RECORD = struct.Struct('<QIB')
+_SESSION_INFO = struct.Struct('<Q')
+
+# Kinds of record
+INBOUND = 0
+OUTBOUND = 1
+_SESSION = 2
+
+# Framings of the captured frames, as the transport modes
+FRAMING_BLE = 'BLE'
+FRAMING_BT = 'BT'
+
+# A captured frame, at time seconds since the start of its session
+Frame = collections.namedtuple('Frame', ['time', 'direction', 'data'])
+
+
+class CaptureWriter:
+    """
+    Appends the frames read from and written to the transport to a capture file.
+
+    .. highlight:: python
+    .. code-block:: python
+
+        from agt import AlexaGadget, CaptureWriter
+
+        class MyGadget(AlexaGadget):
+            def __init__(self):
+                super().__init__(capture=CaptureWriter('/var/tmp/gadget.agtcap'))
+
+    The file is only appended to, each run of the gadget adds a session. Writes are buffered, pass buffering=0
+    to have every frame written as it is recorded.
+    """
+
+    def __init__(self, path, buffering=-1):
+        """
+        :param path: Capture file, created if it doesn't exist.
+        :param buffering: Buffer size of the file, see open().
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab', buffering=buffering)
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        else:
+            with open(path, 'rb') as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    self._file.close()
+                    raise Exception('{} is not a capture file'.format(path))
+        self._start = None
+        self.frames = 0
+
+    def start_session(self, framing):
+        """
+        Starts a new session, the transports call it when the capture is set.
+
+        :param framing: FRAMING_BLE or FRAMING_BT
+        """
+        info = _SESSION_INFO.pack(time.time_ns()) + framing.encode('ascii')
+        with self._lock:
+            self._start = time.monotonic_ns()
+            self._file.write(_RECORD.pack(0, len(info), _SESSION) + info)
+
+    def record(self, direction, data):
+        """
+        Appends a frame.
+
+        :param direction: INBOUND or OUTBOUND
+        :param data: Bytes-like data, or a list of byte values
+        """
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            data = bytes(data)
+        with self._lock:
+            if self._start is None or self._file.closed:
+                return
+            self._file.write(_RECORD.pack(time.monotonic_ns() - self._start, len(data), direction) + data)
+            self.frames += 1
+
+    def flush(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class CaptureSession:
+    """
+    Frames of a session of a capture file
+    """
+
+    def __init__(self, framing, start_time):
+        self.framing = framing
+        # wall clock time of the start, in seconds since the epoch
+        self.start_time = start_time
+        self.frames = []
+
+    def inbound(self):
+        """
+        Returns the frames read from the transport
+        """
+        return [frame for frame in self.frames if frame.direction == INBOUND]
+
+    def outbound(self):
+        """
+        Returns the frames written to the transport
+        """
+        return [frame for frame in self.frames if frame.direction == OUTBOUND]
+
+    def duration(self):
+        return self.frames[-1].time if self.frames else 0
+
+
+class CaptureReader:
+    """
+    Reads the sessions of a capture file, memory-mapped by default so that a large capture is not read at once.
+    A record truncated by a gadget which stopped while writing it ends the last session.
+    """
+
+    def __init__(self, path, use_mmap=True):
+        """
+        :param path: Capture file.
+        :param use_mmap: Memory-map the file instead of reading it.
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            if use_mmap and f.seek(0, 2) > 0:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                f.seek(0)
+                self._data = f.read()
+        if self._data[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise Exception('{} is not a capture file'.format(path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        """
+        Iterates over the records, as (kind, nanoseconds since the start of the session, data)
+        """
+        data = self._data
+        pos = len(MAGIC)
+        end = len(data)
+        while pos < end:
+            if pos + _RECORD.size > end:
+                logger.warning('%s: truncated record at offset %d', self.path, pos)
+                return
+            time_ns, length, kind = _RECORD.unpack_from(data, pos)
+            pos += _RECORD.size
+            if pos + length > end:
+                logger.warning('%s: truncated record at offset %d', self.path, pos - _RECORD.size)
+                return
+            yield kind, time_ns, data[pos:pos + length]
+            pos += length
+
+    def sessions(self):
+        """
+        Returns the sessions of the file, as CaptureSession
+        """
+        sessions = []
+        session = None
+        for kind, time_ns, data in self:
+            if kind == _SESSION:
+                start_time, = _SESSION_INFO.unpack_from(data)
+                session = CaptureSession(data[_SESSION_INFO.size:].decode('ascii'), start_time / 1e9)
+                sessions.append(session)
+            elif session is None:
+                logger.warning('%s: frame recorded outside of a session', self.path)
+            else:
+                session.frames.append(Frame(time_ns / 1e9, kind, data))
+        return sessions
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+
+def replay(frames, data_received, speed=1.0, direction=INBOUND):
+    """
+    Feeds captured frames to data_received, spaced as they were captured.
+
+    data_received is BLEProtocol.data_received or SPPParser.parse for the framing of the session, e.g. of a
+    gadget with the LOOPBACK_BLE or LOOPBACK_BT transport mode, or its LoopbackAdapter.echo_write to have
+    them read on the transport thread:
+
+    .. highlight:: python
+    .. code-block:: python
+
+        with CaptureReader('gadget.agtcap') as reader:
+            session = reader.sessions()[-1]
+        gadget = MyGadget(transport_mode=LOOPBACK_BLE if session.framing == FRAMING_BLE else LOOPBACK_BT)
+        ...
+        replay(session.frames, gadget.transport.echo_write, speed=10)
+
+    :param frames: Frames of a session, see CaptureSession.
+    :param data_received: Called with the data of each frame.
+    :param speed: How many times faster than captured, None to feed the frames as fast as possible.
+    :param direction: Direction of the frames fed, the others are skipped.
+    :return: Number of frames fed.
+    """
+    count = 0
+    start = time.monotonic()
+    first = None
+    for frame in frames:
+        if frame.direction != direction:
+            continue
+        if speed:
+            if first is None:
+                first = frame.time
+            delay = start + (frame.time - first) / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        data_received(frame.data)
+        count += 1
+    return count
@@ -0,0 +1,148 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+import collections
+import logging.config
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Default number of threads running the directive handlers, and of directives waiting for one
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_MAX_QUEUE_SIZE = 256
+
+
+class DirectiveExecutor:
+    """
+    Runs the directive handlers on a bounded pool of threads, so that a slow handler never blocks the transport.
+
+    The directives of a namespace run one at a time, in the order they were received, while the directives of
+    different namespaces run concurrently. At most max_queue_size directives wait for a thread, the ones
+    received past that are dropped.
+
+    .. highlight:: python
+    .. code-block:: python
+
+        from agt import AlexaGadget, DirectiveExecutor
+
+        class MyGadget(AlexaGadget):
+            def __init__(self):
+                super().__init__(directive_executor=DirectiveExecutor(max_workers=2))
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, max_queue_size=DEFAULT_MAX_QUEUE_SIZE):
+        """
+        :param max_workers: Number of threads running the handlers.
+        :param max_queue_size: Maximum number of directives waiting for a thread.
+        """
+        self.max_queue_size = max_queue_size
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='agt-directive')
+        self._lock = threading.Lock()
+        # calls waiting to run, by namespace; a namespace is in the pool queue only while it has calls waiting
+        self._pending = {}
+        self._queue_depth = 0
+        self.reset_stats()
+
+    def submit(self, namespace, fn, *args):
+        """
+        Queue a call to run after the calls of the same namespace submitted before it.
+
+        :return: True if the call was queued, False if it was dropped because the queue is full or the executor
+        is shut down.
+        """
+        with self._lock:
+            if self._queue_depth >= self.max_queue_size:
+                self.dropped += 1
+                return False
+            self._queue_depth += 1
+            self.submitted += 1
+            self.max_queue_depth = max(self.max_queue_depth, self._queue_depth)
+            calls = self._pending.get(namespace)
+            if calls is not None:
+                calls.append((fn, args))
+                return True
+            calls = self._pending[namespace] = collections.deque([(fn, args)])
+        try:
+            self._pool.submit(self._run_next, namespace)
+        except RuntimeError:
+            # shut down: the call is dropped, with the calls of its namespace queued after it in the meantime
+            with self._lock:
+                self.submitted -= 1
+                if self._pending.get(namespace) is calls:
+                    del self._pending[namespace]
+                    self._queue_depth -= len(calls)
+                    self.dropped += len(calls)
+                # otherwise shutdown() has already counted them as dropped
+            return False
+        return True
+
+    def shutdown(self, wait=True):
+        """
+        Stop running the calls, the ones still waiting are dropped.
+        """
+        with self._lock:
+            self.dropped += self._queue_depth
+            self._queue_depth = 0
+            self._pending.clear()
+        self._pool.shutdown(wait=wait)
+
+    def get_stats(self):
+        """
+        Returns the queue depth and the counters of the executor
+        """
+        with self._lock:
+            return {
+                'queue_depth': self._queue_depth,
+                'max_queue_depth': self.max_queue_depth,
+                'namespaces_pending': len(self._pending),
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'dropped': self.dropped,
+            }
+
+    def reset_stats(self):
+        self.max_queue_depth = self._queue_depth
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def _run_next(self, namespace):
+        with self._lock:
+            calls = self._pending.get(namespace)
+            if not calls:
+                return
+            fn, args = calls.popleft()
+            self._queue_depth -= 1
+
+        failed = False
+        try:
+            fn(*args)
+        except Exception:
+            failed = True
+            logger.exception('Exception running directive handler of %s', namespace)
+
+        with self._lock:
+            if failed:
+                self.failed += 1
+            else:
+                self.completed += 1
+            if calls:
+                # one call at a time, the namespace goes back to the end of the pool queue
+                requeue = self._pending.get(namespace) is calls
+            else:
+                requeue = False
+                if self._pending.get(namespace) is calls:
+                    del self._pending[namespace]
+        if requeue:
+            try:
+                self._pool.submit(self._run_next, namespace)
+            except RuntimeError:
+                # shut down in the meantime
+                pass
@@ -0,0 +1,255 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+import errno
+import fcntl
+import logging.config
+import socket
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+"""
+HCI constants
+https://www.bluetooth.com/specifications/specs/core-specification/ Vol 4, Part E
+"""
+BTPROTO_HCI = 1
+SOL_HCI = 0
+HCI_FILTER = 2
+
+HCI_COMMAND_PKT = 0x01
+HCI_EVENT_PKT = 0x04
+
+EVT_CMD_COMPLETE = 0x0E
+EVT_CMD_STATUS = 0x0F
+
+# Command groups
+OGF_HOST_CTL = 0x03
+OGF_INFO_PARAM = 0x04
+OGF_LE_CTL = 0x08
+
+# Controller & Baseband commands
+OCF_WRITE_LOCAL_NAME = 0x0013
+OCF_WRITE_INQUIRY_MODE = 0x0045
+OCF_WRITE_EXT_INQUIRY_RESPONSE = 0x0052
+OCF_WRITE_SIMPLE_PAIRING_MODE = 0x0056
+
+# Informational parameters
+OCF_READ_BD_ADDR = 0x0009
+
+# LE controller commands
+OCF_LE_SET_ADVERTISING_PARAMETERS = 0x0006
+OCF_LE_SET_ADVERTISING_DATA = 0x0008
+OCF_LE_SET_SCAN_RESPONSE_DATA = 0x0009
+OCF_LE_SET_ADVERTISE_ENABLE = 0x000A
+
+# Error codes
+HCI_COMMAND_DISALLOWED = 0x0C
+
+SCAN_DISABLED = 0x00
+SCAN_INQUIRY = 0x01
+SCAN_PAGE = 0x02
+
+# Device ioctls of the HCI socket, _IOW('H', nr, int)
+HCIDEVUP = 0x400448C9
+HCIDEVDOWN = 0x400448CA
+HCISETSCAN = 0x400448DD
+
+LOCAL_NAME_SIZE = 248
+EXT_INQUIRY_RESPONSE_SIZE = 240
+ADV_DATA_SIZE = 31
+
+# Seconds to wait for the controller to complete a command
+HCI_COMMAND_TIMEOUT = 2
+
+_COMMAND_HEADER = struct.Struct('<BHB')
+_EVENT_HEADER = struct.Struct('<BBB')
+_CMD_COMPLETE = struct.Struct('<BH')
+_CMD_STATUS = struct.Struct('<BBH')
+# struct hci_filter: type mask, event mask, opcode
+_FILTER = struct.Struct('<IIIH')
+# struct hci_dev_req: device id, option
+_DEV_REQ = struct.Struct('<HxxI')
+
+
+def opcode(ogf, ocf):
+    return (ogf << 10) | ocf
+
+
+class HCICommandError(Exception):
+    """
+    A command completed with an error status
+    """
+
+    def __init__(self, op, status):
+        super().__init__('HCI command 0x{:04x} failed with status 0x{:02x}'.format(op, status))
+        self.opcode = op
+        self.status = status
+
+
+class HCISocket:
+    """
+    Sends HCI commands to the controller over a raw AF_BLUETOOTH/BTPROTO_HCI socket, instead of spawning
+    hcitool or hciconfig, and waits for the Command Complete event of each command.
+
+    The socket can be injected, any object with send(), recv() and settimeout() will do.
+    """
+
+    def __init__(self, dev_id=0, sock=None, timeout=HCI_COMMAND_TIMEOUT):
+        """
+        :param dev_id: Index of the HCI device, 0 for hci0.
+        :param sock: Socket to use instead of opening the HCI device.
+        :param timeout: Seconds to wait for the controller to complete a command.
+        """
+        self.dev_id = dev_id
+        self.timeout = timeout
+        self._sock = sock
+
+    def open(self):
+        if self._sock is None:
+            sock = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_RAW, BTPROTO_HCI)
+            try:
+                sock.bind((self.dev_id,))
+                # only the events completing the commands are needed
+                event_mask = (1 << EVT_CMD_COMPLETE) | (1 << EVT_CMD_STATUS)
+                sock.setsockopt(SOL_HCI, HCI_FILTER, _FILTER.pack(1 << HCI_EVENT_PKT, event_mask, 0, 0))
+            except OSError:
+                sock.close()
+                raise
+            self._sock = sock
+        return self._sock
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def send_command(self, ogf, ocf, params=b''):
+        """
+        Send a command and wait for it to complete.
+
+        :param ogf: Command group.
+        :param ocf: Command.
+        :param params: Command parameters.
+        :return: Return parameters of the Command Complete event, after the status.
+        """
+        sock = self.open()
+        op = opcode(ogf, ocf)
+        sock.send(_COMMAND_HEADER.pack(HCI_COMMAND_PKT, op, len(params)) + bytes(params))
+
+        deadline = time.monotonic() + self.timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise Exception('HCI command 0x{:04x} timed out'.format(op))
+            sock.settimeout(remaining)
+            try:
+                event = sock.recv(260)
+            except socket.timeout:
+                continue
+            if len(event) < _EVENT_HEADER.size:
+                continue
+            packet_type, event_code, _ = _EVENT_HEADER.unpack_from(event)
+            if packet_type != HCI_EVENT_PKT:
+                continue
+            if event_code == EVT_CMD_COMPLETE:
+                _, event_op = _CMD_COMPLETE.unpack_from(event, _EVENT_HEADER.size)
+                if event_op != op:
+                    continue
+                result = event[_EVENT_HEADER.size + _CMD_COMPLETE.size:]
+                status = result[0] if result else 0
+                if status:
+                    raise HCICommandError(op, status)
+                return bytes(result[1:])
+            elif event_code == EVT_CMD_STATUS:
+                status, _, event_op = _CMD_STATUS.unpack_from(event, _EVENT_HEADER.size)
+                if event_op == op and status:
+                    raise HCICommandError(op, status)
+
+    def device_up(self):
+        """
+        Bring the device up, like `hciconfig hci0 up`
+        """
+        try:
+            fcntl.ioctl(self.open().fileno(), HCIDEVUP, self.dev_id)
+        except OSError as e:
+            if e.errno != errno.EALREADY:
+                raise
+
+    def device_down(self):
+        fcntl.ioctl(self.open().fileno(), HCIDEVDOWN, self.dev_id)
+
+    def reset(self):
+        """
+        Reset the device, like `hciconfig hci0 reset`, the kernel restores its state once the device is up
+        """
+        self.device_down()
+        self.device_up()
+
+    def set_scan(self, scan):
+        """
+        Set the page and inquiry scans, like `hciconfig hci0 piscan` or `hciconfig hci0 noscan`
+
+        :param scan: SCAN_DISABLED, or SCAN_INQUIRY and/or SCAN_PAGE.
+        """
+        fcntl.ioctl(self.open().fileno(), HCISETSCAN, _DEV_REQ.pack(self.dev_id, scan))
+
+    def read_bd_addr(self):
+        """
+        :return: The BD address of the device, as an hex string without separators, e.g. B827EB000000
+        """
+        result = self.send_command(OGF_INFO_PARAM, OCF_READ_BD_ADDR)
+        return ''.join('{:02X}'.format(b) for b in reversed(result[:6]))
+
+    def write_local_name(self, name):
+        name = name.encode('utf-8')[:LOCAL_NAME_SIZE]
+        self.send_command(OGF_HOST_CTL, OCF_WRITE_LOCAL_NAME, name.ljust(LOCAL_NAME_SIZE, b'\x00'))
+
+    def write_inquiry_mode(self, mode):
+        self.send_command(OGF_HOST_CTL, OCF_WRITE_INQUIRY_MODE, bytes([mode]))
+
+    def write_ext_inquiry_response(self, eir, fec_required=0):
+        if len(eir) > EXT_INQUIRY_RESPONSE_SIZE:
+            raise Exception('EIR is {} bytes, the maximum is {}'.format(len(eir), EXT_INQUIRY_RESPONSE_SIZE))
+        self.send_command(OGF_HOST_CTL, OCF_WRITE_EXT_INQUIRY_RESPONSE,
+                          bytes([fec_required]) + bytes(eir).ljust(EXT_INQUIRY_RESPONSE_SIZE, b'\x00'))
+
+    def write_simple_pairing_mode(self, enable):
+        self.send_command(OGF_HOST_CTL, OCF_WRITE_SIMPLE_PAIRING_MODE, bytes([1 if enable else 0]))
+
+    def le_set_advertising_parameters(self, params):
+        self.send_command(OGF_LE_CTL, OCF_LE_SET_ADVERTISING_PARAMETERS, params)
+
+    def le_set_advertising_data(self, data):
+        self.send_command(OGF_LE_CTL, OCF_LE_SET_ADVERTISING_DATA, _adv_data_params(data))
+
+    def le_set_scan_response_data(self, data):
+        self.send_command(OGF_LE_CTL, OCF_LE_SET_SCAN_RESPONSE_DATA, _adv_data_params(data))
+
+    def le_set_advertise_enable(self, enable):
+        self.send_command(OGF_LE_CTL, OCF_LE_SET_ADVERTISE_ENABLE, bytes([1 if enable else 0]))
+
+
+def _adv_data_params(data):
+    """
+    Advertising and scan response data parameters: significant length followed by the data padded to 31 bytes
+    """
+    if len(data) > ADV_DATA_SIZE:
+        raise Exception('Advertising data is {} bytes, the maximum is {}'.format(len(data), ADV_DATA_SIZE))
+    return bytes([len(data)]) + bytes(data).ljust(ADV_DATA_SIZE, b'\x00')
+
+
+def read_bd_addr(dev_id=0):
+    """
+    :return: The BD address of the device, as an hex string without separators, e.g. B827EB000000
+    """
+    hci = HCISocket(dev_id)
+    try:
+        return hci.read_bd_addr()
+    finally:
+        hci.close()
@@ -0,0 +1,484 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+Loopback transport and virtual Echo device, to run an AlexaGadget end to end without BlueZ or an Echo device.
+
+The gadget is created with the LOOPBACK_BLE or LOOPBACK_BT transport mode, a VirtualEcho is attached to its
+transport and exchanges with it the packets a real Echo device would, framed with the BLE Packetizer or as
+SPP packets:
+
+.. highlight:: python
+.. code-block:: python
+
+    gadget = MyGadget(transport_mode=LOOPBACK_BLE)
+    echo = VirtualEcho(gadget.transport)
+    gadget.start()
+    threading.Thread(target=gadget.transport.run, daemon=True).start()
+
+    echo.connect()
+    echo.discover()
+    echo.wait_for_events(1)
+"""
+import logging.config
+import queue
+import threading
+import time
+
+import agt.messages_pb2 as proto
+from agt.ble.protocol import AppStreams, BLEProtocol, Packetizer, MTU_SIZE, PROTOCOL_VERSION_PACKET_PREFIX, \
+    TransactionType
+from agt.bt_classic.spp import SPPPacket, SPPParser
+from agt.capture import INBOUND, OUTBOUND
+
+logger = logging.getLogger(__name__)
+
+# Framings of the loopback transport
+FRAMING_BLE = 'BLE'
+FRAMING_BT = 'BT'
+
+# Radio address of the gadget, and Bluetooth address of the virtual Echo device
+LOOPBACK_ADDRESS = '000000000000'
+VIRTUAL_ECHO_ADDRESS = '00:00:00:00:00:01'
+
+# Ack requested bit of the second byte of a BLE packet header
+_ACK_BIT = 0x02
+
+
+class LoopbackAdapter:
+    """
+    Transport of the gadget to a VirtualEcho in the same process, with the interface of the Bluetooth adapters.
+
+    Like the GLib main loop of the Bluetooth adapters, run() calls the gadget callbacks from its own thread:
+    the packets written by the VirtualEcho are queued to it. The packets sent by the gadget are handed to the
+    VirtualEcho on the sending thread.
+    """
+
+    def __init__(self,
+                 framing,
+                 gadget_endpoint_id,
+                 gadget_friendly_name,
+                 gadget_device_type,
+                 data_received_cb,
+                 on_connection_cb,
+                 on_disconnection_cb):
+        """
+        :param framing: FRAMING_BLE to packetize the data like the BLE transport, FRAMING_BT for SPP packets.
+        """
+        self.framing = framing
+        self._data_received_cb = data_received_cb
+        self._on_connection_cb = on_connection_cb
+        self._on_disconnection_cb = on_disconnection_cb
+        if framing == FRAMING_BLE:
+            self._protocol = BLEProtocol(gadget_endpoint_id, gadget_friendly_name, gadget_device_type,
+                                         data_received_cb, self._to_echo)
+        elif framing == FRAMING_BT:
+            self._spp_parser = SPPParser(data_received_cb)
+        else:
+            raise Exception('Invalid loopback framing: {}'.format(framing))
+        self._echo = None
+        self._events = queue.Queue()
+        self._connected_address = None
+        self._paired_addresses = set()
+        self.discoverable = False
+        self._tracer = None
+        self._capture = None
+
+    @staticmethod
+    def get_address():
+        """
+        Gets the BD Address of the host
+
+        :return: Host BD Address
+        """
+        return LOOPBACK_ADDRESS
+
+    def attach(self, echo):
+        """
+        Attach the VirtualEcho at the other end of the transport
+        """
+        self._echo = echo
+
+    def start_server(self):
+        pass
+
+    def stop_server(self):
+        self._events.put(None)
+
+    def poll_server(self):
+        pass
+
+    def run(self):
+        """
+        Call the gadget callbacks for the events of the VirtualEcho, until stop_server() is called
+        """
+        while True:
+            event = self._events.get()
+            if event is None:
+                return
+            try:
+                event()
+            except Exception:
+                logger.exception('Exception handling loopback event')
+
+    def send(self, data):
+        """
+        Send data
+
+        :param data: Data to append
+        :return: True if the data was sent, False if not connected.
+        """
+        if self._connected_address is None:
+            return False
+        if self.framing == FRAMING_BLE:
+            self._protocol.send_data(data)
+        else:
+            packet = SPPPacket()
+            packet.payload = data
+            self._to_echo(packet.get())
+        return True
+
+    def set_discoverable(self, discoverable):
+        self.discoverable = discoverable
+
+    def disconnect(self):
+        self._events.put(self._disconnected)
+
+    def is_connected(self):
+        return self._connected_address is not None
+
+    def reconnect(self, bd_addr):
+        # the VirtualEcho connects again right away, as an Echo device does when it sees the gadget advertising
+        if self._echo is not None and not self.is_connected():
+            self._echo.connect(wait=False)
+
+    def is_paired_to_address(self, bd_addr):
+        return bd_addr in self._paired_addresses
+
+    def unpair(self, bd_addr):
+        self._paired_addresses.discard(bd_addr)
+
+    def get_stats(self):
+        """
+        Returns the counters of the BLE protocol, or of the SPP parser
+        """
+        if self.framing == FRAMING_BLE:
+            return self._protocol.get_stats()
+        return {'checksum_failures': self._spp_parser.checksum_failures}
+
+    def set_ack_observer(self, observer):
+        """
+        Calls observer with the seconds from the last packet of each directive to its transport ACK, BLE framing only
+        """
+        if self.framing == FRAMING_BLE:
+            self._protocol.ack_observer = observer
+
+    def set_capture(self, capture):
+        """
+        Records the packets written by the VirtualEcho and sent by the gadget with capture, a CaptureWriter
+        """
+        capture.start_session(self.framing)
+        self._capture = capture
+
+    def set_tracer(self, tracer):
+        """
+        Traces the packets written by the VirtualEcho with tracer, see agt.tracing
+        """
+        self._tracer = tracer
+        if self.framing == FRAMING_BLE:
+            self._protocol.tracer = tracer
+
+    # ------------------------------------------------
+    # VirtualEcho side, called from any thread
+    # ------------------------------------------------
+
+    def echo_connect(self, address):
+        self._events.put(lambda: self._connected(address))
+
+    def echo_disconnect(self):
+        self._events.put(self._disconnected)
+
+    def echo_write(self, packet):
+        self._events.put(lambda: self._data_received(packet))
+
+    # ------------------------------------------------
+    # Helpers
+    # ------------------------------------------------
+
+    def _connected(self, address):
+        if self._connected_address is not None:
+            return
+        self._connected_address = address
+        self._paired_addresses.add(address)
+        self._on_connection_cb(address)
+        if self._echo is not None:
+            self._echo.on_connected()
+        if self.framing == FRAMING_BLE:
+            # the VirtualEcho enables the notifications as soon as it is connected
+            self._protocol.gadget_ready()
+
+    def _disconnected(self):
+        address = self._connected_address
+        if address is None:
+            return
+        self._connected_address = None
+        if self.framing == FRAMING_BLE:
+            self._protocol.connection_closed()
+        if self._echo is not None:
+            self._echo.on_disconnected()
+        self._on_disconnection_cb(address)
+
+    def _data_received(self, packet):
+        if self._connected_address is None:
+            return
+        if self._capture is not None:
+            self._capture.record(INBOUND, packet)
+        tracer = self._tracer
+        span = tracer.start() if tracer is not None and tracer.begin() is not None else None
+        try:
+            if self.framing == FRAMING_BLE:
+                self._protocol.data_received(packet)
+            else:
+                self._spp_parser.parse(packet)
+        finally:
+            if span is not None:
+                tracer.stop(span, 'loopback.read', size=len(packet))
+                tracer.end()
+
+    def _to_echo(self, packet):
+        if self._capture is not None:
+            self._capture.record(OUTBOUND, packet)
+        if self._echo is not None:
+            self._echo.on_packet(bytes(packet))
+
+
+class VirtualEcho:
+    """
+    Scriptable Echo device at the other end of a LoopbackAdapter.
+
+    It sends directives framed like a real Echo device does, at a given rate if needed, and records every event
+    the gadget sends back with the time it was received. The BLE packets of a directive request a transport ACK,
+    the ACKs and the protocol version packets of the gadget are counted.
+    """
+
+    def __init__(self, adapter, address=VIRTUAL_ECHO_ADDRESS):
+        """
+        :param adapter: LoopbackAdapter of the gadget.
+        :param address: Bluetooth address of the virtual Echo device.
+        """
+        self.address = address
+        self._adapter = adapter
+        self._framing = adapter.framing
+        if self._framing == FRAMING_BLE:
+            self._packetizer = Packetizer(MTU_SIZE)
+        else:
+            self._spp_parser = SPPParser(self._on_message)
+        self._condition = threading.Condition()
+        self._ready = False
+        # (time.monotonic(), directive) of the directives sent, and (time.monotonic(), event) of the events received
+        self.sent = []
+        self.events = []
+        self.acks = 0
+        self.protocol_versions = 0
+        adapter.attach(self)
+
+    def connect(self, wait=True, timeout=5):
+        """
+        Connect to the gadget.
+
+        :param wait: Return once the gadget is ready to receive directives, with the BLE framing that is once
+        it has sent its protocol version packet.
+        :return: True if the gadget is ready.
+        """
+        with self._condition:
+            self._ready = False
+        self._adapter.echo_connect(self.address)
+        if not wait:
+            return False
+        return self._wait(lambda: self._ready, timeout)
+
+    def disconnect(self):
+        self._adapter.echo_disconnect()
+
+    def send_directive(self, directive):
+        """
+        Send a directive to the gadget
+        """
+        message = proto.Message()
+        message.payload = directive.SerializeToString()
+        data = message.SerializeToString()
+        if self._framing == FRAMING_BLE:
+            packets = [bytearray(p) for p in self._packetizer.serialize(data, AppStreams.ALEXA_STREAM_ID)]
+            packets[-1][1] |= _ACK_BIT
+        else:
+            packet = SPPPacket()
+            packet.payload = data
+            packets = [packet.get()]
+        with self._condition:
+            self.sent.append((time.monotonic(), directive))
+        for packet in packets:
+            self._adapter.echo_write(bytes(packet))
+
+    def play(self, directives, rate=None, count=None):
+        """
+        Send directives in turn.
+
+        :param directives: Directives to send, cycled through until count directives have been sent.
+        :param rate: Directives per second, None sends them as fast as possible.
+        :param count: Number of directives to send, defaults to len(directives).
+        """
+        if count is None:
+            count = len(directives)
+        start = time.monotonic()
+        for i in range(count):
+            if rate:
+                delay = start + i / rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            self.send_directive(directives[i % len(directives)])
+
+    def discover(self):
+        self.send_directive(discover_directive())
+
+    def state_update(self, name, value):
+        self.send_directive(state_update_directive(name, value))
+
+    def speechmarks(self, visemes, player_offset=0):
+        self.send_directive(speechmarks_directive(visemes, player_offset))
+
+    def set_alert(self, token, alert_type, scheduled_time):
+        self.send_directive(set_alert_directive(token, alert_type, scheduled_time))
+
+    def delete_alert(self, token):
+        self.send_directive(delete_alert_directive(token))
+
+    def wait_for_events(self, count, timeout=5):
+        """
+        Wait until the gadget has sent count events in total.
+
+        :return: True if it has, False on timeout.
+        """
+        return self._wait(lambda: len(self.events) >= count, timeout)
+
+    def clear(self):
+        """
+        Forget the directives sent and the events received
+        """
+        with self._condition:
+            self.sent = []
+            self.events = []
+            self.acks = 0
+
+    # ------------------------------------------------
+    # Called by the LoopbackAdapter
+    # ------------------------------------------------
+
+    def on_packet(self, packet):
+        if self._framing == FRAMING_BT:
+            self._spp_parser.parse(packet)
+            return
+        if packet[:2] == bytes(PROTOCOL_VERSION_PACKET_PREFIX[:2]):
+            with self._condition:
+                self.protocol_versions += 1
+                self._ready = True
+                self._condition.notify_all()
+            return
+        if (packet[1] >> 2) & 0x03 == TransactionType.CONTROL_PACKET:
+            with self._condition:
+                self.acks += 1
+            return
+        data, stream_id, _, _ = self._packetizer.deserialize(packet)
+        if data is not None and stream_id == AppStreams.ALEXA_STREAM_ID:
+            self._on_message(data)
+
+    def on_connected(self):
+        with self._condition:
+            # with the BLE framing, the gadget is ready once it has sent its protocol version packet
+            if self._framing == FRAMING_BT:
+                self._ready = True
+            self._condition.notify_all()
+
+    def on_disconnected(self):
+        with self._condition:
+            self._ready = False
+            self._condition.notify_all()
+
+    # ------------------------------------------------
+    # Helpers
+    # ------------------------------------------------
+
+    def _on_message(self, data):
+        received = time.monotonic()
+        message = proto.Message()
+        message.ParseFromString(bytes(data))
+        event = proto.Event()
+        event.ParseFromString(message.payload)
+        with self._condition:
+            self.events.append((received, event))
+            self._condition.notify_all()
+
+    def _wait(self, predicate, timeout):
+        with self._condition:
+            return self._condition.wait_for(predicate, timeout)
+
+
+def discover_directive():
+    directive = proto.DiscoverDirective()
+    directive.header.namespace = 'Alexa.Discovery'
+    directive.header.name = 'Discover'
+    directive.payload.scope.type = 'BearerToken'
+    return directive
+
+
+def state_update_directive(name, value):
+    directive = proto.StateUpdateDirective()
+    directive.header.namespace = 'Alexa.Gadget.StateListener'
+    directive.header.name = 'StateUpdate'
+    state = directive.payload.states.add()
+    state.name = name
+    state.value = value
+    return directive
+
+
+def speechmarks_directive(visemes, player_offset=0):
+    """
+    :param visemes: Visemes of the speechmarks, 60 ms apart.
+    :param player_offset: Offset of the first speechmark in milliseconds.
+    """
+    directive = proto.SpeechmarksDirective()
+    directive.header.namespace = 'Alexa.Gadget.SpeechData'
+    directive.header.name = 'Speechmarks'
+    directive.payload.playerOffsetInMilliSeconds = player_offset
+    for i, viseme in enumerate(visemes):
+        mark = directive.payload.speechmarksData.add()
+        mark.type = 'VISEME'
+        mark.value = viseme
+        mark.startOffsetInMilliSeconds = player_offset + i * 60
+    return directive
+
+
+def set_alert_directive(token, alert_type, scheduled_time):
+    """
+    :param alert_type: TIMER, ALARM or REMINDER.
+    :param scheduled_time: ISO 8601 time of the alert, e.g. 2019-05-01T12:00:00+0000.
+    """
+    directive = proto.SetAlertDirective()
+    directive.header.namespace = 'Alerts'
+    directive.header.name = 'SetAlert'
+    directive.payload.token = token
+    directive.payload.type = alert_type
+    directive.payload.scheduledTime = scheduled_time
+    return directive
+
+
+def delete_alert_directive(token):
+    directive = proto.DeleteAlertDirective()
+    directive.header.namespace = 'Alerts'
+    directive.header.name = 'DeleteAlert'
+    directive.payload.token = token
+    return directive
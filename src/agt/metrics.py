@@ -0,0 +1,446 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+import bisect
+import logging.config
+import math
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the histogram buckets, from the handling of a packet on a Pi Zero
+# up to a handler doing I/O
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+
+def _format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        k, str(v).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')) for k, v in labels) + '}'
+
+
+class _CounterValue:
+    __slots__ = ('_lock', 'value')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, labels):
+        return [('', labels, self.value)]
+
+
+class _GaugeValue(_CounterValue):
+    __slots__ = ()
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+
+class _HistogramValue:
+    __slots__ = ('_lock', '_upper_bounds', '_counts', '_sum')
+
+    def __init__(self, upper_bounds):
+        self._lock = threading.Lock()
+        self._upper_bounds = upper_bounds
+        # one count per bucket, and a last one for +Inf, made cumulative when rendered
+        self._counts = [0] * (len(upper_bounds) + 1)
+        self._sum = 0.0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self._upper_bounds, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    def samples(self, labels):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        samples = []
+        cumulative = 0
+        for upper_bound, count in zip(self._upper_bounds + (math.inf,), counts):
+            cumulative += count
+            samples.append(('_bucket', labels + (('le', _format_value(upper_bound)),), cumulative))
+        samples.append(('_sum', labels, total))
+        samples.append(('_count', labels, cumulative))
+        return samples
+
+
+class _Metric:
+    """
+    A metric and its values, one for each combination of label values
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        if not self.labelnames:
+            self._values[()] = self._new_value()
+
+    def labels(self, *values):
+        """
+        Returns the value of the metric for the label values, in the order of the label names.
+
+        Keep the returned value to update it on a hot path, it saves looking it up.
+        """
+        value = self._values.get(values)
+        if value is None:
+            if len(values) != len(self.labelnames):
+                raise Exception('{} expects the labels {}, got {}'.format(self.name, self.labelnames, values))
+            with self._lock:
+                value = self._values.setdefault(values, self._new_value())
+        return value
+
+    def collect(self):
+        """
+        Returns the samples of the metric, as (name, labels, value)
+        """
+        with self._lock:
+            values = list(self._values.items())
+        samples = []
+        for label_values, value in values:
+            for suffix, labels, sample in value.samples(tuple(zip(self.labelnames, label_values))):
+                samples.append((self.name + suffix, labels, sample))
+        return samples
+
+    def _new_value(self):
+        raise NotImplementedError()
+
+
+class Counter(_Metric):
+    kind = COUNTER
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _new_value(self):
+        return _CounterValue()
+
+
+class Gauge(_Metric):
+    kind = GAUGE
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def _new_value(self):
+        return _GaugeValue()
+
+
+class Histogram(_Metric):
+    kind = HISTOGRAM
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _new_value(self):
+        return _HistogramValue(self.buckets)
+
+
+class MetricsRegistry:
+    """
+    Holds the metrics and renders them in the Prometheus text exposition format, served over HTTP or written to
+    a file, e.g. for the textfile collector of the node exporter.
+
+    Updating a metric takes a lock and a few attribute lookups, the work is done when the metrics are rendered.
+    The collectors are called on each rendering, to read counters kept elsewhere.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector):
+        """
+        Registers a callable returning the metrics it reads, as (name, kind, documentation, samples) where
+        samples is a list of (labels, value) and labels a dict.
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        """
+        Returns the metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            self._render_metric(lines, metric.name, metric.kind, metric.documentation, metric.collect())
+        for collector in collectors:
+            try:
+                collected = list(collector())
+            except Exception:
+                logger.exception('Exception collecting metrics')
+                continue
+            for name, kind, documentation, samples in collected:
+                self._render_metric(lines, name, kind, documentation,
+                                    [(name, tuple(sorted(labels.items())), value) for labels, value in samples])
+        return ''.join(lines)
+
+    def write_textfile(self, path):
+        """
+        Writes the metrics to a file, replaced atomically so that a reader never sees it partially written
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.metrics')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.render())
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    def start_textfile_writer(self, path, interval=15):
+        """
+        Writes the metrics to a file every interval seconds, from a daemon thread.
+
+        :return: The thread, stop it with its stop() method.
+        """
+        writer = _TextfileWriter(self, path, interval)
+        writer.start()
+        return writer
+
+    def start_http_server(self, port, address='127.0.0.1'):
+        """
+        Serves the metrics on http://address:port/metrics from a daemon thread, for Prometheus to scrape.
+
+        :return: The HTTP server, stop it with its shutdown() method.
+        """
+        registry = self
+
+        class Handler(_MetricsHandler):
+            pass
+
+        Handler.registry = registry
+        server = _ThreadingHTTPServer((address, port), Handler)
+        thread = threading.Thread(target=server.serve_forever, name='agt-metrics', daemon=True)
+        thread.start()
+        logger.info('Serving metrics on http://%s:%d/metrics', address, server.server_address[1])
+        return server
+
+    def _register(self, metric):
+        with self._lock:
+            if any(m.name == metric.name for m in self._metrics):
+                raise Exception('Metric {} is already registered'.format(metric.name))
+            self._metrics.append(metric)
+        return metric
+
+    @staticmethod
+    def _render_metric(lines, name, kind, documentation, samples):
+        lines.append('# HELP {} {}\n'.format(name, documentation.replace('\\', r'\\').replace('\n', r'\n')))
+        lines.append('# TYPE {} {}\n'.format(name, kind))
+        for sample_name, labels, value in samples:
+            lines.append('{}{} {}\n'.format(sample_name, _format_labels(labels), _format_value(value)))
+
+
+class _TextfileWriter(threading.Thread):
+
+    def __init__(self, registry, path, interval):
+        super().__init__(name='agt-metrics-textfile', daemon=True)
+        self._registry = registry
+        self._path = path
+        self._interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while True:
+            try:
+                self._registry.write_textfile(self._path)
+            except Exception:
+                logger.exception('Exception writing the metrics to %s', self._path)
+            if self._stopped.wait(self._interval):
+                return
+
+    def stop(self):
+        self._stopped.set()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug('%s - ' + format, self.address_string(), *args)
+
+
+class GadgetMetrics:
+    """
+    Metrics of an AlexaGadget, opt-in: pass it to the gadget and expose its registry.
+
+    .. highlight:: python
+    .. code-block:: python
+
+        from agt import AlexaGadget, GadgetMetrics
+
+        metrics = GadgetMetrics()
+        metrics.registry.start_http_server(9101)
+
+        class MyGadget(AlexaGadget):
+            def __init__(self):
+                super().__init__(metrics=metrics)
+
+    The counters of the transport and of the DirectiveExecutor are read from their get_stats() when the metrics
+    are rendered, they cost nothing per packet. The transport counters start over on every connection.
+    """
+
+    def __init__(self, registry=None):
+        """
+        :param registry: (Optional) MetricsRegistry to register the metrics in, a new one by default.
+        """
+        self.registry = registry if registry is not None else MetricsRegistry()
+        r = self.registry
+        self.directives_received = r.counter('agt_directives_received_total',
+                                             'Directives received from the Echo device', ('namespace', 'name'))
+        self.events_sent = r.counter('agt_events_sent_total', 'Events sent to the Echo device', ('namespace', 'name'))
+        self.events_dropped = r.counter('agt_events_dropped_total', 'Events the transport could not send',
+                                        ('transport',))
+        self.transport_bytes = r.counter('agt_transport_bytes_total',
+                                         'Bytes of the messages exchanged with the Echo device, before framing',
+                                         ('transport', 'direction'))
+        self.reconnect_attempts = r.counter('agt_reconnect_attempts_total', 'Attempts to reconnect to the Echo device',
+                                            ('transport',))
+        self.connected = r.gauge('agt_connected', '1 while connected to the Echo device', ('transport',))
+        self.handler_seconds = r.histogram('agt_directive_handler_seconds', 'Time spent in the directive handlers',
+                                           ('namespace', 'name'))
+        self.encode_seconds = r.histogram('agt_event_encode_seconds', 'Time to serialize an event')
+        self.send_seconds = r.histogram('agt_event_send_seconds',
+                                        'Time to packetize an event and hand it over to the transport', ('transport',))
+        self.ack_seconds = r.histogram('agt_directive_ack_seconds',
+                                       'Time from the last packet of a directive to its transport ACK', ('transport',))
+
+        # values of the transport the gadget uses, see bind()
+        self.bytes_in = None
+        self.bytes_out = None
+        self.dropped = None
+        self.reconnects = None
+        self.connection = None
+        self.send_time = None
+        self.ack_time = None
+
+    def bind(self, transport_mode, transport, directive_executor=None):
+        """
+        Called by the gadget with its transport, a GadgetMetrics is used by a single gadget.
+        """
+        if self.bytes_in is not None:
+            raise Exception('The metrics are already used by another gadget')
+        self.bytes_in = self.transport_bytes.labels(transport_mode, 'in')
+        self.bytes_out = self.transport_bytes.labels(transport_mode, 'out')
+        self.dropped = self.events_dropped.labels(transport_mode)
+        self.reconnects = self.reconnect_attempts.labels(transport_mode)
+        self.connection = self.connected.labels(transport_mode)
+        self.send_time = self.send_seconds.labels(transport_mode)
+        self.ack_time = self.ack_seconds.labels(transport_mode)
+        self.connection.set(1 if transport.is_connected() else 0)
+        transport.set_ack_observer(self.ack_time.observe)
+        self.registry.register_collector(lambda: self._collect_transport(transport_mode, transport))
+        if directive_executor is not None:
+            self.registry.register_collector(lambda: self._collect_executor(directive_executor))
+
+    @staticmethod
+    def _collect_transport(transport_mode, transport):
+        stats = transport.get_stats()
+        labels = {'transport': transport_mode}
+        for key, name, kind, documentation in _TRANSPORT_STATS:
+            if stats.get(key) is not None:
+                yield name, kind, documentation, [(labels, stats[key])]
+
+    @staticmethod
+    def _collect_executor(directive_executor):
+        stats = directive_executor.get_stats()
+        yield 'agt_directive_queue_depth', GAUGE, 'Directives waiting for a DirectiveExecutor thread', \
+            [({}, stats['queue_depth'])]
+        yield 'agt_directives_dropped_total', COUNTER, 'Directives dropped, the DirectiveExecutor queue was full', \
+            [({}, stats['dropped'])]
+        yield 'agt_directive_handler_failures_total', COUNTER, 'Directive handlers which raised an exception', \
+            [({}, stats['failed'])]
+
+
+# get_stats() key of a transport, metric name, kind and documentation
+_TRANSPORT_STATS = [
+    ('checksum_failures', 'agt_checksum_failures_total', COUNTER, 'SPP packets received with a wrong checksum'),
+    ('dropped_transactions', 'agt_dropped_packets_total', COUNTER,
+     'BLE transactions received and dropped before they were complete'),
+    ('dropped_bytes', 'agt_dropped_bytes_total', COUNTER, 'Bytes dropped, the send queue was full'),
+    ('send_queue_size', 'agt_send_queue_bytes', GAUGE, 'Bytes waiting in the send queue'),
+    ('att_mtu', 'agt_att_mtu_bytes', GAUGE, 'ATT MTU negotiated for the BLE connection'),
+    ('packet_size', 'agt_packet_size_bytes', GAUGE, 'Maximum size of the BLE packets sent on the connection'),
+    ('transactions_sent', 'agt_transactions_sent_total', COUNTER, 'BLE transactions sent'),
+    ('fragmented_transactions_sent', 'agt_fragmented_transactions_sent_total', COUNTER,
+     'BLE transactions sent in more than one packet'),
+    ('packets_sent', 'agt_packets_sent_total', COUNTER, 'BLE packets sent'),
+    ('sent_bytes', 'agt_sent_bytes_total', COUNTER, 'Bytes written to the RFCOMM socket'),
+]
@@ -0,0 +1,167 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+import collections
+import itertools
+import json
+import logging.config
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Number of spans kept, about 10 per directive
+DEFAULT_CAPACITY = 8192
+
+
+class Tracer:
+    """
+    Records where the time goes for each packet received from the Echo device, as spans with monotonic
+    timestamps: the read from BlueZ or the RFCOMM socket, the BLE reassembly and transport ACK, the protobuf
+    decoding, the dispatch and the directive handler. The spans are kept in a ring buffer and can be dumped
+    as a Chrome trace, to open in chrome://tracing or https://ui.perfetto.dev.
+
+    A trace starts when the transport reads a packet, for sample_rate of the packets. The stages record their
+    span in the trace of the thread they run on, a trace is handed over to the thread running the handler.
+    A packet which is not sampled costs a thread-local lookup per stage.
+
+    .. highlight:: python
+    .. code-block:: python
+
+        from agt import AlexaGadget, Tracer
+
+        tracer = Tracer(sample_rate=0.1)
+
+        class MyGadget(AlexaGadget):
+            def __init__(self):
+                super().__init__(tracer=tracer)
+
+            def on_alerts_setalert(self, directive):
+                ...
+                tracer.dump('/tmp/agt-trace.json')
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, sample_rate=1.0):
+        """
+        :param capacity: Number of spans kept, the oldest ones are dropped.
+        :param sample_rate: Fraction of the packets traced, from 0 to 1. It can be changed at any time.
+        """
+        self.sample_rate = sample_rate
+        self._spans = collections.deque(maxlen=capacity)
+        self._local = threading.local()
+        self._trace_ids = itertools.count(1)
+        self._sample_credit = 0.0
+        self._origin = time.perf_counter()
+
+    def begin(self):
+        """
+        Starts a trace on the calling thread if the packet is sampled.
+
+        :return: The id of the trace, None if the packet is not traced.
+        """
+        self._sample_credit += self.sample_rate
+        if self._sample_credit < 1:
+            self._local.trace_id = None
+            return None
+        self._sample_credit -= 1
+        trace_id = next(self._trace_ids)
+        self._local.trace_id = trace_id
+        return trace_id
+
+    def end(self):
+        """
+        Ends the trace of the calling thread
+        """
+        self._local.trace_id = None
+
+    def current(self):
+        """
+        :return: The id of the trace of the calling thread, None if it is not tracing.
+        """
+        return getattr(self._local, 'trace_id', None)
+
+    def attach(self, trace_id):
+        """
+        Continues a trace on the calling thread, e.g. the one of a directive run by a DirectiveExecutor thread.
+
+        :return: The trace the calling thread had, to restore with detach().
+        """
+        previous = self.current()
+        self._local.trace_id = trace_id
+        return previous
+
+    def detach(self, previous):
+        self._local.trace_id = previous
+
+    def start(self):
+        """
+        :return: The start time of a span, None if the calling thread is not tracing.
+        """
+        if getattr(self._local, 'trace_id', None) is None:
+            return None
+        return time.perf_counter()
+
+    def stop(self, start, stage, **args):
+        """
+        Records a span of the trace of the calling thread, from start to now.
+
+        :param start: Returned by start(), nothing is recorded if it is None.
+        :param stage: Name of the span, e.g. ble.deserialize.
+        :param args: Details shown with the span.
+        """
+        if start is None:
+            return
+        trace_id = getattr(self._local, 'trace_id', None)
+        if trace_id is None:
+            return
+        self._spans.append((trace_id, stage, start, time.perf_counter() - start, threading.get_ident(), args))
+
+    def get_spans(self):
+        """
+        Returns the spans kept, as (trace id, name, start, duration, thread id, args) in the order they ended
+        """
+        return list(self._spans)
+
+    def clear(self):
+        self._spans.clear()
+
+    def to_chrome_trace(self):
+        """
+        Returns the spans kept in the Chrome trace event format
+        """
+        pid = os.getpid()
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        events = []
+        threads = set()
+        for trace_id, name, start, duration, thread_id, args in self.get_spans():
+            threads.add(thread_id)
+            event_args = {'trace': trace_id}
+            event_args.update(args)
+            events.append({
+                'name': name,
+                'cat': name.split('.')[0],
+                'ph': 'X',
+                'ts': (start - self._origin) * 1e6,
+                'dur': duration * 1e6,
+                'pid': pid,
+                'tid': thread_id,
+                'args': event_args,
+            })
+        for thread_id in threads:
+            if thread_id in thread_names:
+                events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread_id,
+                               'args': {'name': thread_names[thread_id]}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def dump(self, path):
+        """
+        Writes the spans kept to a Chrome trace JSON file
+        """
+        with open(path, 'w') as f:
+            json.dump(self.to_chrome_trace(), f)
+        logger.info('Wrote %d spans to %s', len(self._spans), path)
@@ -18,10 +18,34 @@ def subprocess_run_and_log(command):
     output = subprocess.check_output(command, shell=True)
     logger.debug(output.decode('ascii'))
 
+"""
+Defer an expensive rendering of a log argument until the log record is formatted,
+which never happens when the logger is not enabled for the level of the record:
+
+    logger.debug('Received %s', LazyFormat(json_format.MessageToDict, message))
+"""
+class LazyFormat:
+    __slots__ = ('_fn', '_args', '_kwargs')
+
+    def __init__(self, fn, *args, **kwargs):
+        self._fn = fn
+        self._args = args
+        self._kwargs = kwargs
+
+    def __str__(self):
+        return str(self._fn(*self._args, **self._kwargs))
+
+
+"""
+Format payload bytes as a list of hex values
+"""
+def format_bytes(payload):
+    return '[' + ', '.join('0x%02x' % i for i in bytearray(payload)) + ']'
+
+
 """
 Log payload bytes
 """
-def log_bytes(payload):
-    payload = bytearray(payload)
-    printable_list = '[' + ', '.join('0x' + '%02x' % i for i in payload) + ']'
-    logger.debug(printable_list)
\ No newline at end of file
+def log_bytes(payload, level=logging.DEBUG):
+    if logger.isEnabledFor(level):
+        logger.log(level, format_bytes(payload))
\ No newline at end of file
@@ -0,0 +1,91 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+Micro-benchmarks for the agt hot paths.
+
+Run a benchmark from the src directory, for example:
+
+.. code-block:: bash
+
+    python3 -m benchmarks.dbus_array
+
+or the whole suite, see benchmarks.suite:
+
+.. code-block:: bash
+
+    python3 -m benchmarks.suite --output results.json
+"""
+import contextlib
+import os
+import tempfile
+import timeit
+
+_GADGET_CONFIG = """
+[GadgetSettings]
+amazonId = BENCHMARK
+alexaGadgetSecret = BENCHMARK
+
+[GadgetCapabilities]
+Alerts = 1.1
+Notifications = 1.0
+Alexa.Gadget.StateListener = 1.0 - timeinfo, timers, alarms, reminders, wakeword
+Alexa.Gadget.MusicData = 1.0 - tempo
+Alexa.Gadget.SpeechData = 1.0 - viseme
+"""
+
+
+def best_time(fn, number=1000, repeat=5):
+    """
+    Returns the best time of a single call to fn, in seconds.
+
+    :param fn: callable without arguments to measure
+    :param number: number of calls in each measurement
+    :param repeat: number of measurements
+    """
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+
+
+def report(name, seconds, **params):
+    """
+    Prints the result of a benchmark as a single line, and keeps it when run by collect().
+    """
+    labels = ' '.join('{}={}'.format(k, v) for k, v in params.items())
+    print('{:<40} {:<24} {:>12.2f} us'.format(name, labels, seconds * 1e6))
+    if _results is not None:
+        _results.append({'name': name, 'params': params, 'seconds': seconds})
+
+
+# results reported while collect() runs
+_results = None
+
+
+def collect(fn):
+    """
+    Runs a benchmark and returns the results it reported, as dicts with the name, params and seconds.
+    """
+    global _results
+    _results = []
+    try:
+        fn()
+        return _results
+    finally:
+        _results = None
+
+
+@contextlib.contextmanager
+def gadget_config():
+    """
+    Yields the path of a Gadget .ini file declaring every capability, removed on exit.
+    """
+    with tempfile.NamedTemporaryFile('w', suffix='.ini', delete=False) as config_file:
+        config_file.write(_GADGET_CONFIG)
+    try:
+        yield config_file.name
+    finally:
+        os.remove(config_file.name)
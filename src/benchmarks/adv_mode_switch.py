@@ -0,0 +1,114 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+Latency of switching the BLE advertisement between pairing and reconnect mode, with the hcitool
+commands used previously, the HCI socket backend and the BlueZ advertising backend.
+
+Advertises for real, requires root, a Bluetooth LE controller, bluetoothd, dbus-python and PyGObject:
+
+.. code-block:: bash
+
+    sudo python3 -m benchmarks.adv_mode_switch
+"""
+import subprocess
+import time
+
+import dbus
+from dbus.mainloop.glib import DBusGMainLoop
+from gi.repository import GLib
+
+from agt.ble.adapter import find_adapter
+from agt.ble.advertisement import ADV_MODE_PAIR, ADV_MODE_RECONNECT, BlueZAdvertiser, HCIAdvertiser
+from benchmarks import best_time, report
+
+NAME = 'GadgetBench'
+MODES = [ADV_MODE_PAIR, ADV_MODE_RECONNECT]
+
+# Previous implementation, kept as the baseline of the benchmark
+_HCITOOL_ADV_DATA = {
+    ADV_MODE_PAIR: 'sudo hcitool -i hci0 cmd 0x08 0x0008 '
+                   ' 0x1F 0x02 0x01 0x06'
+                   ' 0x03 0x03 0x03 0xFE'
+                   ' 0x17 0x16 0x03 0xFE 0x71 0x01 0x00 0xFF '
+                   '0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00',
+    ADV_MODE_RECONNECT: 'sudo hcitool -i hci0 cmd 0x08 0x0008 '
+                        ' 0x1F 0x02 0x01 0x06'
+                        ' 0x1B 0x16 0x03 0xFE 0x71 0x01 0x00 0xFF'
+                        ' 0x00 0x00 0x00 0x00'
+                        ' 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00 0x00',
+}
+_HCITOOL_SCAN_RESP = 'sudo hcitool -i hci0 cmd 0x08 0x0009 0x0d 0x0c 0x09 ' + \
+                     ' '.join('0x{:02x}'.format(b) for b in NAME.encode()) + ' 0x00' * 18
+_HCITOOL_ADV_PARAMS = 'sudo hcitool -i hci0 cmd 0x08 0x0006 0x20 0x00 0x20 0x00 0x00 0x00 0x00 ' \
+                      '0x00 0x00 0x00 0x00 0x00 0x00 0x07 0x00'
+_HCITOOL_ADV_ENABLE = 'sudo hcitool -i hci0 cmd 0x08 0x000a 01'
+_HCITOOL_ADV_DISABLE = 'sudo hcitool -i hci0 cmd 0x08 0x000a 00'
+
+
+def _run(command):
+    subprocess.check_output(command, shell=True)
+
+
+def _hcitool_switch(mode):
+    _run('sudo hciconfig hci0 up')
+    _run(_HCITOOL_ADV_DATA[mode])
+    _run(_HCITOOL_SCAN_RESP)
+    _run(_HCITOOL_ADV_PARAMS)
+    time.sleep(1)
+    _run(_HCITOOL_ADV_ENABLE)
+
+
+def _alternate(switch):
+    """
+    Returns a callable switching to the other mode on each call
+    """
+    modes = []
+
+    def fn():
+        if not modes:
+            modes.extend(MODES)
+        switch(modes.pop())
+    return fn
+
+
+def main():
+    report('hcitool', best_time(_alternate(_hcitool_switch), number=2, repeat=3), switch='pair<->reconnect')
+    _run(_HCITOOL_ADV_DISABLE)
+
+    hci = HCIAdvertiser(NAME)
+
+    def hci_switch(mode):
+        hci.set_mode(mode)
+        hci.enable(True)
+
+    report('HCIAdvertiser', best_time(_alternate(hci_switch), number=10), switch='pair<->reconnect')
+    hci.enable(False)
+
+    DBusGMainLoop(set_as_default=True)
+    bus = dbus.SystemBus()
+    loop = GLib.MainLoop()
+    bluez = BlueZAdvertiser(bus, find_adapter(bus), NAME, on_registered_cb=lambda mode: loop.quit())
+
+    def bluez_switch(mode):
+        # wait for BlueZ to confirm the registration
+        bluez.set_mode(mode)
+        bluez.enable(True)
+        timeout = GLib.timeout_add_seconds(5, loop.quit)
+        loop.run()
+        if bluez.last_register_latency is None:
+            raise Exception('The advertisement was not registered')
+        bluez.last_register_latency = None
+        GLib.source_remove(timeout)
+
+    report('BlueZAdvertiser', best_time(_alternate(bluez_switch), number=10), switch='pair<->reconnect')
+    bluez.enable(False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+Time from a disconnect to the first directive delivered to the gadget over BLE, with a simulated Echo device
+driving the GATT characteristics the way BlueZ does: the Echo device disconnects, connects again, enables
+the notifications, waits for the protocol version packet and sends a directive.
+
+Nothing goes over the air, the GATT objects are not exported on D-Bus. The previous StartNotify, which slept
+for a second on the main loop, is kept as the baseline.
+
+Requires dbus-python and PyGObject:
+
+.. code-block:: bash
+
+    python3 -m benchmarks.ble_reconnect
+"""
+import time
+import types
+
+from gi.repository import GLib
+
+import agt.messages_pb2 as proto
+from agt.ble.adapter import Application
+from agt.ble.protocol import AppStreams, BLEProtocol, Packetizer, MTU_SIZE
+from benchmarks import best_time, report
+
+
+def _legacy_start_notify(self):
+    """
+    Previous implementation, kept as the baseline of the benchmark
+    """
+    self._notifying = True
+    time.sleep(1)
+    self._protocol.gadget_ready()
+
+
+class SimulatedEcho:
+    """
+    Plays the Echo device side of a reconnection
+    """
+
+    def __init__(self, legacy_start_notify=False):
+        self._loop = GLib.MainLoop()
+        self._protocol = BLEProtocol('AGT0000', 'Gadget', 'DEVICE_TYPE', self._on_directive, self._on_notification)
+        application = Application(None, self._protocol, acquire_io=False)
+        self._tx_char = application.get_gadget_service()._txChar
+        self._rx_char = application.get_gadget_service()._rxChar
+        if legacy_start_notify:
+            self._rx_char.StartNotify = types.MethodType(_legacy_start_notify, self._rx_char)
+
+        # the directive, packetized as the Echo device sends it
+        directive = proto.Directive()
+        directive.header.namespace = 'Alexa.Gadget.StateListener'
+        directive.header.name = 'StateUpdate'
+        message = proto.Message()
+        message.payload = directive.SerializeToString()
+        self._packets = [bytes(p) for p in Packetizer(MTU_SIZE).serialize(message.SerializeToString(),
+                                                                           AppStreams.ALEXA_STREAM_ID)]
+        self._connected = False
+        self._delivered = False
+
+    def reconnect(self):
+        """
+        Disconnect, connect again and wait for the directive to be delivered
+        """
+        # disconnection, as handled by BLEGattTransport.property_changed
+        self._connected = False
+        self._rx_char.StopNotify()
+        self._tx_char.release_write()
+        self._protocol.connection_closed()
+
+        # connection, the Echo device enables the notifications first
+        self._connected = True
+        self._delivered = False
+        self._rx_char.StartNotify()
+        if not self._delivered:
+            self._loop.run()
+
+    def _on_notification(self, payload):
+        # the protocol version packet, the gadget is ready
+        if self._connected:
+            self._connected = False
+            for packet in self._packets:
+                self._tx_char.WriteValue(packet, {})
+
+    def _on_directive(self, data):
+        message = proto.Message()
+        message.ParseFromString(data)
+        proto.Directive().ParseFromString(message.payload)
+        self._delivered = True
+        if self._loop.is_running():
+            self._loop.quit()
+
+
+def main():
+    echo = SimulatedEcho()
+    report('reconnect_to_first_directive', best_time(echo.reconnect, number=100))
+    legacy = SimulatedEcho(legacy_start_notify=True)
+    report('legacy_reconnect_to_first_directive', best_time(legacy.reconnect, number=1, repeat=3))
+
+
+if __name__ == '__main__':
+    main()
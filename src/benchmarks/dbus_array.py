@@ -0,0 +1,49 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+Per-notification cost of converting a packet to the D-Bus value sent by
+DataReadCharacteristic.notify_rx_value, at the smallest, a typical and the largest ATT MTU.
+
+Requires dbus-python:
+
+.. code-block:: bash
+
+    python3 -m benchmarks.dbus_array
+"""
+import dbus
+
+from agt.ble.adapter import convert_to_dbus_array
+from benchmarks import best_time, report
+
+MTU_SIZES = [23, 185, 512]
+
+
+def _per_byte_convert_to_dbus_array(payload):
+    """
+    Previous implementation, kept as the baseline of the benchmark
+    """
+    payload = bytearray(payload)
+    out = []
+    for b in payload:
+        out = out + [dbus.Byte(b)]
+
+    return dbus.Array(out, signature=dbus.Signature('y'))
+
+
+def main():
+    for mtu in MTU_SIZES:
+        # ATT header takes 3 bytes of the MTU
+        payload = memoryview(bytes(i & 0xFF for i in range(mtu - 3)))
+        report('convert_to_dbus_array', best_time(lambda: convert_to_dbus_array(payload)), mtu=mtu)
+        report('per_byte_convert_to_dbus_array', best_time(lambda: _per_byte_convert_to_dbus_array(payload), number=100),
+               mtu=mtu)
+
+
+if __name__ == '__main__':
+    main()
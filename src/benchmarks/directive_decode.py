@@ -0,0 +1,137 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+Cost of decoding the directives received from the Echo device into their proto class, over a corpus of
+directives: a single parse after peeking the header, against parsing a generic Directive first.
+
+The corpus defaults to a built-in set of directives shaped like the ones an Echo device sends during a
+spoken response. A recorded corpus can be passed instead, as a file with one hex encoded Message per line:
+
+.. code-block:: bash
+
+    python3 -m benchmarks.directive_decode [corpus.txt]
+"""
+import sys
+
+import agt.messages_pb2 as proto
+from agt.alexa_gadget import _DIRECTIVE_CLASSES, _peek_directive_header
+from benchmarks import best_time, report
+
+
+def _message(directive):
+    message = proto.Message()
+    message.payload = directive.SerializeToString()
+    return message.SerializeToString()
+
+
+def builtin_corpus():
+    """
+    Returns serialized Messages: a wakeword state update, speechmarks of a response, tempo, an alert and discovery
+    """
+    corpus = []
+
+    directive = proto.StateUpdateDirective()
+    directive.header.namespace = 'Alexa.Gadget.StateListener'
+    directive.header.name = 'StateUpdate'
+    state = directive.payload.states.add()
+    state.name = 'wakeword'
+    state.value = 'active'
+    corpus.append(_message(directive))
+
+    visemes = 'p t S T f k i r s @ a E e O u'.split()
+    for i in range(20):
+        directive = proto.SpeechmarksDirective()
+        directive.header.namespace = 'Alexa.Gadget.SpeechData'
+        directive.header.name = 'Speechmarks'
+        directive.header.messageId = 'c1a4e4bc-{:04d}-4d6b-9f0b-51f1a8a51a7e'.format(i)
+        directive.payload.playerOffsetInMilliSeconds = i * 500
+        for j in range(8):
+            mark = directive.payload.speechmarksData.add()
+            mark.type = 'VISEME'
+            mark.value = visemes[(i + j) % len(visemes)]
+            mark.startOffsetInMilliSeconds = i * 500 + j * 60
+        corpus.append(_message(directive))
+
+    directive = proto.TempoDirective()
+    directive.header.namespace = 'Alexa.Gadget.MusicData'
+    directive.header.name = 'Tempo'
+    tempo = directive.payload.tempoData.add()
+    tempo.value = 120
+    corpus.append(_message(directive))
+
+    directive = proto.SetAlertDirective()
+    directive.header.namespace = 'Alerts'
+    directive.header.name = 'SetAlert'
+    directive.payload.token = 'alert-token'
+    directive.payload.type = 'TIMER'
+    directive.payload.scheduledTime = '2019-05-01T12:00:00+0000'
+    corpus.append(_message(directive))
+
+    directive = proto.DiscoverDirective()
+    directive.header.namespace = 'Alexa.Discovery'
+    directive.header.name = 'Discover'
+    directive.payload.scope.type = 'BearerToken'
+    corpus.append(_message(directive))
+
+    state_update = proto.StateUpdateDirective()
+    state_update.header.namespace = 'Alexa.Gadget.StateListener'
+    state_update.header.name = 'StateUpdate'
+    state = state_update.payload.states.add()
+    state.name = 'wakeword'
+    state.value = 'cleared'
+    corpus.append(_message(state_update))
+    return corpus
+
+
+def load_corpus(path):
+    with open(path, 'r') as corpus_file:
+        return [bytes.fromhex(line.strip()) for line in corpus_file if line.strip()]
+
+
+def _decode(data):
+    message = proto.Message()
+    message.ParseFromString(data)
+    header = _peek_directive_header(message.payload)
+    proto_class = _DIRECTIVE_CLASSES.get(header, proto.Directive) if header is not None else proto.Directive
+    directive = proto_class()
+    directive.ParseFromString(message.payload)
+    return directive
+
+
+def _two_pass_decode(data):
+    """
+    Previous implementation, kept as the baseline of the benchmark
+    """
+    message = proto.Message()
+    message.ParseFromString(data)
+    directive = proto.Directive()
+    directive.ParseFromString(message.payload)
+    proto_class = getattr(proto, directive.header.name + 'Directive', None)
+    if proto_class and directive.header.namespace == proto_class.DESCRIPTOR.GetOptions().Extensions[proto.namespace]:
+        directive = proto_class()
+        directive.ParseFromString(message.payload)
+    return directive
+
+
+def main():
+    corpus = load_corpus(sys.argv[1]) if len(sys.argv) > 1 else builtin_corpus()
+    for data in corpus:
+        if _decode(data) != _two_pass_decode(data):
+            raise Exception('Decoders disagree on {}'.format(data.hex()))
+
+    def decode_corpus(decode):
+        return lambda: [decode(data) for data in corpus]
+
+    report('decode', best_time(decode_corpus(_decode), number=20) / len(corpus), directives=len(corpus))
+    report('two_pass_decode', best_time(decode_corpus(_two_pass_decode), number=20) / len(corpus),
+           directives=len(corpus))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+Cost of AlexaGadget._on_bluetooth_data_received for each typed directive of messages_pb2: decoding the
+Message and the directive, and the dispatch to a handler doing nothing.
+
+Runs without BlueZ, dbus or GLib, over the loopback transport:
+
+.. code-block:: bash
+
+    python3 -m benchmarks.directive_dispatch
+"""
+import agt.messages_pb2 as proto
+from agt import AlexaGadget
+from agt.alexa_gadget import LOOPBACK_BLE, _DIRECTIVE_CLASSES
+from agt.loopback import discover_directive, delete_alert_directive, set_alert_directive, speechmarks_directive, \
+    state_update_directive
+from benchmarks import best_time, gadget_config, report
+
+# directives with a payload, the others only have a header
+_BUILDERS = {
+    ('Alexa.Discovery', 'Discover'): discover_directive,
+    ('Alexa.Gadget.StateListener', 'StateUpdate'): lambda: state_update_directive('wakeword', 'active'),
+    ('Alexa.Gadget.SpeechData', 'Speechmarks'): lambda: speechmarks_directive('p t S T f k i r'.split()),
+    ('Alerts', 'SetAlert'): lambda: set_alert_directive('alert-token', 'TIMER', '2019-05-01T12:00:00+0000'),
+    ('Alerts', 'DeleteAlert'): lambda: delete_alert_directive('alert-token'),
+}
+
+
+def directive_message(key, proto_class):
+    """
+    Returns the serialized Message of a directive, as received from the Echo device
+    """
+    builder = _BUILDERS.get(key)
+    if builder is not None:
+        directive = builder()
+    else:
+        directive = proto_class()
+        directive.header.namespace, directive.header.name = key
+    message = proto.Message()
+    message.payload = directive.SerializeToString()
+    return message.SerializeToString()
+
+
+def main():
+    with gadget_config() as gadget_config_path:
+        gadget = AlexaGadget(gadget_config_path, transport_mode=LOOPBACK_BLE)
+    handled = []
+    for key, proto_class in sorted(_DIRECTIVE_CLASSES.items()):
+        gadget.register_directive_handler(key[0], key[1], handled.append)
+        data = directive_message(key, proto_class)
+        gadget._on_bluetooth_data_received(data)
+        if type(handled.pop()) is not proto_class:
+            raise Exception('{}.{} was not decoded into {}'.format(key[0], key[1], proto_class.__name__))
+        report('_on_bluetooth_data_received', best_time(lambda: gadget._on_bluetooth_data_received(data)),
+               directive='.'.join(key))
+        handled.clear()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+End to end latency and throughput of an AlexaGadget, driven by a VirtualEcho over the loopback transport with
+the BLE and the Classic Bluetooth framings: the directives go through the packetizing, the transport thread,
+the decoding and the dispatch to the handlers, and the events all the way back.
+
+Runs without BlueZ, dbus or GLib:
+
+.. code-block:: bash
+
+    python3 -m benchmarks.end_to_end
+"""
+import statistics
+import threading
+import time
+
+from agt import AlexaGadget
+from agt.alexa_gadget import LOOPBACK_BLE, LOOPBACK_BT
+from agt.loopback import VirtualEcho, discover_directive, speechmarks_directive, state_update_directive
+from benchmarks import gadget_config, report
+
+
+class BenchmarkGadget(AlexaGadget):
+    """
+    Answers a wakeword state update with a custom event, counts the speechmarks
+    """
+
+    def __init__(self, gadget_config_path, transport_mode):
+        super().__init__(gadget_config_path, transport_mode=transport_mode)
+        self.speechmarks = 0
+        self.speechmarks_done = threading.Event()
+        self.speechmarks_expected = 0
+
+    def on_alexa_gadget_statelistener_stateupdate(self, directive):
+        self.send_custom_event('Custom.Benchmark', 'Pong', {})
+
+    def on_alexa_gadget_speechdata_speechmarks(self, directive):
+        self.speechmarks += 1
+        if self.speechmarks == self.speechmarks_expected:
+            self.speechmarks_done.set()
+
+
+def round_trips(echo, directive, count):
+    """
+    Returns the seconds between each directive sent and the event it was answered with
+    """
+    times = []
+    for _ in range(count):
+        events = len(echo.events)
+        echo.send_directive(directive)
+        if not echo.wait_for_events(events + 1):
+            raise Exception('No answer to {}'.format(directive.header.name))
+        times.append(echo.events[-1][0] - echo.sent[-1][0])
+    return times
+
+
+def run(transport_mode, gadget_config_path, count=500):
+    gadget = BenchmarkGadget(gadget_config_path, transport_mode)
+    echo = VirtualEcho(gadget.transport)
+    gadget.start()
+    transport_thread = threading.Thread(target=gadget.transport.run, daemon=True)
+    transport_thread.start()
+    try:
+        if not echo.connect():
+            raise Exception('The gadget did not get ready')
+        framing = transport_mode.split('_')[-1]
+
+        report('discover_round_trip', statistics.median(round_trips(echo, discover_directive(), count)),
+               framing=framing)
+        report('state_update_round_trip',
+               statistics.median(round_trips(echo, state_update_directive('wakeword', 'active'), count)),
+               framing=framing)
+
+        directive = speechmarks_directive('p t S T f k i r'.split())
+        gadget.speechmarks_expected = count
+        start = time.monotonic()
+        echo.play([directive], count=count)
+        if not gadget.speechmarks_done.wait(30):
+            raise Exception('Only {} of {} speechmarks were handled'.format(gadget.speechmarks, count))
+        report('speechmarks_throughput', (time.monotonic() - start) / count, framing=framing, directives=count)
+    finally:
+        gadget.transport.stop_server()
+        transport_thread.join()
+
+
+def main():
+    with gadget_config() as gadget_config_path:
+        for transport_mode in (LOOPBACK_BLE, LOOPBACK_BT):
+            run(transport_mode, gadget_config_path)
+
+
+if __name__ == '__main__':
+    main()
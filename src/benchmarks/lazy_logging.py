@@ -0,0 +1,81 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+Cost of the debug logging on the directive/event path when the logging level is INFO: the lazy rendering
+against the previous eager one. The lazy calls should cost about as much as not logging at all, the
+benchmark fails if any of them renders its message.
+
+.. code-block:: bash
+
+    python3 -m benchmarks.lazy_logging
+"""
+import logging
+
+from google.protobuf import json_format
+
+import agt.messages_pb2 as proto
+from agt.util import LazyFormat, log_bytes
+from benchmarks import best_time, report
+
+logger = logging.getLogger('benchmarks.lazy_logging')
+
+
+def _eager_log_bytes(payload):
+    """
+    Previous implementation, kept as the baseline of the benchmark
+    """
+    payload = bytearray(payload)
+    printable_list = '[' + ', '.join('0x' + '%02x' % i for i in payload) + ']'
+    logger.debug(printable_list)
+
+
+def _directive():
+    directive = proto.SpeechmarksDirective()
+    directive.header.namespace = 'Alexa.Gadget.SpeechData'
+    directive.header.name = 'Speechmarks'
+    for i in range(8):
+        mark = directive.payload.speechmarksData.add()
+        mark.type = 'VISEME'
+        mark.value = 'p'
+        mark.startOffsetInMilliSeconds = i * 60
+    return directive
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    directive = _directive()
+    # protocol version packet
+    packet = [0xfe, 0x03, 0x03, 0x00, 0x02, 0x00, 0x13, 0x88] + [0x00] * 12
+
+    renders = []
+
+    def counting_message_to_dict(message, **kwargs):
+        renders.append(message)
+        return json_format.MessageToDict(message, **kwargs)
+
+    def lazy_directive():
+        logger.debug('Received directive from Echo device:\033[90m { %s }\033[00m',
+                     LazyFormat(counting_message_to_dict, directive, including_default_value_fields=True))
+
+    def eager_directive():
+        logger.debug('Received directive from Echo device:\033[90m {{ {} }}\033[00m'.format(
+            json_format.MessageToDict(directive, including_default_value_fields=True)))
+
+    report('no_logging', best_time(lambda: None, number=10000))
+    report('lazy_directive_log', best_time(lazy_directive, number=10000), level='INFO')
+    report('eager_directive_log', best_time(eager_directive, number=100), level='INFO')
+    report('log_bytes', best_time(lambda: log_bytes(packet), number=10000), level='INFO')
+    report('eager_log_bytes', best_time(lambda: _eager_log_bytes(packet), number=1000), level='INFO')
+
+    if renders:
+        raise Exception('{} messages were rendered at INFO level'.format(len(renders)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+Overhead of the GadgetMetrics: the update of a counter and of a histogram, and the dispatch of a directive
+and the sending of an event with and without metrics.
+
+.. code-block:: bash
+
+    python3 -m benchmarks.metrics
+"""
+from agt import AlexaGadget, GadgetMetrics
+from agt.alexa_gadget import LOOPBACK_BT, _DIRECTIVE_CLASSES
+from benchmarks import best_time, gadget_config, report
+from benchmarks.directive_dispatch import directive_message
+
+KEY = ('Alexa.Gadget.StateListener', 'StateUpdate')
+
+
+def main():
+    metrics = GadgetMetrics()
+    counter = metrics.directives_received.labels(*KEY)
+    histogram = metrics.handler_seconds.labels(*KEY)
+    report('counter.inc', best_time(counter.inc, number=10000))
+    report('histogram.observe', best_time(lambda: histogram.observe(0.0003), number=10000))
+    report('labels', best_time(lambda: metrics.directives_received.labels(*KEY), number=10000))
+
+    data = directive_message(KEY, _DIRECTIVE_CLASSES[KEY])
+    with gadget_config() as gadget_config_path:
+        for label, gadget_metrics in (('off', None), ('on', GadgetMetrics())):
+            gadget = AlexaGadget(gadget_config_path, transport_mode=LOOPBACK_BT, metrics=gadget_metrics)
+            gadget.register_directive_handler(KEY[0], KEY[1], lambda directive: None)
+            report('_on_bluetooth_data_received', best_time(lambda: gadget._on_bluetooth_data_received(data)),
+                   metrics=label)
+            # not connected, the transport drops the events
+            report('send_custom_event',
+                   best_time(lambda: gadget.send_custom_event('Custom.Benchmark', 'Event', {'color': 'red'})),
+                   metrics=label)
+            if gadget_metrics is not None:
+                report('render', best_time(gadget_metrics.registry.render, number=100), metrics=label)
+
+
+if __name__ == '__main__':
+    main()
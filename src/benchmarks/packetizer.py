@@ -0,0 +1,48 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+Cost of a BLE transaction through Packetizer.serialize and Packetizer.deserialize, at several payload sizes,
+with the default packet size and with the packet size of the smallest ATT MTU.
+
+.. code-block:: bash
+
+    python3 -m benchmarks.packetizer
+"""
+import random
+
+from agt.ble.protocol import AppStreams, Packetizer, ATT_HEADER_SIZE, ATT_MIN_MTU, MTU_SIZE
+from benchmarks import best_time, report
+
+PAYLOAD_SIZES = [16, 512, 4096]
+PACKET_SIZES = [int.from_bytes(MTU_SIZE, byteorder='big'), ATT_MIN_MTU - ATT_HEADER_SIZE]
+
+
+def main():
+    rng = random.Random(0)
+    for packet_size in PACKET_SIZES:
+        for size in PAYLOAD_SIZES:
+            payload = bytes(rng.randrange(256) for _ in range(size))
+            packetizer = Packetizer(MTU_SIZE, zero_copy=True)
+            packetizer.max_payload_size = packet_size
+            packets = [bytes(p) for p in packetizer.serialize(payload, AppStreams.ALEXA_STREAM_ID)]
+
+            def deserialize():
+                for packet in packets:
+                    data = packetizer.deserialize(packet)[0]
+                return data
+
+            if bytes(deserialize()) != payload:
+                raise Exception('Packetizer round trip failed, size={} packet_size={}'.format(size, packet_size))
+            report('Packetizer.serialize', best_time(lambda: packetizer.serialize(payload, AppStreams.ALEXA_STREAM_ID)),
+                   size=size, packet_size=packet_size)
+            report('Packetizer.deserialize', best_time(deserialize), size=size, packet_size=packet_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+Cost of handling captured traffic: the inbound frames of each session of a capture file are replayed as fast
+as possible into a gadget with the loopback transport of the same framing, read on the calling thread.
+
+The capture defaults to one recorded on the fly from a VirtualEcho sending directives shaped like the ones of a
+spoken response, with both framings. A capture from the field can be passed instead, see agt.capture:
+
+.. code-block:: bash
+
+    python3 -m benchmarks.replay [gadget.agtcap]
+"""
+import os
+import sys
+import tempfile
+import threading
+
+from agt import AlexaGadget, CaptureReader, CaptureWriter
+from agt.alexa_gadget import LOOPBACK_BLE, LOOPBACK_BT
+from agt.capture import FRAMING_BLE, replay
+from agt.loopback import VIRTUAL_ECHO_ADDRESS, VirtualEcho, discover_directive, speechmarks_directive, \
+    state_update_directive
+from benchmarks import best_time, gadget_config, report
+
+
+class ReplayGadget(AlexaGadget):
+    """
+    Answers a wakeword state update with a custom event, ignores the other directives
+    """
+
+    def on_alexa_gadget_statelistener_stateupdate(self, directive):
+        self.send_custom_event('Custom.Benchmark', 'Pong', {})
+
+
+def record(path, gadget_config_path):
+    """
+    Records a session for each framing to the capture file
+    """
+    directives = [discover_directive(), state_update_directive('wakeword', 'active')] + \
+        [speechmarks_directive('p t S T f k i r'.split()) for _ in range(20)] + \
+        [state_update_directive('wakeword', 'cleared')]
+    capture = CaptureWriter(path)
+    try:
+        for transport_mode in (LOOPBACK_BLE, LOOPBACK_BT):
+            gadget = ReplayGadget(gadget_config_path, transport_mode=transport_mode, capture=capture)
+            echo = VirtualEcho(gadget.transport)
+            transport_thread = threading.Thread(target=gadget.transport.run, daemon=True)
+            transport_thread.start()
+            try:
+                if not echo.connect():
+                    raise Exception('The gadget did not get ready')
+                echo.play(directives)
+                if not echo.wait_for_events(3):
+                    raise Exception('The gadget did not answer the directives')
+            finally:
+                gadget.transport.stop_server()
+                transport_thread.join()
+    finally:
+        capture.close()
+
+
+def main():
+    with gadget_config() as gadget_config_path:
+        if len(sys.argv) > 1:
+            path = sys.argv[1]
+        else:
+            path = os.path.join(tempfile.mkdtemp(), 'benchmark.agtcap')
+            record(path, gadget_config_path)
+        with CaptureReader(path) as reader:
+            sessions = reader.sessions()
+
+        for i, session in enumerate(sessions):
+            frames = session.inbound()
+            if not frames:
+                continue
+            transport_mode = LOOPBACK_BLE if session.framing == FRAMING_BLE else LOOPBACK_BT
+            gadget = ReplayGadget(gadget_config_path, transport_mode=transport_mode)
+            # connected without running the transport thread, the frames are read on this thread
+            gadget.transport._connected(VIRTUAL_ECHO_ADDRESS)
+            seconds = best_time(lambda: replay(frames, gadget.transport._data_received, speed=None), number=20)
+            report('replay', seconds / len(frames), session=i, framing=session.framing, frames=len(frames))
+
+
+if __name__ == '__main__':
+    main()
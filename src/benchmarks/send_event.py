@@ -0,0 +1,59 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+Cost of AlexaGadget.send_custom_event with a small and a large JSON payload, down to the packets handed to the
+transport, with the BLE and the Classic Bluetooth framings.
+
+Runs without BlueZ, dbus or GLib, over the loopback transport:
+
+.. code-block:: bash
+
+    python3 -m benchmarks.send_event
+"""
+import threading
+import time
+
+from agt import AlexaGadget
+from agt.alexa_gadget import LOOPBACK_BLE, LOOPBACK_BT
+from agt.loopback import VIRTUAL_ECHO_ADDRESS
+from benchmarks import best_time, gadget_config, report
+
+PAYLOADS = {
+    'small': {'color': 'red'},
+    # close to the 5000 bytes maximum BLE transaction, once serialized with the event header
+    'large': {'speechmarks': [{'type': 'VISEME', 'value': 'p', 'startOffsetInMilliSeconds': i * 60}
+                              for i in range(70)]},
+}
+
+
+def main():
+    with gadget_config() as gadget_config_path:
+        for transport_mode in (LOOPBACK_BLE, LOOPBACK_BT):
+            gadget = AlexaGadget(gadget_config_path, transport_mode=transport_mode)
+            transport_thread = threading.Thread(target=gadget.transport.run, daemon=True)
+            transport_thread.start()
+            try:
+                # no VirtualEcho attached, the packets are dropped once framed
+                gadget.transport.echo_connect(VIRTUAL_ECHO_ADDRESS)
+                deadline = time.monotonic() + 5
+                while not gadget.is_connected():
+                    if time.monotonic() > deadline:
+                        raise Exception('The loopback transport did not connect')
+                    time.sleep(0.001)
+                for size, payload in PAYLOADS.items():
+                    report('send_custom_event',
+                           best_time(lambda: gadget.send_custom_event('Custom.Benchmark', 'Event', payload)),
+                           payload=size, framing=gadget.transport.framing)
+            finally:
+                gadget.transport.stop_server()
+                transport_thread.join()
+
+
+if __name__ == '__main__':
+    main()
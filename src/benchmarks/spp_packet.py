@@ -0,0 +1,81 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+Cost of building an SPP packet with SPPPacket.get, and of parsing it back with SPPParser.parse, for payloads
+where 0%, 1% and 50% of the bytes are reserved characters (STX, ETX, ESC) that need to be escaped. The
+packet is parsed at once, and split in chunks of CHUNK_SIZE bytes as read from the RFCOMM socket.
+
+.. code-block:: bash
+
+    python3 -m benchmarks.spp_packet
+"""
+import random
+
+from agt.bt_classic.spp import SPPPacket, SPPParser, RESERVED, CMD, ERR, ESC, ETX
+from benchmarks import best_time, report
+
+PAYLOAD_SIZES = [64, 1024, 4096]
+RESERVED_RATIOS = [0, 0.01, 0.5]
+CHUNK_SIZE = 1024
+
+
+def make_payload(size, reserved_ratio, seed=0):
+    """
+    Returns a payload of the given size where reserved_ratio of the bytes are reserved characters
+    """
+    rng = random.Random(seed)
+    payload = bytearray(rng.randrange(0xF0) for _ in range(size))
+    for i in rng.sample(range(size), int(size * reserved_ratio)):
+        payload[i] = rng.choice(RESERVED)
+    return bytes(payload)
+
+
+def _per_byte_get(packet):
+    """
+    Previous implementation of SPPPacket.get, kept as the baseline of the benchmark
+    """
+    header = packet._get_header()
+    packet.command_id = CMD
+    packet.error_id = ERR
+    checksum = packet._calc_checksum()
+    payload_to_escape = bytearray(packet.payload) + bytearray([checksum >> 8, checksum & 0xFF])
+    payload_escaped = bytearray()
+    for b in payload_to_escape:
+        if b in RESERVED:
+            payload_escaped.append(ESC)
+            payload_escaped.append(ESC ^ b)
+        else:
+            payload_escaped.append(b)
+    payload_escaped.append(ETX)
+
+    return header + payload_escaped
+
+
+def _parse_chunks(chunks):
+    parser = SPPParser(lambda payload: None)
+    for chunk in chunks:
+        parser.parse(chunk)
+
+
+def main():
+    for size in PAYLOAD_SIZES:
+        for ratio in RESERVED_RATIOS:
+            packet = SPPPacket()
+            packet.payload = make_payload(size, ratio)
+            report('SPPPacket.get', best_time(packet.get), size=size, reserved=ratio)
+            report('per_byte_get', best_time(lambda: _per_byte_get(packet), number=100), size=size, reserved=ratio)
+            data = bytes(packet.get())
+            parser = SPPParser(lambda payload: None)
+            report('SPPParser.parse', best_time(lambda: parser.parse(data)), size=size, reserved=ratio)
+            chunks = [data[pos:pos + CHUNK_SIZE] for pos in range(0, len(data), CHUNK_SIZE)]
+            report('SPPParser.parse_chunked', best_time(lambda: _parse_chunks(chunks)), size=size, reserved=ratio)
+
+
+if __name__ == '__main__':
+    main()
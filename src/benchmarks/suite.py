@@ -0,0 +1,137 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+Runs the benchmarks, stores the results as JSON and compares them with the results of a previous run.
+
+The benchmarks whose dependencies are not installed (dbus-python, PyGObject) are skipped. The ones which need
+a Bluetooth controller only run when named.
+
+.. code-block:: bash
+
+    # results of the current tree
+    python3 -m benchmarks.suite --output baseline.json
+
+    # after a change, exits with 1 if a benchmark got more than 10% slower
+    python3 -m benchmarks.suite --compare baseline.json --threshold 0.1
+
+    # only some of the benchmarks
+    python3 -m benchmarks.suite packetizer directive_dispatch
+"""
+import argparse
+import datetime
+import importlib
+import json
+import platform
+import sys
+
+from google.protobuf.internal import api_implementation
+
+from benchmarks import collect
+
+BENCHMARKS = [
+    'packetizer',
+    'spp_packet',
+    'dbus_array',
+    'directive_decode',
+    'directive_dispatch',
+    'send_event',
+    'lazy_logging',
+    'metrics',
+    'tracing',
+    'replay',
+    'ble_reconnect',
+    'end_to_end',
+]
+
+
+def run(names):
+    """
+    Runs the benchmarks, returns their results and the names of the ones skipped.
+    """
+    results = []
+    skipped = []
+    argv = sys.argv
+    for name in names:
+        try:
+            module = importlib.import_module('benchmarks.' + name)
+        except ImportError as e:
+            print('{}: skipped, {}'.format(name, e))
+            skipped.append(name)
+            continue
+        print('{}:'.format(name))
+        # the benchmarks read their own command line arguments
+        sys.argv = [module.__file__]
+        try:
+            for result in collect(module.main):
+                result['benchmark'] = name
+                results.append(result)
+        finally:
+            sys.argv = argv
+    return results, skipped
+
+
+def _key(result):
+    return result['benchmark'], result['name'], tuple(sorted((k, str(v)) for k, v in result['params'].items()))
+
+
+def compare(baseline, results, threshold):
+    """
+    Prints the ratio of each result to the baseline, returns the number of results slower by more than threshold.
+    """
+    baseline = {_key(result): result['seconds'] for result in baseline['results']}
+    regressions = 0
+    print('\n{:<64} {:>12} {:>12} {:>8}'.format('benchmark', 'baseline', 'current', 'ratio'))
+    for result in results:
+        key = _key(result)
+        if key not in baseline:
+            continue
+        ratio = result['seconds'] / baseline[key] if baseline[key] else float('inf')
+        regressed = ratio > 1 + threshold
+        regressions += regressed
+        label = ' '.join([key[0], key[1]] + ['{}={}'.format(k, v) for k, v in key[2]])
+        print('{:<64} {:>9.2f} us {:>9.2f} us {:>7.2f}x{}'.format(
+            label, baseline[key] * 1e6, result['seconds'] * 1e6, ratio, ' REGRESSION' if regressed else ''))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs the agt benchmarks.')
+    parser.add_argument('benchmarks', nargs='*', default=BENCHMARKS, help='benchmarks to run, all by default')
+    parser.add_argument('--output', help='file to write the results to, as JSON')
+    parser.add_argument('--compare', help='results of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown over which a result is a regression, 0.1 by default')
+    args = parser.parse_args()
+
+    results, skipped = run(args.benchmarks)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({
+                'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'protobuf': api_implementation.Type(),
+                'platform': platform.platform(),
+                'skipped': skipped,
+                'results': results,
+            }, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get('protobuf') != api_implementation.Type():
+            print('\nThe baseline ran with the {} protobuf implementation, this run with {}'.format(
+                baseline.get('protobuf'), api_implementation.Type()))
+        regressions = compare(baseline, results, args.threshold)
+        if regressions:
+            print('\n{} regression(s) over {:.0%}'.format(regressions, args.threshold))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+Overhead of the Tracer on a directive read by the loopback transport with the BLE framing: without a tracer,
+with none of the packets sampled, and with all of them sampled.
+
+.. code-block:: bash
+
+    python3 -m benchmarks.tracing
+"""
+import agt.messages_pb2 as proto
+from agt import AlexaGadget, Tracer
+from agt.alexa_gadget import LOOPBACK_BLE
+from agt.ble.protocol import AppStreams, Packetizer, MTU_SIZE
+from agt.loopback import VIRTUAL_ECHO_ADDRESS, state_update_directive
+from benchmarks import best_time, gadget_config, report
+
+
+def main():
+    message = proto.Message()
+    message.payload = state_update_directive('wakeword', 'active').SerializeToString()
+    packets = [bytes(p) for p in Packetizer(MTU_SIZE).serialize(message.SerializeToString(),
+                                                                 AppStreams.ALEXA_STREAM_ID)]
+    with gadget_config() as gadget_config_path:
+        for label, tracer in (('none', None), ('unsampled', Tracer(sample_rate=0)), ('sampled', Tracer())):
+            gadget = AlexaGadget(gadget_config_path, transport_mode=LOOPBACK_BLE, tracer=tracer)
+            gadget.register_directive_handler('Alexa.Gadget.StateListener', 'StateUpdate', lambda directive: None)
+            transport = gadget.transport
+            # connected without running the transport thread, the packets are read on this thread
+            transport._connected(VIRTUAL_ECHO_ADDRESS)
+
+            def read():
+                for packet in packets:
+                    transport._data_received(packet)
+
+            report('loopback read', best_time(read), tracer=label)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,7 +12,7 @@ import time
 
 from gpiozero import AngularServo
 
-from agt import AlexaGadget
+from agt import AlexaGadget, DirectiveExecutor
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -25,10 +25,13 @@ class NotificationGadget(AlexaGadget):
     """
     An Alexa Gadget that rotates a servo to raise and lower a flag when a
     notification is received or cleared on a paired Echo device
+
+    The servo takes a second to move, the directives are handled off the Bluetooth
+    thread, one at a time and in order.
     """
 
     def __init__(self):
-        super().__init__()
+        super().__init__(directive_executor=DirectiveExecutor(max_workers=1))
 
     def on_notifications_setindicator(self, directive):
         logger.info('Notification set - set servo to 0 degrees')
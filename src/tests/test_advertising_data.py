@@ -0,0 +1,53 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+Local name of the advertising data and extended inquiry response.
+"""
+import logging
+
+from agt import advertising_data
+from agt.advertising_data import AdvertisingData, AD_TYPE_COMPLETE_LOCAL_NAME, AD_TYPE_SHORTENED_LOCAL_NAME
+
+
+def _structures(data):
+    structures = []
+    pos = 0
+    while pos < len(data):
+        length = data[pos]
+        structures.append((data[pos + 1], data[pos + 2:pos + 1 + length]))
+        pos += 1 + length
+    return structures
+
+
+def test_name_that_fits_is_complete():
+    data = advertising_data.ble_scan_resp_data('Gadget')
+    assert _structures(data) == [(AD_TYPE_COMPLETE_LOCAL_NAME, b'Gadget')]
+
+
+def test_long_name_is_shortened(caplog):
+    name = 'My Alexa Gadget with a very long friendly name'
+    with caplog.at_level(logging.WARNING):
+        data = advertising_data.ble_scan_resp_data(name)
+    assert len(data) == advertising_data.ADV_DATA_SIZE
+    assert _structures(data) == [(AD_TYPE_SHORTENED_LOCAL_NAME, name.encode('utf-8')[:29])]
+    assert 'shortened' in caplog.text
+
+
+def test_name_is_shortened_on_a_character_boundary():
+    data = AdvertisingData().add_flags(0x06).add_local_name('é' * 20).build()
+    # 26 bytes left for the name, 13 two byte characters
+    assert _structures(data)[1] == (AD_TYPE_SHORTENED_LOCAL_NAME, ('é' * 13).encode('utf-8'))
+
+
+def test_long_name_is_shortened_in_eir():
+    data = advertising_data.classic_eir('x' * 248, '0000', '0000')
+    assert len(data) == advertising_data.EIR_SIZE
+    ad_type, name = _structures(data)[-1]
+    assert ad_type == AD_TYPE_SHORTENED_LOCAL_NAME
+    assert name == b'x' * len(name)
@@ -0,0 +1,92 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+AsyncAlexaGadget on the loopback transport, with GLib and gbulb installed or not.
+"""
+import asyncio
+import types
+
+import pytest
+
+from agt import async_alexa_gadget
+from agt.alexa_gadget import LOOPBACK_BLE, LOOPBACK_BT
+from agt.async_alexa_gadget import AsyncAlexaGadget
+from agt.loopback import VirtualEcho
+from benchmarks import gadget_config
+
+
+class FakeGLib:
+    """
+    GLib installed but no GLib main loop running: idle callbacks never run
+    """
+    PRIORITY_DEFAULT = 0
+
+    def __init__(self):
+        self.idle = []
+
+    def idle_add(self, callback, *args, priority=None):
+        self.idle.append(callback)
+        return len(self.idle)
+
+
+class Gadget(AsyncAlexaGadget):
+
+    def __init__(self, gadget_config_path, transport_mode):
+        super().__init__(gadget_config_path, transport_mode=transport_mode)
+        self.connected = asyncio.Event()
+
+    def on_connected(self, device_addr):
+        self.connected.set()
+
+
+def _run(transport_mode, test):
+    with gadget_config() as config_path:
+        gadget = Gadget(config_path, transport_mode)
+
+    async def main():
+        gadget.start()
+        run = asyncio.ensure_future(gadget.run())
+        try:
+            echo = VirtualEcho(gadget.transport)
+            await asyncio.get_event_loop().run_in_executor(None, echo.connect)
+            await asyncio.wait_for(gadget.connected.wait(), 5)
+            await test(gadget, echo)
+        finally:
+            gadget.stop()
+            await asyncio.wait_for(run, 5)
+
+    asyncio.run(main())
+
+
+async def _send_custom_event(gadget, echo):
+    sent = await asyncio.wait_for(gadget.send_custom_event('Custom.Test', 'Event', {'value': 1}), 5)
+    assert sent is not False
+    assert echo.wait_for_events(1)
+    assert echo.events[-1][1].header.namespace == 'Custom.Test'
+
+
+@pytest.mark.parametrize('transport_mode', [LOOPBACK_BLE, LOOPBACK_BT])
+def test_send_without_glib(monkeypatch, transport_mode):
+    monkeypatch.setattr(async_alexa_gadget, 'GLib', None)
+    _run(transport_mode, _send_custom_event)
+
+
+@pytest.mark.parametrize('transport_mode', [LOOPBACK_BLE, LOOPBACK_BT])
+def test_send_does_not_wait_for_glib_with_loopback(monkeypatch, transport_mode):
+    glib = FakeGLib()
+    monkeypatch.setattr(async_alexa_gadget, 'GLib', glib)
+    _run(transport_mode, _send_custom_event)
+    assert glib.idle == []
+
+
+def test_loopback_transport_runs_with_gbulb(monkeypatch):
+    # every asyncio loop passes for a gbulb GLib loop
+    monkeypatch.setattr(async_alexa_gadget, 'GLib', FakeGLib())
+    monkeypatch.setattr(async_alexa_gadget, 'gbulb', types.SimpleNamespace(GLibEventLoop=asyncio.AbstractEventLoop))
+    _run(LOOPBACK_BLE, _send_custom_event)
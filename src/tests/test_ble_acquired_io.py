@@ -0,0 +1,123 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+The AcquireWrite/AcquireNotify sockets of the GATT characteristics, with the remote end of the socket pair
+standing in for BlueZ and the GLib watches and idle callbacks run by hand.
+"""
+import pytest
+
+pytest.importorskip('dbus')
+
+from agt.ble import adapter
+from agt.ble.protocol import AppStreams, BLEProtocol, Packetizer, MTU_SIZE, PROTOCOL_VERSION_PACKET_PREFIX
+
+# Ack requested bit of the second byte of a BLE packet header
+_ACK_BIT = 0x02
+
+
+class FakeGLib:
+    PRIORITY_DEFAULT = 0
+    IO_IN = 1
+    IO_ERR = 8
+    IO_HUP = 16
+
+    def __init__(self):
+        self.watches = {}
+        self.idle = []
+        self._next_id = 1
+
+    def io_add_watch(self, fd, priority, condition, callback):
+        watch = self._next_id
+        self._next_id += 1
+        self.watches[watch] = (fd, callback)
+        return watch
+
+    def source_remove(self, watch):
+        self.watches.pop(watch, None)
+
+    def idle_add(self, callback, *args, **kwargs):
+        self.idle.append(callback)
+
+    def run_idle(self):
+        callbacks, self.idle = self.idle, []
+        for callback in callbacks:
+            callback()
+
+    def dispatch(self, sock):
+        """
+        Calls the watch of the socket, as GLib does when it is readable or closed
+        """
+        for watch, (fd, callback) in list(self.watches.items()):
+            if fd == sock.fileno() and not callback(fd, self.IO_IN):
+                self.watches.pop(watch, None)
+
+
+@pytest.fixture
+def glib(monkeypatch):
+    glib = FakeGLib()
+    monkeypatch.setattr(adapter, 'GLib', glib)
+    # hand the remote end of the socket pair to the test instead of BlueZ
+    monkeypatch.setattr(adapter, '_unix_fd', lambda sock: sock)
+    return glib
+
+
+@pytest.fixture
+def service(glib):
+    received = []
+    characteristics = {}
+    protocol = BLEProtocol('ENDPOINT', 'Gadget', 'DEVICE_TYPE', received.append,
+                           lambda payload: characteristics['rx'].notify_rx_value(payload))
+    service = adapter.AlexaGadgetService(None, 0, protocol)
+    characteristics['rx'] = service.getRxChar()
+    service.received = received
+    return service
+
+
+def test_acquire_notify_sends_protocol_version_packet(glib, service):
+    notify_remote, mtu = service.getRxChar().AcquireNotify({'mtu': 185})
+    assert mtu == 185
+    glib.run_idle()
+
+    packet = notify_remote.recv(512)
+    assert packet[:4] == bytes(PROTOCOL_VERSION_PACKET_PREFIX)
+    assert int.from_bytes(packet[4:6], byteorder='big') == 185 - 3
+    assert len(packet) == 20
+
+
+def test_acquire_write_delivers_directive_and_acks(glib, service):
+    notify_remote, _ = service.getRxChar().AcquireNotify({'mtu': 23})
+    glib.run_idle()
+    notify_remote.recv(512)
+    write_remote, _ = service.getTxChar().AcquireWrite({'mtu': 23})
+    write_socket = service.getTxChar()._write_socket
+
+    message = bytes(range(256)) * 2
+    packetizer = Packetizer(MTU_SIZE)
+    packetizer.max_payload_size = 20
+    packets = [bytearray(p) for p in packetizer.serialize(message, AppStreams.ALEXA_STREAM_ID)]
+    packets[-1][1] |= _ACK_BIT
+    for packet in packets:
+        write_remote.send(packet)
+    glib.dispatch(write_socket._sock)
+
+    assert [bytes(data) for data in service.received] == [message]
+    ack = notify_remote.recv(512)
+    assert ack[0] >> 4 == AppStreams.ALEXA_STREAM_ID
+    assert len(ack) == 6
+
+
+def test_write_socket_released_when_bluez_closes_it(glib, service):
+    tx = service.getTxChar()
+    write_remote, _ = tx.AcquireWrite({})
+    write_socket = tx._write_socket
+    write_remote.close()
+    glib.dispatch(write_socket._sock)
+
+    assert tx._write_socket is None
+    assert not glib.watches
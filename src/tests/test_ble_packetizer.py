@@ -0,0 +1,153 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+Packetizer reassembling the transactions sent by the Echo device.
+"""
+import logging
+import time
+
+from agt.ble.protocol import AppStreams, Packetizer
+
+# 13 bytes of payload per packet
+PACKET_SIZE = [0x00, 20]
+
+
+def _packets(payload, transaction_id=0, stream_id=AppStreams.ALEXA_STREAM_ID):
+    sender = Packetizer(PACKET_SIZE)
+    sender.transaction_id = transaction_id
+    return [bytes(packet) for packet in sender.serialize(payload, stream_id)]
+
+
+def _feed(packetizer, packets):
+    """
+    Returns the transactions completed by the packets, as (payload, stream id, transaction id)
+    """
+    completed = []
+    for packet in packets:
+        data, stream_id, _, tx_id = packetizer.deserialize(packet)
+        if data is not None:
+            completed.append((bytes(data), stream_id, tx_id))
+    return completed
+
+
+def test_single_packet_transaction():
+    packetizer = Packetizer(PACKET_SIZE)
+    assert _feed(packetizer, _packets(b'hello')) == [(b'hello', AppStreams.ALEXA_STREAM_ID, 0)]
+
+
+def test_fragmented_transaction():
+    payload = bytes(range(100))
+    packets = _packets(payload)
+    assert len(packets) == 8
+    packetizer = Packetizer(PACKET_SIZE)
+    assert _feed(packetizer, packets) == [(payload, AppStreams.ALEXA_STREAM_ID, 0)]
+    assert packetizer._in_flight_size == 0
+
+
+def test_zero_copy_reassembly():
+    payload = bytes(range(100))
+    assert _feed(Packetizer(PACKET_SIZE, zero_copy=True), _packets(payload)) == \
+        [(payload, AppStreams.ALEXA_STREAM_ID, 0)]
+
+
+def test_interleaved_transactions():
+    first = bytes(range(60))
+    second = bytes(range(100, 160))
+    control = bytes(range(180, 240))
+    packets = [_packets(first, 1), _packets(second, 2), _packets(control, 1, AppStreams.CONTROL_STREAM_ID)]
+    interleaved = [packet for group in zip(*packets) for packet in group]
+    assert len(interleaved) == 3 * len(packets[0])
+
+    packetizer = Packetizer(PACKET_SIZE)
+    assert _feed(packetizer, interleaved) == [
+        (first, AppStreams.ALEXA_STREAM_ID, 1),
+        (second, AppStreams.ALEXA_STREAM_ID, 2),
+        (control, AppStreams.CONTROL_STREAM_ID, 1),
+    ]
+    assert packetizer.dropped_transactions == 0
+
+
+def test_sequence_gap_drops_the_transaction(caplog):
+    packets = _packets(bytes(range(100)))
+    packetizer = Packetizer(PACKET_SIZE)
+    with caplog.at_level(logging.WARNING):
+        assert _feed(packetizer, packets[:2] + packets[3:]) == []
+    assert packetizer.dropped_transactions == 1
+    assert packetizer._in_flight_size == 0
+    # the gap is logged, not each of the packets left
+    assert len(caplog.records) == 1
+    assert 'expected sequence 2, got 3' in caplog.text
+
+    # the next transaction with the same id is reassembled
+    caplog.clear()
+    with caplog.at_level(logging.WARNING):
+        assert _feed(packetizer, _packets(b'next' * 10)) == [(b'next' * 10, AppStreams.ALEXA_STREAM_ID, 0)]
+    assert caplog.records == []
+
+
+def test_packets_of_an_unknown_transaction_are_dropped(caplog):
+    packetizer = Packetizer(PACKET_SIZE)
+    with caplog.at_level(logging.WARNING):
+        assert _feed(packetizer, _packets(bytes(100))[1:]) == []
+    assert 'unknown transaction' in caplog.text
+
+
+def test_new_first_packet_replaces_an_unfinished_transaction():
+    packetizer = Packetizer(PACKET_SIZE)
+    payload = bytes(range(50))
+    assert _feed(packetizer, _packets(bytes(100))[:3] + _packets(payload)) == \
+        [(payload, AppStreams.ALEXA_STREAM_ID, 0)]
+    assert packetizer.dropped_transactions == 1
+    assert packetizer._in_flight_size == 0
+
+
+def test_in_flight_limit():
+    packetizer = Packetizer(PACKET_SIZE, max_in_flight_size=150)
+    first = _packets(bytes(100), 1)
+    second = _packets(bytes(100), 2)
+    small = _packets(bytes(40), 3)
+    # the second transaction would hold 200 bytes
+    assert _feed(packetizer, [first[0], second[0], small[0]]) == []
+    assert packetizer.dropped_transactions == 1
+    assert packetizer._in_flight_size == 140
+
+    assert _feed(packetizer, first[1:] + second[1:] + small[1:]) == [
+        (bytes(100), AppStreams.ALEXA_STREAM_ID, 1),
+        (bytes(40), AppStreams.ALEXA_STREAM_ID, 3),
+    ]
+    assert packetizer.dropped_transactions == 1
+    assert packetizer._in_flight_size == 0
+
+
+def test_transaction_timeout():
+    packetizer = Packetizer(PACKET_SIZE, transaction_timeout=0.01)
+    packets = _packets(bytes(range(100)))
+    assert _feed(packetizer, packets[:2]) == []
+    time.sleep(0.02)
+    assert _feed(packetizer, packets[2:]) == []
+    assert packetizer.dropped_transactions == 1
+    assert packetizer._in_flight_size == 0
+
+
+def test_timed_out_transactions_free_their_space():
+    packetizer = Packetizer(PACKET_SIZE, max_in_flight_size=150, transaction_timeout=0.01)
+    assert _feed(packetizer, _packets(bytes(100), 1)[:1]) == []
+    time.sleep(0.02)
+    # starting a transaction expires the ones timed out
+    payload = bytes(range(100))
+    assert _feed(packetizer, _packets(payload, 2)) == [(payload, AppStreams.ALEXA_STREAM_ID, 2)]
+    assert packetizer.dropped_transactions == 1
+    assert packetizer._transactions == {}
+
+
+def test_truncated_packets_are_dropped():
+    packetizer = Packetizer(PACKET_SIZE)
+    packets = _packets(bytes(range(100)))
+    assert _feed(packetizer, [packets[0][:3], packets[0][:-1], b'\x60']) == []
+    assert packetizer.dropped_transactions == 3
@@ -0,0 +1,106 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+BLEProtocol sizing its packets to the ATT MTU of the connection.
+"""
+import pytest
+
+from agt.ble.protocol import AppStreams, BLEProtocol, Packetizer, ATT_HEADER_SIZE, MTU_SIZE, \
+    PROTOCOL_VERSION_PACKET_PREFIX
+
+DEFAULT_MTU = int.from_bytes(MTU_SIZE, byteorder='big')
+
+
+@pytest.fixture
+def sent():
+    return []
+
+
+@pytest.fixture
+def protocol(sent):
+    return BLEProtocol('AGT0123456789', 'Gadget', 'AMAZONID', lambda data: None, sent.append)
+
+
+def _announced_mtu(packet):
+    assert packet[:4] == bytes(PROTOCOL_VERSION_PACKET_PREFIX)
+    return int.from_bytes(packet[4:6], byteorder='big')
+
+
+def test_packets_are_sized_to_att_mtu(protocol, sent):
+    protocol.set_mtu(185)
+    assert protocol.get_mtu() == 185 - ATT_HEADER_SIZE
+    protocol.send_data(bytes(range(256)) * 4)
+    assert len(sent) > 1
+    assert all(len(packet) <= 185 - ATT_HEADER_SIZE for packet in sent)
+
+    # the packets reassemble to the data sent
+    packetizer = Packetizer(MTU_SIZE)
+    for packet in sent:
+        data, stream_id, _, _ = packetizer.deserialize(bytes(packet))
+    assert data == bytes(range(256)) * 4
+    assert stream_id == AppStreams.ALEXA_STREAM_ID
+
+
+def test_packet_size_is_capped_to_the_default(protocol):
+    protocol.set_mtu(1024)
+    assert protocol.get_mtu() == DEFAULT_MTU
+    assert protocol.get_stats()['att_mtu'] == 1024
+
+
+def test_invalid_mtu_is_ignored(protocol):
+    protocol.set_mtu(185)
+    protocol.set_mtu(22)
+    assert protocol.get_mtu() == 185 - ATT_HEADER_SIZE
+    assert protocol.get_stats()['att_mtu'] == 185
+
+
+def test_connection_closed_resets_mtu_and_stats(protocol, sent):
+    protocol.set_mtu(23)
+    protocol.send_data(bytes(100))
+    assert protocol.get_stats()['fragmented_transactions_sent'] == 1
+
+    protocol.connection_closed()
+    assert protocol.get_mtu() == DEFAULT_MTU
+    assert protocol.get_stats() == {
+        'att_mtu': None,
+        'packet_size': DEFAULT_MTU,
+        'transactions_sent': 0,
+        'packets_sent': 0,
+        'fragmented_transactions_sent': 0,
+        'dropped_transactions': 0,
+    }
+
+
+def test_protocol_version_packet_reports_known_mtu(protocol, sent):
+    # AcquireNotify reports the MTU before the packet is sent
+    protocol.set_mtu(185)
+    protocol.gadget_ready()
+    assert len(sent) == 1
+    assert len(sent[0]) == 20
+    assert _announced_mtu(sent[0]) == 185 - ATT_HEADER_SIZE
+
+
+def test_protocol_version_packet_is_updated_when_mtu_is_known_late(protocol, sent):
+    # StartNotify sends the packet before the first WriteValue reports the MTU
+    protocol.gadget_ready()
+    assert _announced_mtu(sent[-1]) == DEFAULT_MTU
+    protocol.set_mtu(185)
+    assert len(sent) == 2
+    assert _announced_mtu(sent[-1]) == 185 - ATT_HEADER_SIZE
+
+    # every write reports the same MTU
+    protocol.set_mtu(185)
+    assert len(sent) == 2
+
+
+def test_protocol_version_packet_is_not_repeated_on_a_new_connection(protocol, sent):
+    protocol.gadget_ready()
+    protocol.connection_closed()
+    protocol.set_mtu(185)
+    assert len(sent) == 1
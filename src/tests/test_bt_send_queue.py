@@ -0,0 +1,116 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+Send queue of the RFCOMM server, drained by partial writes to the socket.
+"""
+import pytest
+
+pytest.importorskip('dbus')
+pytest.importorskip('gi')
+pytest.importorskip('bluetooth')
+
+from agt.bt_classic import adapter
+from agt.bt_classic.adapter import _RFCOMMServer, _SendQueue
+
+
+def test_partial_writes_advance_the_head():
+    queue = _SendQueue()
+    queue.put(b'abcdef')
+    queue.put(bytearray(b'gh'))
+    assert len(queue) == 8
+
+    assert bytes(queue.peek()) == b'abcdef'
+    queue.consume(4)
+    assert bytes(queue.peek()) == b'ef'
+    queue.consume(2)
+    assert bytes(queue.peek()) == b'gh'
+    queue.consume(2)
+    assert queue.peek() is None
+    assert len(queue) == 0
+    assert (queue.queued_bytes, queue.sent_bytes, queue.dropped_bytes) == (8, 8, 0)
+
+
+def test_data_is_queued_without_a_copy():
+    queue = _SendQueue()
+    data = bytearray(b'packet')
+    queue.put(data)
+    assert queue.peek().obj is data
+
+
+def test_data_past_the_high_water_mark_is_dropped():
+    queue = _SendQueue(high_water_mark=8)
+    assert queue.put(b'123456')
+    # below the mark, queued even if it goes over it
+    assert queue.put(b'7890')
+    assert queue.is_full()
+    assert not queue.put(b'x')
+    assert (len(queue), queue.queued_bytes, queue.dropped_bytes) == (10, 10, 1)
+
+    queue.consume(6)
+    assert not queue.is_full()
+    assert queue.put(b'y')
+    assert (len(queue), queue.queued_bytes, queue.sent_bytes) == (5, 11, 6)
+
+    queue.clear()
+    queue.reset_stats()
+    assert (len(queue), queue.queued_bytes, queue.sent_bytes, queue.dropped_bytes) == (0, 0, 0, 0)
+
+
+class FakeGLib:
+    PRIORITY_DEFAULT = 0
+    IO_OUT = 4
+
+    def __init__(self):
+        self.watches = []
+
+    def io_add_watch(self, fd, priority, condition, callback):
+        self.watches.append(callback)
+        return len(self.watches)
+
+
+class FakeSocket:
+    """
+    Connected RFCOMM socket taking at most max_write bytes per send
+    """
+
+    def __init__(self, max_write):
+        self.max_write = max_write
+        self.written = bytearray()
+
+    def fileno(self):
+        return 0
+
+    def send(self, data):
+        count = min(len(data), self.max_write)
+        self.written += data[:count]
+        return count
+
+
+def test_server_drains_the_queue_with_partial_writes(monkeypatch):
+    glib = FakeGLib()
+    monkeypatch.setattr(adapter, 'GLib', glib)
+    server = _RFCOMMServer(1, None, None, None, high_water_mark=16)
+    server._socket = FakeSocket(max_write=5)
+
+    assert server.send(bytearray(b'0123456789'))
+    assert server.send(bytearray(b'abcdefghij'))
+    # the queue is at its high-water mark
+    assert not server.send(bytearray(b'dropped'))
+    # a single watch until the queue is drained
+    assert len(glib.watches) == 1
+
+    while server._on_writable(0, glib.IO_OUT):
+        pass
+    assert server._socket.written == b'0123456789abcdefghij'
+    stats = server.get_stats()
+    assert stats['send_queue_size'] == 0
+    assert stats['queued_bytes'] == 20
+    assert stats['sent_bytes'] == 20
+    assert stats['dropped_bytes'] == 7
+    assert server._write_watch is None
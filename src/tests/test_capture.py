@@ -0,0 +1,136 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+Capture files written by CaptureWriter and read back by CaptureReader.
+"""
+import logging
+
+import pytest
+
+from agt.capture import CaptureReader, CaptureWriter, FRAMING_BLE, FRAMING_BT, INBOUND, OUTBOUND, MAGIC, replay
+
+
+@pytest.fixture(params=[True, False], ids=['mmap', 'read'])
+def use_mmap(request):
+    return request.param
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'gadget.agtcap')
+
+
+def _write(path, sessions):
+    """
+    Writes sessions given as (framing, [(direction, data)])
+    """
+    writer = CaptureWriter(path)
+    for framing, frames in sessions:
+        writer.start_session(framing)
+        for direction, data in frames:
+            writer.record(direction, data)
+    writer.close()
+
+
+BLE_FRAMES = [(INBOUND, b'\x60\x00\x00\x00\x05\x05hello'), (OUTBOUND, bytearray(b'\x60\x08\x00\x02\x01\x00')),
+              (INBOUND, b''), (OUTBOUND, [0xfe, 0x03, 0x03, 0x00])]
+BT_FRAMES = [(INBOUND, bytes(range(256)) * 4)]
+
+
+def test_sessions_round_trip(path, use_mmap):
+    _write(path, [(FRAMING_BLE, BLE_FRAMES)])
+    # appended as a second session
+    _write(path, [(FRAMING_BT, BT_FRAMES)])
+
+    with CaptureReader(path, use_mmap=use_mmap) as reader:
+        sessions = reader.sessions()
+        assert [session.framing for session in sessions] == [FRAMING_BLE, FRAMING_BT]
+        assert [(frame.direction, bytes(frame.data)) for frame in sessions[0].frames] == \
+            [(direction, bytes(data)) for direction, data in BLE_FRAMES]
+        assert [bytes(frame.data) for frame in sessions[0].inbound()] == [BLE_FRAMES[0][1], b'']
+        assert [bytes(frame.data) for frame in sessions[0].outbound()] == \
+            [bytes(BLE_FRAMES[1][1]), bytes(BLE_FRAMES[3][1])]
+        assert [bytes(frame.data) for frame in sessions[1].frames] == [BT_FRAMES[0][1]]
+
+        times = [frame.time for frame in sessions[0].frames]
+        assert times == sorted(times)
+        assert sessions[0].duration() == times[-1]
+        assert sessions[0].start_time <= sessions[1].start_time
+
+
+def test_truncated_record_ends_the_last_session(path, use_mmap, caplog):
+    _write(path, [(FRAMING_BLE, BLE_FRAMES[:2])])
+    with open(path, 'rb') as f:
+        size = len(f.read())
+    _write(path, [(FRAMING_BLE, [(INBOUND, b'lost frame')])])
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    # cut in the data of the last record, then in its header
+    for end in (len(data) - 3, len(data) - len(b'lost frame') - 2):
+        with open(path, 'wb') as f:
+            f.write(data[:end])
+        caplog.clear()
+        with caplog.at_level(logging.WARNING), CaptureReader(path, use_mmap=use_mmap) as reader:
+            sessions = reader.sessions()
+        assert len(sessions) == 2
+        assert [bytes(frame.data) for frame in sessions[0].frames] == [bytes(data) for _, data in BLE_FRAMES[:2]]
+        assert sessions[1].frames == []
+        assert 'truncated record' in caplog.text
+
+    # a file cut after a complete record reads without a warning
+    with open(path, 'wb') as f:
+        f.write(data[:size])
+    caplog.clear()
+    with caplog.at_level(logging.WARNING), CaptureReader(path, use_mmap=use_mmap) as reader:
+        assert len(reader.sessions()) == 1
+    assert caplog.text == ''
+
+
+def test_not_a_capture_file(path, use_mmap):
+    with open(path, 'wb') as f:
+        f.write(b'not a capture file')
+    with pytest.raises(Exception, match='is not a capture file'):
+        CaptureReader(path, use_mmap=use_mmap)
+    with pytest.raises(Exception, match='is not a capture file'):
+        CaptureWriter(path)
+
+
+def test_empty_capture_file(path, use_mmap):
+    CaptureWriter(path).close()
+    with open(path, 'rb') as f:
+        assert f.read() == MAGIC
+    with CaptureReader(path, use_mmap=use_mmap) as reader:
+        assert reader.sessions() == []
+
+
+def test_frames_recorded_before_a_session_are_ignored(path):
+    writer = CaptureWriter(path)
+    writer.record(INBOUND, b'before')
+    writer.start_session(FRAMING_BT)
+    writer.record(INBOUND, b'after')
+    writer.close()
+    # recording after close is ignored too
+    writer.record(INBOUND, b'closed')
+    with CaptureReader(path) as reader:
+        sessions = reader.sessions()
+    assert [bytes(frame.data) for frame in sessions[0].frames] == [b'after']
+    assert writer.frames == 1
+
+
+def test_replay_feeds_the_frames_of_a_direction(path):
+    _write(path, [(FRAMING_BLE, BLE_FRAMES)])
+    with CaptureReader(path, use_mmap=False) as reader:
+        session = reader.sessions()[0]
+    fed = []
+    assert replay(session.frames, fed.append, speed=None) == 2
+    assert [bytes(data) for data in fed] == [BLE_FRAMES[0][1], b'']
+    fed = []
+    assert replay(session.frames, fed.append, speed=1000, direction=OUTBOUND) == 2
+    assert [bytes(data) for data in fed] == [bytes(BLE_FRAMES[1][1]), bytes(BLE_FRAMES[3][1])]
@@ -0,0 +1,77 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+Dispatch of the directives to the handlers of AlexaGadget, and the dispatch table caching them.
+"""
+import pytest
+
+import agt.messages_pb2 as proto
+from agt.alexa_gadget import AlexaGadget, LOOPBACK_BLE, _DIRECTIVE_CLASSES
+from benchmarks import gadget_config
+from benchmarks.directive_dispatch import directive_message
+
+
+class Gadget(AlexaGadget):
+
+    def __init__(self, gadget_config_path):
+        super().__init__(gadget_config_path, transport_mode=LOOPBACK_BLE)
+        self.handled = []
+
+    def on_alerts_setalert(self, directive):
+        self.handled.append(('method', directive))
+
+
+@pytest.fixture
+def gadget():
+    with gadget_config() as config_path:
+        return Gadget(config_path)
+
+
+SET_ALERT = ('Alerts', 'SetAlert')
+
+
+def _receive_set_alert(gadget):
+    gadget._on_bluetooth_data_received(directive_message(SET_ALERT, _DIRECTIVE_CLASSES[SET_ALERT]))
+    return gadget.handled.pop()
+
+
+def test_directive_is_decoded_into_its_class(gadget):
+    source, directive = _receive_set_alert(gadget)
+    assert source == 'method'
+    assert type(directive) is proto.SetAlertDirective
+
+
+def test_registered_handler_replaces_the_cached_method(gadget):
+    assert _receive_set_alert(gadget)[0] == 'method'
+    gadget.register_directive_handler(*SET_ALERT, lambda directive: gadget.handled.append(('registered', directive)))
+    source, directive = _receive_set_alert(gadget)
+    assert source == 'registered'
+    assert type(directive) is proto.SetAlertDirective
+
+
+def test_unregistered_handler_falls_back_to_the_method(gadget):
+    gadget.register_directive_handler(*SET_ALERT, lambda directive: gadget.handled.append(('registered', directive)))
+    assert _receive_set_alert(gadget)[0] == 'registered'
+    # the registered handler is in the dispatch table
+    assert SET_ALERT in gadget._dispatch_table
+
+    gadget.register_directive_handler(*SET_ALERT, None)
+    assert _receive_set_alert(gadget)[0] == 'method'
+    assert _receive_set_alert(gadget)[0] == 'method'
+
+
+def test_unknown_directive_has_no_handler(gadget):
+    directive = proto.Directive()
+    directive.header.namespace = 'Custom.Test'
+    directive.header.name = 'Ping'
+    message = proto.Message()
+    message.payload = directive.SerializeToString()
+    gadget._on_bluetooth_data_received(message.SerializeToString())
+    assert gadget.handled == []
+    assert gadget._dispatch_table[('Custom.Test', 'Ping')] == (proto.Directive, None)
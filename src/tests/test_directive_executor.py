@@ -0,0 +1,135 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+DirectiveExecutor ordering, queue limit and counters.
+"""
+import threading
+import time
+
+import pytest
+
+from agt.directive_executor import DirectiveExecutor
+
+
+@pytest.fixture
+def executor():
+    executor = DirectiveExecutor(max_workers=4, max_queue_size=8)
+    yield executor
+    executor.shutdown()
+
+
+def _wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.001)
+    return True
+
+
+def test_calls_of_a_namespace_run_in_order_one_at_a_time():
+    executor = DirectiveExecutor(max_workers=4, max_queue_size=1000)
+    lock = threading.Lock()
+    order = {'Alerts': [], 'Notifications': [], 'SpeechSynthesizer': []}
+    running = {namespace: 0 for namespace in order}
+    overlaps = []
+
+    def call(namespace, i):
+        with lock:
+            running[namespace] += 1
+            if running[namespace] > 1:
+                overlaps.append(namespace)
+        time.sleep(0.0005)
+        with lock:
+            order[namespace].append(i)
+            running[namespace] -= 1
+
+    for i in range(50):
+        for namespace in order:
+            assert executor.submit(namespace, call, namespace, i)
+    try:
+        assert _wait_for(lambda: executor.get_stats()['completed'] == 150)
+    finally:
+        executor.shutdown()
+
+    assert overlaps == []
+    for namespace in order:
+        assert order[namespace] == list(range(50))
+
+
+def test_namespaces_run_concurrently(executor):
+    release = threading.Event()
+    started = threading.Event()
+    executor.submit('Alerts', release.wait, 5)
+    executor.submit('Notifications', started.set)
+    # the second namespace runs while the first one is blocked
+    assert started.wait(5)
+    release.set()
+
+
+def test_calls_past_the_queue_size_are_dropped(executor):
+    release = threading.Event()
+    executor.submit('Alerts', release.wait, 5)
+    # the first call is running, it no longer waits in the queue
+    assert _wait_for(lambda: executor.get_stats()['queue_depth'] == 0)
+    results = [executor.submit('Alerts', lambda: None) for _ in range(10)]
+    assert results == [True] * 8 + [False] * 2
+    stats = executor.get_stats()
+    assert stats['queue_depth'] == 8
+    assert stats['max_queue_depth'] == 8
+    assert stats['dropped'] == 2
+
+    release.set()
+    assert _wait_for(lambda: executor.get_stats()['completed'] == 9)
+    assert executor.get_stats()['queue_depth'] == 0
+    assert executor.get_stats()['namespaces_pending'] == 0
+
+
+def test_failed_calls_are_counted_and_do_not_stop_the_namespace(executor):
+    done = threading.Event()
+
+    def fail():
+        raise ValueError('handler failed')
+
+    executor.submit('Alerts', fail)
+    executor.submit('Alerts', fail)
+    executor.submit('Alerts', done.set)
+    assert done.wait(5)
+    assert _wait_for(lambda: executor.get_stats()['completed'] == 1)
+    stats = executor.get_stats()
+    assert stats['failed'] == 2
+    assert stats['submitted'] == 3
+
+
+def test_submit_after_shutdown_drops_the_call():
+    executor = DirectiveExecutor()
+    executor.shutdown()
+    assert executor.submit('Alerts', lambda: None) is False
+    stats = executor.get_stats()
+    assert stats['queue_depth'] == 0
+    assert stats['namespaces_pending'] == 0
+    assert stats['submitted'] == 0
+    assert stats['dropped'] == 1
+    # the queue is not left full
+    assert executor.submit('Alerts', lambda: None) is False
+    assert executor.get_stats()['dropped'] == 2
+    assert executor.get_stats()['queue_depth'] == 0
+
+
+def test_shutdown_drops_the_waiting_calls():
+    executor = DirectiveExecutor(max_workers=1)
+    release = threading.Event()
+    executor.submit('Alerts', release.wait, 5)
+    executor.submit('Alerts', lambda: None)
+    executor.submit('Alerts', lambda: None)
+    executor.shutdown(wait=False)
+    release.set()
+    stats = executor.get_stats()
+    assert stats['dropped'] == 2
+    assert stats['queue_depth'] == 0
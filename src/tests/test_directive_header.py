@@ -0,0 +1,99 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+Namespace and name of a serialized directive read by _peek_directive_header, without parsing it.
+"""
+import pytest
+
+import agt.messages_pb2 as proto
+from agt import alexa_gadget
+from agt.alexa_gadget import _DIRECTIVE_CLASSES, _peek_directive_header, _read_varint
+from benchmarks.directive_dispatch import directive_message
+
+
+@pytest.fixture(params=[True, False], ids=['wire_format', 'protobuf'])
+def peek_wire_format(request, monkeypatch):
+    """
+    Runs a test with both the wire format scan and the generic Directive parse
+    """
+    monkeypatch.setattr(alexa_gadget, '_PEEK_WIRE_FORMAT', request.param)
+    return request.param
+
+
+def _directive_payload(key, proto_class):
+    message = proto.Message()
+    message.ParseFromString(directive_message(key, proto_class))
+    return message.payload
+
+
+def _field(number, value):
+    """
+    Length delimited field
+    """
+    return _varint(number << 3 | 2) + _varint(len(value)) + value
+
+
+def _varint(value):
+    data = bytearray()
+    while value > 0x7F:
+        data.append(value & 0x7F | 0x80)
+        value >>= 7
+    data.append(value)
+    return bytes(data)
+
+
+@pytest.mark.parametrize('key', sorted(_DIRECTIVE_CLASSES), ids='.'.join)
+def test_peek_every_directive(peek_wire_format, key):
+    assert _peek_directive_header(_directive_payload(key, _DIRECTIVE_CLASSES[key])) == key
+
+
+@pytest.mark.parametrize('key', sorted(_DIRECTIVE_CLASSES), ids='.'.join)
+def test_peek_truncated_directive(peek_wire_format, key):
+    payload = _directive_payload(key, _DIRECTIVE_CLASSES[key])
+    header_length, pos = _read_varint(payload, 1)
+    header_end = pos + header_length
+    for end in range(1, len(payload)):
+        header = _peek_directive_header(payload[:end])
+        if end < header_end:
+            # cut in the header
+            assert header is None, end
+        else:
+            # cut in the payload, only read up to a field boundary
+            assert header in (None, key), end
+
+
+def test_peek_fields_in_any_order(peek_wire_format):
+    data = b''.join([
+        # payload before the header, unknown varint, fixed64 and fixed32 fields
+        _field(2, b'\x0a\x03abc'),
+        _varint(15 << 3 | 0) + _varint(300),
+        _varint(16 << 3 | 1) + bytes(8),
+        _varint(17 << 3 | 5) + bytes(4),
+        # name before namespace, and an unknown field in the header
+        _field(1, _field(2, b'SetAlert') + _varint(9 << 3 | 0) + b'\x01' + _field(1, b'Alerts')),
+    ])
+    assert _peek_directive_header(data) == ('Alerts', 'SetAlert')
+
+    # a header found twice is merged, the last value of each field wins
+    data += _field(1, _field(2, b'DeleteAlert'))
+    assert _peek_directive_header(data) == ('Alerts', 'DeleteAlert')
+
+
+def test_peek_invalid_data(peek_wire_format):
+    assert _peek_directive_header(b'\x0a\x05\x0a\x10abc') is None
+    assert _peek_directive_header(b'\xff\xff\xff') is None
+
+
+def test_peek_matches_protobuf_on_every_directive(monkeypatch):
+    for key, proto_class in _DIRECTIVE_CLASSES.items():
+        payload = _directive_payload(key, proto_class)
+        monkeypatch.setattr(alexa_gadget, '_PEEK_WIRE_FORMAT', True)
+        wire_format = _peek_directive_header(payload)
+        monkeypatch.setattr(alexa_gadget, '_PEEK_WIRE_FORMAT', False)
+        assert wire_format == _peek_directive_header(payload)
@@ -0,0 +1,111 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+HCISocket.send_command with a fake socket standing in for the controller.
+"""
+import socket
+import time
+
+import pytest
+
+from agt import hci
+
+
+class FakeSocket:
+    """
+    Returns the events given, then times out like a socket which receives nothing
+    """
+
+    def __init__(self, events):
+        self.events = list(events)
+        self.sent = []
+        self._timeout = None
+
+    def send(self, data):
+        self.sent.append(bytes(data))
+        return len(data)
+
+    def settimeout(self, timeout):
+        self._timeout = timeout
+
+    def recv(self, size):
+        if self.events:
+            return self.events.pop(0)[:size]
+        time.sleep(self._timeout)
+        raise socket.timeout()
+
+    def close(self):
+        pass
+
+
+def _cmd_complete(op, status, result=b''):
+    params = bytes([1]) + op.to_bytes(2, 'little') + bytes([status]) + result
+    return bytes([hci.HCI_EVENT_PKT, hci.EVT_CMD_COMPLETE, len(params)]) + params
+
+
+def _cmd_status(op, status):
+    params = bytes([status, 1]) + op.to_bytes(2, 'little')
+    return bytes([hci.HCI_EVENT_PKT, hci.EVT_CMD_STATUS, len(params)]) + params
+
+
+READ_BD_ADDR = hci.opcode(hci.OGF_INFO_PARAM, hci.OCF_READ_BD_ADDR)
+WRITE_LOCAL_NAME = hci.opcode(hci.OGF_HOST_CTL, hci.OCF_WRITE_LOCAL_NAME)
+
+
+def test_command_is_sent_with_its_header():
+    sock = FakeSocket([_cmd_complete(WRITE_LOCAL_NAME, 0)])
+    hci.HCISocket(sock=sock).send_command(hci.OGF_HOST_CTL, hci.OCF_WRITE_LOCAL_NAME, b'\x01\x02')
+    assert sock.sent == [bytes([hci.HCI_COMMAND_PKT, 0x13, 0x0C, 2, 1, 2])]
+
+
+def test_cmd_complete_is_matched_by_opcode():
+    sock = FakeSocket([
+        _cmd_complete(WRITE_LOCAL_NAME, 0),
+        _cmd_complete(READ_BD_ADDR, 0, bytes([0x00, 0x00, 0x00, 0xEB, 0x27, 0xB8])),
+    ])
+    assert hci.HCISocket(sock=sock).read_bd_addr() == 'B827EB000000'
+    assert sock.events == []
+
+
+def test_events_for_other_opcodes_and_other_packets_are_skipped():
+    sock = FakeSocket([
+        b'\x04\x0e',
+        bytes([hci.HCI_COMMAND_PKT, 0x09, 0x10, 0]),
+        bytes([hci.HCI_EVENT_PKT, 0x05, 4, 0, 0x40, 0, 0x13]),
+        _cmd_status(WRITE_LOCAL_NAME, hci.HCI_COMMAND_DISALLOWED),
+        _cmd_complete(WRITE_LOCAL_NAME, hci.HCI_COMMAND_DISALLOWED),
+        _cmd_status(READ_BD_ADDR, 0),
+        _cmd_complete(READ_BD_ADDR, 0, b'\x01\x02\x03\x04\x05\x06'),
+    ])
+    result = hci.HCISocket(sock=sock).send_command(hci.OGF_INFO_PARAM, hci.OCF_READ_BD_ADDR)
+    assert result == b'\x01\x02\x03\x04\x05\x06'
+
+
+def test_failing_cmd_complete_raises():
+    sock = FakeSocket([_cmd_complete(WRITE_LOCAL_NAME, hci.HCI_COMMAND_DISALLOWED)])
+    with pytest.raises(hci.HCICommandError) as e:
+        hci.HCISocket(sock=sock).write_local_name('Gadget')
+    assert e.value.opcode == WRITE_LOCAL_NAME
+    assert e.value.status == hci.HCI_COMMAND_DISALLOWED
+
+
+def test_failing_cmd_status_raises():
+    sock = FakeSocket([_cmd_status(READ_BD_ADDR, hci.HCI_COMMAND_DISALLOWED)])
+    with pytest.raises(hci.HCICommandError) as e:
+        hci.HCISocket(sock=sock).read_bd_addr()
+    assert e.value.opcode == READ_BD_ADDR
+    assert e.value.status == hci.HCI_COMMAND_DISALLOWED
+
+
+def test_command_times_out():
+    sock = FakeSocket([_cmd_complete(WRITE_LOCAL_NAME, 0), _cmd_status(READ_BD_ADDR, 0)])
+    start = time.monotonic()
+    with pytest.raises(Exception, match='timed out'):
+        hci.HCISocket(sock=sock, timeout=0.05).read_bd_addr()
+    assert 0.05 <= time.monotonic() - start < 1
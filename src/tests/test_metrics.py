@@ -0,0 +1,86 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+GadgetMetrics of a gadget on the loopback transport.
+"""
+import threading
+
+import pytest
+
+from agt import AlexaGadget, GadgetMetrics
+from agt.alexa_gadget import LOOPBACK_BLE
+from agt.loopback import VirtualEcho
+from benchmarks import gadget_config
+
+
+def _samples(metrics):
+    """
+    Returns the samples rendered, by name and labels as written
+    """
+    samples = {}
+    for line in metrics.registry.render().splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+
+@pytest.fixture
+def metrics():
+    return GadgetMetrics()
+
+
+@pytest.fixture
+def gadget(metrics):
+    with gadget_config() as config_path:
+        gadget = AlexaGadget(config_path, transport_mode=LOOPBACK_BLE, metrics=metrics)
+    transport_thread = threading.Thread(target=gadget.transport.run, daemon=True)
+    transport_thread.start()
+    yield gadget
+    gadget.transport.stop_server()
+    transport_thread.join(5)
+
+
+def test_dropped_event_is_not_counted_as_sent(gadget, metrics):
+    # not connected, the transport drops the event
+    gadget.send_custom_event('Custom.Test', 'Event', {})
+    samples = _samples(metrics)
+    assert samples['agt_events_dropped_total{transport="LOOPBACK_BLE"}'] == 1
+    assert 'agt_events_sent_total{namespace="Custom.Test",name="Event"}' not in samples
+
+    echo = VirtualEcho(gadget.transport)
+    assert echo.connect()
+    gadget.send_custom_event('Custom.Test', 'Event', {})
+    assert echo.wait_for_events(1)
+    samples = _samples(metrics)
+    assert samples['agt_events_sent_total{namespace="Custom.Test",name="Event"}'] == 1
+    assert samples['agt_events_dropped_total{transport="LOOPBACK_BLE"}'] == 1
+
+
+def test_discover_response_is_counted_when_sent(gadget, metrics):
+    echo = VirtualEcho(gadget.transport)
+    assert echo.connect()
+    echo.discover()
+    assert echo.wait_for_events(1)
+    samples = _samples(metrics)
+    assert samples['agt_events_sent_total{namespace="Alexa.Discovery",name="Discover.Response"}'] == 1
+
+
+def test_ble_mtu_and_fragmentation(gadget, metrics):
+    echo = VirtualEcho(gadget.transport)
+    assert echo.connect()
+    gadget.transport._protocol.set_mtu(185)
+    gadget.send_custom_event('Custom.Test', 'Event', {'data': 'x' * 400})
+    assert echo.wait_for_events(1)
+    samples = _samples(metrics)
+    assert samples['agt_att_mtu_bytes{transport="LOOPBACK_BLE"}'] == 185
+    assert samples['agt_packet_size_bytes{transport="LOOPBACK_BLE"}'] == 182
+    assert samples['agt_transactions_sent_total{transport="LOOPBACK_BLE"}'] == 1
+    assert samples['agt_fragmented_transactions_sent_total{transport="LOOPBACK_BLE"}'] == 1
+    assert samples['agt_packets_sent_total{transport="LOOPBACK_BLE"}'] == 3
@@ -0,0 +1,177 @@
+#
+# Copyright 2019 Amazon.com, Inc. or its affiliates.  All Rights Reserved.
+# These materials are licensed under the Amazon Software License in connection with the Alexa Gadgets Program.
+# The Agreement is available at https://aws.amazon.com/asl/.
+# See the Agreement for the specific terms and conditions of the Agreement.
+# Capitalized terms not defined in this file have the meanings given to them in the Agreement.
+#
+
+"""
+SPPParser against the previous per-byte parser, on streams of valid, corrupted and truncated packets fed in
+random chunks.
+"""
+import random
+
+import pytest
+
+from agt.bt_classic.spp import SPPPacket, SPPParser, RESERVED, STX, ETX, ESC
+
+
+class _PerByteParser:
+    """
+    Previous implementation of SPPParser, a state machine fed one byte at a time
+    """
+
+    def __init__(self, payload_cb):
+        self._payload_cb = payload_cb
+        self._state = self._state_find_stx
+        self._command_id = None
+        self._error_id = None
+        self._payload = None
+
+    def parse(self, data):
+        for c in data:
+            self._state(c)
+
+    def _start_packet(self):
+        self._payload = bytearray()
+        self._state = self._state_get_command_id
+
+    def _state_find_stx(self, c):
+        if c == STX:
+            self._start_packet()
+
+    def _state_get_command_id(self, c):
+        if c == STX:
+            self._start_packet()
+        else:
+            self._command_id = c
+            self._state = self._state_get_error_id
+
+    def _state_get_error_id(self, c):
+        if c == STX:
+            self._start_packet()
+        else:
+            self._error_id = c
+            self._state = self._state_get_seq_id
+
+    def _state_get_seq_id(self, c):
+        if c == STX:
+            self._start_packet()
+        elif c == ESC:
+            self._state = self._state_get_seq_id_escaped
+        else:
+            self._state = self._state_get_data
+
+    def _state_get_seq_id_escaped(self, c):
+        self._state = self._state_get_data
+
+    def _state_get_data(self, c):
+        if c == STX:
+            self._start_packet()
+        elif c == ESC:
+            self._state = self._state_get_escaped
+        elif c == ETX:
+            payload = self._payload
+            if len(payload) >= 2:
+                found_checksum = payload.pop() + (payload.pop() << 8)
+                if found_checksum == (sum(payload) + self._command_id + self._error_id) & 0xFFFF:
+                    self._payload_cb(payload)
+            self._state = self._state_find_stx
+        else:
+            self._payload.append(c)
+
+    def _state_get_escaped(self, c):
+        self._payload.append(ESC ^ c)
+        self._state = self._state_get_data
+
+
+def _random_payload(rng):
+    size = rng.choice([0, 1, 2, rng.randrange(64), rng.randrange(1024)])
+    reserved_ratio = rng.choice([0, 0.01, 0.5, 1])
+    return bytes(rng.choice(RESERVED) if rng.random() < reserved_ratio else rng.randrange(256) for _ in range(size))
+
+
+def _random_stream(rng):
+    """
+    Returns valid packets mixed with noise, packets with a flipped or dropped byte, and truncated packets
+    """
+    stream = bytearray()
+    for _ in range(rng.randrange(1, 6)):
+        packet = SPPPacket()
+        packet.payload = _random_payload(rng)
+        data = packet.get()
+        mutation = rng.random()
+        if mutation < 0.15:
+            data[rng.randrange(len(data))] = rng.choice(RESERVED + [rng.randrange(256)])
+        elif mutation < 0.25:
+            del data[rng.randrange(len(data))]
+        elif mutation < 0.35:
+            del data[rng.randrange(len(data)):]
+        elif mutation < 0.45:
+            stream += bytes(rng.choice(RESERVED + [rng.randrange(256)]) for _ in range(rng.randrange(8)))
+        stream += data
+    return bytes(stream)
+
+
+def _chunks(rng, data):
+    pos = 0
+    while pos < len(data):
+        size = rng.choice([1, 2, 3, rng.randrange(1, 64), 1024])
+        yield data[pos:pos + size]
+        pos += size
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_matches_per_byte_parser(seed):
+    rng = random.Random(seed)
+    for _ in range(100):
+        stream = _random_stream(rng)
+        expected = []
+        _PerByteParser(lambda payload: expected.append(bytes(payload))).parse(stream)
+        received = []
+        parser = SPPParser(lambda payload: received.append(bytes(payload)))
+        for chunk in _chunks(rng, stream):
+            parser.parse(chunk)
+        assert received == expected, stream.hex()
+
+
+@pytest.mark.parametrize('reserved_ratio', [0, 0.5])
+def test_packet_split_in_chunks(reserved_ratio):
+    rng = random.Random(0)
+    payload = bytes(rng.choice(RESERVED) if rng.random() < reserved_ratio else rng.randrange(0xF0)
+                    for _ in range(4096))
+    packet = SPPPacket()
+    packet.payload = payload
+    data = bytes(packet.get())
+    received = []
+    parser = SPPParser(received.append)
+    for pos in range(0, len(data), 1024):
+        parser.parse(data[pos:pos + 1024])
+    assert received == [payload]
+    # only the bytes received after the end of the packet are kept
+    assert parser._data is None
+
+
+def test_escape_split_from_escaped_character():
+    packet = SPPPacket()
+    packet.payload = bytes([ETX, 1, STX])
+    data = bytes(packet.get())
+    received = []
+    parser = SPPParser(received.append)
+    esc = data.index(ESC, 4)
+    parser.parse(data[:esc + 1])
+    parser.parse(data[esc + 1:])
+    assert received == [bytes([ETX, 1, STX])]
+
+
+def test_checksum_failures_are_counted():
+    packet = SPPPacket()
+    packet.payload = b'\x01\x02\x03'
+    data = bytearray(packet.get())
+    data[4] ^= 0x04
+    received = []
+    parser = SPPParser(received.append)
+    parser.parse(bytes(data) + bytes(packet.get()))
+    assert received == [b'\x01\x02\x03']
+    assert parser.checksum_failures == 1